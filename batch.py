@@ -0,0 +1,169 @@
+# 複数の API 呼び出しを1リクエストにまとめる POST /batch の処理
+# - サブリクエストは ASGI アプリを直接呼び出して (HTTP を経由せずに) asyncio で並行に実行します
+#   ミドルウェア (レスポンスキャッシュ・処理時間の計測など) は通常のリクエストと同じく通ります
+# - 親リクエストの Authorization ヘッダはサブリクエストに引き継ぎます
+#   Accept-Encoding は引き継がず、サブリクエストで指定しても除きます (圧縮されたボディは JSON に埋め込めないため)
+# - 結果はサブリクエストの順に [{"status", "headers", "body"}, ...] で返します
+#   JSON のボディは再度パースせず、そのまま埋め込みます
+# - 全体の制限時間を超えたサブリクエストはキャンセルし、504 とします
+import asyncio
+import json
+import os
+from typing import Any, Dict, List
+from urllib.parse import unquote, urlsplit
+
+from pydantic import BaseModel, Field, validator
+
+# 1回のバッチで受け付けるサブリクエストの数
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+# バッチ全体の制限時間 [秒]
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", "5"))
+BATCH_PATH = "/batch"
+BATCH_METHODS = ("GET", "POST", "PUT", "PATCH", "DELETE")
+# サブリクエストに引き継ぐ親リクエストのヘッダ
+INHERITED_HEADERS = (b"authorization", b"user-agent", b"accept-language")
+# サブリクエストで指定できないヘッダ
+DROPPED_HEADERS = (b"accept-encoding",)
+
+
+class SubRequest(BaseModel):
+    method: str = "GET"
+    path: str = Field(..., description="Path with an optional query string, e.g. `/items/?q=rock`")
+    headers: Dict[str, str] = {}
+    body: Any = None
+
+    @validator("method")
+    def check_method(cls, value):
+        value = value.upper()
+        if value not in BATCH_METHODS:
+            raise ValueError("method must be one of " + ", ".join(BATCH_METHODS))
+        return value
+
+    @validator("path")
+    def check_path(cls, value):
+        if not value.startswith("/") or value.startswith("//"):
+            raise ValueError("path must start with /")
+        if urlsplit(value).path.rstrip("/") == BATCH_PATH:
+            raise ValueError("batch requests can not be nested")
+        return value
+
+
+class BatchIn(BaseModel):
+    requests: List[SubRequest] = Field(..., min_items=1, max_items=BATCH_MAX_REQUESTS)
+
+
+def _error(status: int, detail: str) -> bytes:
+    return json.dumps({"status": status, "headers": {}, "body": {"detail": detail}}).encode()
+
+
+def _sub_scope(parent: dict, request: SubRequest, body: bytes) -> dict:
+    url = urlsplit(request.path)
+    headers = [(k, v) for k, v in parent["headers"] if k in INHERITED_HEADERS]
+    names = {k for k, _ in headers}
+    for name, value in request.headers.items():
+        key = name.lower().encode("latin-1")
+        if key in DROPPED_HEADERS:
+            continue
+        if key in names:
+            headers = [(k, v) for k, v in headers if k != key]
+        headers.append((key, value.encode("latin-1")))
+    if body:
+        headers.append((b"content-type", b"application/json"))
+        headers.append((b"content-length", str(len(body)).encode()))
+    return {
+        "type": "http",
+        "asgi": parent.get("asgi", {"version": "3.0"}),
+        "http_version": parent.get("http_version", "1.1"),
+        "method": request.method,
+        "scheme": parent.get("scheme", "http"),
+        "server": parent.get("server"),
+        "client": parent.get("client"),
+        "root_path": parent.get("root_path", ""),
+        # path はデコードした値、raw_path はエンコードされたままの値です (通常のリクエストと同じ)
+        "path": unquote(url.path),
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": headers,
+    }
+
+
+# サブリクエストを1つ実行し、結果を JSON (bytes) で返します
+async def _dispatch(app, parent: dict, request: SubRequest) -> bytes:
+    body = b"" if request.body is None else json.dumps(request.body).encode()
+    scope = _sub_scope(parent, request, body)
+    status = None
+    response_headers = []
+    chunks = []
+    completed = False
+    done = asyncio.Event()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # レスポンスの送信が終わるまでは切断を通知しません (StreamingResponse が中断されるため)
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, response_headers, completed
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            response_headers = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                completed = True
+                done.set()
+
+    try:
+        await app(scope, receive, send)
+    except Exception:
+        pass
+    finally:
+        done.set()
+    # レスポンスを開始せずに、またはボディの途中で終了・失敗した場合 (途中までのボディは埋め込みません)
+    if status is None or not completed:
+        return _error(500, "Internal Server Error")
+    response_body = b"".join(chunks)
+    headers = {}
+    content_type = ""
+    encoded_body = False
+    for key, value in response_headers:
+        key = key.decode("latin-1")
+        if key == "content-length":
+            continue
+        value = value.decode("latin-1")
+        headers[key] = value
+        if key == "content-type":
+            content_type = value
+        elif key == "content-encoding" and value != "identity":
+            encoded_body = True
+    prefix = ('{"status": %d, "headers": %s, "body": ' % (status, json.dumps(headers))).encode()
+    if not response_body:
+        encoded = b"null"
+    elif encoded_body:
+        # Accept-Encoding を除いても圧縮して返すルートの場合 (ボディは埋め込みません)
+        return _error(502, "Encoded sub-response body can not be embedded")
+    elif content_type.startswith("application/json"):
+        encoded = response_body
+    else:
+        encoded = json.dumps(response_body.decode("utf-8", errors="replace")).encode()
+    return prefix + encoded + b"}"
+
+
+# 結果の JSON 配列 (bytes) を返します
+async def dispatch_batch(app, parent: dict, requests: List[SubRequest], timeout: float = BATCH_TIMEOUT) -> bytes:
+    tasks = [asyncio.ensure_future(_dispatch(app, parent, request)) for request in requests]
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    results = [
+        _error(504, "Batch timeout exceeded") if task in pending else task.result()
+        for task in tasks
+    ]
+    return b"[" + b", ".join(results) + b"]"
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Elastic APM のサンプリング率ごとのリクエストのオーバーヘッドを計測します
+# elastic-apm/intake_stub.py を APM サーバーの代わりに起動し、sql_app を uvicorn で起動して
+# GET /users/ (SQL の span が発生します) の RPS とレイテンシ、APM に送られたイベント数を比較します
+#
+# % python benchmarks/bench_apm_overhead.py
+# % python benchmarks/bench_apm_overhead.py --seconds 10 --clients 16 --rates 0 0.1 1.0
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def wait_ready(url):
+    for _ in range(100):
+        try:
+            httpx.get(url)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start: " + url)
+
+
+async def run_load(url, clients, seconds):
+    deadline = time.perf_counter() + seconds
+    latencies = []
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        async def worker():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get("/users/", params={"limit": 20})
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker() for _ in range(clients)))
+    return latencies
+
+
+def measure(rate, intake_url, args):
+    port = free_port()
+    workdir = tempfile.mkdtemp()
+    env = dict(
+        os.environ, PYTHONPATH=ROOT,
+        ELASTIC_APM_SERVER_URL=intake_url,
+        ELASTIC_APM_ENABLED="false" if rate is None else "true",
+        ELASTIC_APM_TRANSACTION_SAMPLE_RATE=str(rate or 0),
+        ELASTIC_APM_CENTRAL_CONFIG="false",
+        # 計測中のイベントが終了までに送信されるよう、送信間隔を短くします
+        ELASTIC_APM_API_REQUEST_TIME="1s",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "sql_app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = "http://127.0.0.1:%d" % port
+        wait_ready(url + "/internal/pool-stats")
+        for i in range(20):
+            httpx.post(url + "/users/", json={"email": "user%d@example.com" % i, "password": "secret"})
+        httpx.delete(intake_url + "/stats")
+        latencies = asyncio.run(run_load(url, args.clients, args.seconds))
+        time.sleep(2)
+    finally:
+        server.terminate()
+        server.wait()
+    events = httpx.get(intake_url + "/stats").json()["events"]
+    return len(latencies) / args.seconds, latencies, events
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--rates", type=float, nargs="+", default=[0, 0.1, 1.0])
+    args = parser.parse_args()
+
+    intake_port = free_port()
+    intake_url = "http://127.0.0.1:%d" % intake_port
+    intake = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "elastic-apm", "intake_stub.py"), "--port", str(intake_port)],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_ready(intake_url + "/stats")
+        print("%-10s %8s %9s %9s %13s %8s" % ("rate", "rps", "p50 ms", "p99 ms", "transactions", "spans"))
+        for rate in [None] + args.rates:
+            rps, latencies, events = measure(rate, intake_url, args)
+            print("%-10s %8.0f %9.2f %9.2f %13d %8d" % (
+                "disabled" if rate is None else rate, rps,
+                percentile(latencies, 50) * 1e3, percentile(latencies, 99) * 1e3,
+                events.get("transaction", 0), events.get("span", 0),
+            ))
+    finally:
+        intake.terminate()
+        intake.wait()
+
+
+if __name__ == "__main__":
+    main()
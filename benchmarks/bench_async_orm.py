@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# sql_app の ORM ルートを同期 (スレッドプール) と非同期 (AsyncSession) で比較する負荷ベンチマーク
+# モードごとに子プロセスを起動し、同時接続数ごとの RPS / p50 / p99 と
+# スレッドプールの最大待ち数 (飽和の目安) を計測します
+# 同期モードはスレッドプール (40) とコネクションプール (5 + 10) が枯渇すると
+# プールのタイムアウト (30 秒) までリクエストが止まるため、同時接続数 200 では時間がかかります
+#
+# % python benchmarks/bench_async_orm.py
+# % python benchmarks/bench_async_orm.py --concurrency 10 100 400 --requests 4000
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def seed(users):
+    from sql_app import models
+    from sql_app.database import SessionLocal
+
+    db = SessionLocal()
+    for i in range(users):
+        user = models.User(email="bench%d@example.com" % i, hashed_password="x")
+        user.items = [models.Item(title="item %d" % i)]
+        db.add(user)
+    db.commit()
+    db.close()
+
+
+async def sample_threadpool(stats, stop):
+    import anyio.to_thread
+
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    while not stop.is_set():
+        stats["borrowed"] = max(stats["borrowed"], limiter.borrowed_tokens)
+        stats["waiting"] = max(stats["waiting"], limiter.statistics().tasks_waiting)
+        await asyncio.sleep(0.001)
+
+
+async def load(app, concurrency, requests, path):
+    import httpx
+
+    latencies = []
+    stats = {"borrowed": 0, "waiting": 0, "errors": 0}
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_threadpool(stats, stop))
+    queue = iter(range(requests))
+    # プール枯渇などのエラーは 500 として数えます
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for _ in queue:
+                start = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    stats["errors"] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    stop.set()
+    await sampler
+    return requests / elapsed, latencies, stats
+
+
+def run_child(args):
+    sys.path.insert(0, ROOT)
+    # テーブルは sql_app.main の import 時に作成されます
+    from sql_app.main import app
+
+    seed(args.users)
+
+    for concurrency in args.concurrency:
+        rps, latencies, stats = asyncio.run(load(app, concurrency, args.requests, args.path))
+        print("%6s %6d %10.0f %10.2f %10.2f %10d %10d %8d" % (
+            args.child, concurrency, rps,
+            percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+            stats["borrowed"], stats["waiting"], stats["errors"],
+        ), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--path", default="/users/?limit=20")
+    parser.add_argument("--child", choices=["sync", "async"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    print("%6s %6s %10s %10s %10s %10s %10s %8s" % (
+        "mode", "conc", "rps", "p50 ms", "p99 ms", "threads", "waiting", "errors"), flush=True)
+    for mode in ["sync", "async"]:
+        env = dict(os.environ, SQL_APP_ASYNC_ORM="1" if mode == "async" else "0")
+        # database.py は ./test.db を使うため、モードごとに空のディレクトリで実行します
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", mode,
+             "--requests", str(args.requests), "--users", str(args.users), "--path", args.path,
+             "--concurrency", *map(str, args.concurrency)],
+            cwd=tempfile.mkdtemp(), env=env, check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
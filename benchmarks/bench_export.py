@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# GET /notes/ の一覧とストリーミング出力 (export=ndjson / json) のメモリ比較
+# notes を N 行作成した SQLite で sql_app を uvicorn で起動し、
+# レスポンスを読み捨てたときのサーバープロセスのピーク RSS (VmHWM) を計測します
+#
+# % python benchmarks/bench_export.py
+# % python benchmarks/bench_export.py --rows 1000000
+import argparse
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def prepare(rows):
+    workdir = tempfile.mkdtemp()
+    conn = sqlite3.connect(os.path.join(workdir, "test.db"))
+    conn.execute("CREATE TABLE notes (id INTEGER PRIMARY KEY, text VARCHAR, completed BOOLEAN)")
+    conn.executemany(
+        "INSERT INTO notes (text, completed) VALUES (?, ?)",
+        (("note %d" % i, i % 2) for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+    return workdir
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def peak_rss_mb(pid):
+    with open("/proc/%d/status" % pid) as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+
+
+def measure(workdir, query):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "sql_app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=dict(os.environ, PYTHONPATH=ROOT),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = "http://127.0.0.1:%d" % port
+        for _ in range(100):
+            try:
+                httpx.get(url + "/internal/pool-stats")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        before = peak_rss_mb(server.pid)
+        size = 0
+        start = time.perf_counter()
+        with httpx.stream("GET", url + "/notes/" + query, timeout=None) as response:
+            for chunk in response.iter_raw():
+                size += len(chunk)
+        elapsed = time.perf_counter() - start
+        return before, peak_rss_mb(server.pid), size, elapsed
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    workdir = prepare(args.rows)
+    print("%-16s %12s %12s %10s %8s" % ("mode", "startup MB", "peak MB", "body MB", "sec"))
+    for name, query in [("list", ""), ("export=ndjson", "?export=ndjson"), ("export=json", "?export=json")]:
+        before, peak, size, elapsed = measure(workdir, query)
+        print("%-16s %12.1f %12.1f %10.1f %8.2f" % (name, before, peak, size / 1024 / 1024, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# ItemStore に複数スレッドから読み込み・書き込みを混ぜて行い、ops/sec と読み込みのレイテンシを計測します
+# 比較対象は、dict 全体を1つのロックで守る単純な実装 (読み込みもロックを取ります) です
+# 書き込みは If-Match 付きの条件付き更新で、競合 (412 相当) の件数も表示します
+# 最後に、全アイテムが同じタグを持つ場合の追加にかかる時間を件数ごとに表示します (件数に比例するはずです)
+#
+# % python benchmarks/bench_item_store.py
+# % python benchmarks/bench_item_store.py --threads 16 --write-ratio 0.2 --items 10000
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from item_store import ItemStore, PreconditionFailed  # noqa: E402
+
+
+# 以前の items (dict) にロックを付けただけの実装
+class LockedDictStore:
+    def __init__(self):
+        self._items = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def create(self, item_id, data):
+        with self._lock:
+            self._items[item_id] = dict(data)
+            self._versions[item_id] = 1
+
+    def get(self, item_id):
+        with self._lock:
+            return dict(self._items[item_id]), self._versions[item_id]
+
+    def put(self, item_id, changes, if_match):
+        with self._lock:
+            if '"%d"' % self._versions[item_id] != if_match:
+                raise PreconditionFailed(item_id)
+            self._items[item_id].update(changes)
+            self._versions[item_id] += 1
+
+
+def run(store, kind, args):
+    ids = ["item%d" % i for i in range(args.items)]
+    for item_id in ids:
+        store.create(item_id, {"name": item_id, "size": 0, "tags": ["tag%d" % (hash(item_id) % 10)]})
+    deadline = time.perf_counter() + args.seconds
+    results = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        ops = conflicts = 0
+        read_latencies = []
+        while time.perf_counter() < deadline:
+            item_id = ids[rng.randrange(len(ids))]
+            if rng.random() < args.write_ratio:
+                if kind == "item_store":
+                    etag = store.get(item_id).etag
+                else:
+                    etag = '"%d"' % store.get(item_id)[1]
+                try:
+                    store.put(item_id, {"size": rng.randrange(1000)}, if_match=etag)
+                except PreconditionFailed:
+                    conflicts += 1
+            else:
+                start = time.perf_counter()
+                store.get(item_id)
+                read_latencies.append(time.perf_counter() - start)
+            ops += 1
+        results.append((ops, conflicts, read_latencies))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ops = sum(r[0] for r in results)
+    conflicts = sum(r[1] for r in results)
+    latencies = sorted(latency for r in results for latency in r[2])
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+    return ops / args.seconds, conflicts, p99
+
+
+# 同じタグのアイテムを count 件追加する時間 [秒]
+def insert_shared_tag(count):
+    store = ItemStore()
+    start = time.perf_counter()
+    for i in range(count):
+        store.create("item%d" % i, {"name": "item", "tags": ["shared"]})
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    print("%-16s %12s %10s %14s" % ("store", "ops/sec", "conflicts", "read p99 µs"))
+    for kind, store in [("locked_dict", LockedDictStore()), ("item_store", ItemStore())]:
+        ops, conflicts, p99 = run(store, kind, args)
+        print("%-16s %12.0f %10d %14.2f" % (kind, ops, conflicts, p99 * 1e6))
+
+    print()
+    print("%-16s %12s %14s" % ("shared tag", "seconds", "µs/insert"))
+    for count in (5000, 20000, 40000):
+        seconds = insert_shared_tag(count)
+        print("%-16d %12.3f %14.2f" % (count, seconds, seconds / count * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# /fake-video-streamer に多数のクライアントから Range リクエスト (シーク) を送り、
+# 合計のスループットとサーバープロセスの RSS (最大値) を計測します
+# 一時ファイルを作って VIDEO_FILE に指定し、main:app を uvicorn で起動します。MEDIA_CHUNK_SIZE ごとに比較します
+#
+# % python benchmarks/bench_media_stream.py
+# % python benchmarks/bench_media_stream.py --clients 500 --file-mb 256 --range-kb 1024 --chunk-kb 64 256 1024
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url):
+    for _ in range(100):
+        try:
+            httpx.get(url, headers={"Range": "bytes=0-0"})
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start: " + url)
+
+
+def rss_mb(pid):
+    with open("/proc/%d/status" % pid) as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+# 計測中の RSS の最大値を記録します
+class RSSSampler(threading.Thread):
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0.0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, rss_mb(self.pid))
+            time.sleep(self.interval)
+
+
+async def run_load(url, file_size, args):
+    range_size = args.range_kb * 1024
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    received = errors = 0
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits) as client:
+        async def worker(seed):
+            nonlocal received, errors
+            rng = random.Random(seed)
+            for _ in range(args.seeks):
+                start = rng.randrange(0, file_size - range_size)
+                headers = {"Range": "bytes=%d-%d" % (start, start + range_size - 1)}
+                try:
+                    async with client.stream("GET", "/fake-video-streamer", headers=headers) as response:
+                        if response.status_code != 206:
+                            errors += 1
+                        async for chunk in response.aiter_raw():
+                            received += len(chunk)
+                except httpx.TransportError:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(args.clients)))
+        elapsed = time.perf_counter() - start
+    return received, elapsed, errors
+
+
+def measure(chunk_size, video_file, file_size, args):
+    port = free_port()
+    env = dict(
+        os.environ, PYTHONPATH=ROOT, VIDEO_FILE=video_file, MEDIA_CHUNK_SIZE=str(chunk_size),
+        PASSWORD_POOL_WORKERS="0", PROCESS_TIME_HEADER="0", RATE_LIMIT_ENABLED="0",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--log-level", "warning", "--no-access-log",
+         # 待たされている間に keep-alive の接続が切られないようにします
+         "--timeout-keep-alive", "60"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = "http://127.0.0.1:%d" % port
+        wait_ready(url + "/fake-video-streamer")
+        idle = rss_mb(server.pid)
+        sampler = RSSSampler(server.pid)
+        sampler.start()
+        received, elapsed, errors = asyncio.run(run_load(url, file_size, args))
+        sampler.stopped.set()
+        sampler.join()
+    finally:
+        server.terminate()
+        server.wait()
+    return received / elapsed / 1024 / 1024, idle, sampler.peak, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--seeks", type=int, default=4)
+    parser.add_argument("--file-mb", type=int, default=256)
+    parser.add_argument("--range-kb", type=int, default=1024)
+    parser.add_argument("--chunk-kb", type=int, nargs="+", default=[64, 256, 1024])
+    args = parser.parse_args()
+
+    file_size = args.file_mb * 1024 * 1024
+    with tempfile.NamedTemporaryFile(suffix=".mp4") as video:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.file_mb):
+            video.write(block)
+        video.flush()
+        print("%-10s %10s %12s %12s %8s" % ("chunk KB", "MB/s", "idle RSS MB", "peak RSS MB", "errors"))
+        for chunk_kb in args.chunk_kb:
+            throughput, idle, peak, errors = measure(chunk_kb * 1024, video.name, file_size, args)
+            print("%-10d %10.1f %12.1f %12.1f %8d" % (chunk_kb, throughput, idle, peak, errors))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# sql_app の offset ページネーションとカーソルページネーションの比較
+# 1M 行の users テーブルを SQLite に作り、各ページ位置での取得時間を計測します
+#
+# % python benchmarks/bench_pagination.py
+# % python benchmarks/bench_pagination.py --rows 1000000 --limit 100
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sql_app import crud, models  # noqa: E402
+
+
+def prepare(rows):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine("sqlite:///" + path)
+    models.Base.metadata.create_all(bind=engine)
+    batch = 50_000
+    with engine.begin() as conn:
+        for start in range(1, rows + 1, batch):
+            conn.execute(
+                models.User.__table__.insert(),
+                [
+                    {"id": i, "email": "user%d@example.com" % i, "hashed_password": "x", "is_active": True}
+                    for i in range(start, min(start + batch, rows + 1))
+                ],
+            )
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def timed(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    make_session = prepare(args.rows)
+    db = make_session()
+    print("%10s %12s %12s" % ("page", "offset ms", "cursor ms"))
+    pages = [1, 10, 100, 1_000, 10_000]
+    for page in [p for p in pages if p * args.limit <= args.rows]:
+        skip = (page - 1) * args.limit
+        # id は 1 から連番なので skip 件目の id がそのままカーソルになります
+        offset_ms = timed(lambda: crud.get_users(db, skip=skip, limit=args.limit))
+        cursor_ms = timed(lambda: crud.get_users(db, limit=args.limit, after_id=skip))
+        print("%10d %12.2f %12.2f" % (page, offset_ms, cursor_ms))
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# 過負荷時に優先度の高いルートのレイテンシが保たれるかを計測します
+# sql_app を uvicorn で起動し、多数のクライアントから一覧 (GET /users/, PRIORITY_BULK) を送り続けながら、
+# 1クライアントで GET /users/{id} (PRIORITY_NORMAL) と /internal/pool-stats (PRIORITY_CRITICAL) のレイテンシを計測します
+# RateLimitMiddleware を無効にした場合と比較します (負荷なしの値も表示します)
+#
+# % python benchmarks/bench_rate_limit.py
+# % python benchmarks/bench_rate_limit.py --clients 400 --seconds 10 --max-concurrent 8
+import argparse
+import asyncio
+import collections
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PROBES = [("normal", "/users/1"), ("critical", "/internal/pool-stats")]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def wait_ready(url):
+    for _ in range(100):
+        try:
+            httpx.get(url)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start: " + url)
+
+
+# 一覧のリクエストを送り続けます (計測側のイベントループに影響しないよう、別プロセスで実行します)
+async def flood(url, clients, seconds):
+    deadline = time.perf_counter() + seconds
+    statuses = collections.Counter()
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits) as client:
+        async def worker():
+            while time.perf_counter() < deadline:
+                try:
+                    response = await client.get("/users/", params={"limit": 100})
+                    statuses[response.status_code] += 1
+                except httpx.TransportError:
+                    statuses["error"] += 1
+
+        await asyncio.gather(*(worker() for _ in range(clients)))
+    return statuses
+
+
+def run_flood(url, clients, seconds, results):
+    results.put(dict(asyncio.run(flood(url, clients, seconds))))
+
+
+async def probe(url, seconds):
+    deadline = time.perf_counter() + seconds
+    latencies = {name: [] for name, _ in PROBES}
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        while time.perf_counter() < deadline:
+            for name, path in PROBES:
+                start = time.perf_counter()
+                await client.get(path)
+                latencies[name].append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+    return latencies
+
+
+def measure(enabled, with_flood, args):
+    port = free_port()
+    env = dict(
+        os.environ, PYTHONPATH=ROOT, ELASTIC_APM_ENABLED="false",
+        RATE_LIMIT_ENABLED="1" if enabled else "0",
+        # ここではトークンバケットではなく、同時実行数の制限の効果を計測します
+        RATE_LIMIT_RATE="1000000", RATE_LIMIT_BURST="1000000",
+        RATE_LIMIT_MAX_CONCURRENT=str(args.max_concurrent),
+        RATE_LIMIT_MAX_QUEUE=str(args.max_queue),
+        RATE_LIMIT_MAX_WAIT=str(args.max_wait),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "sql_app.main:app", "--port", str(port),
+         "--log-level", "warning", "--no-access-log", "--backlog", "4096"],
+        cwd=tempfile.mkdtemp(), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = "http://127.0.0.1:%d" % port
+        wait_ready(url + "/internal/pool-stats")
+        for i in range(200):
+            httpx.post(url + "/users/", json={"email": "user%d@example.com" % i, "password": "secret"})
+        results = multiprocessing.Queue()
+        flooder = None
+        if with_flood:
+            flooder = multiprocessing.Process(target=run_flood, args=(url, args.clients, args.seconds + 1, results))
+            flooder.start()
+            # 負荷が掛かり始めてから計測します
+            time.sleep(1)
+        latencies = asyncio.run(probe(url, args.seconds))
+        statuses = {}
+        if flooder is not None:
+            statuses = results.get()
+            flooder.join()
+        return latencies, statuses
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--max-concurrent", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=32)
+    parser.add_argument("--max-wait", type=float, default=0.5)
+    args = parser.parse_args()
+
+    print("%-18s %-9s %9s %9s %s" % ("limiter", "probe", "p50 ms", "p99 ms", "flood responses"))
+    for label, enabled, with_flood in [
+        ("idle", True, False), ("overload (off)", False, True), ("overload (on)", True, True),
+    ]:
+        latencies, statuses = measure(enabled, with_flood, args)
+        for name, _ in PROBES:
+            print("%-18s %-9s %9.2f %9.2f %s" % (
+                label, name, percentile(latencies[name], 50) * 1e3, percentile(latencies[name], 99) * 1e3,
+                " ".join("%s=%d" % item for item in sorted(statuses.items(), key=str)),
+            ))
+
+
+if __name__ == "__main__":
+    main()
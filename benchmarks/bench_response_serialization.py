@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# response_model のシリアライズ 1回あたりの時間 [µs] を計測します
+# FastAPI の通常の処理 (serialize_response + JSONResponse) と
+# FastResponseRoute.render_fast (+ FastJSONResponse) を比較します
+#
+# % python benchmarks/bench_response_serialization.py
+# % FAST_RESPONSE_ENCODER=orjson python benchmarks/bench_response_serialization.py --number 20000
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fast_response import FastResponseRoute  # noqa: E402
+from main import Image, Item  # noqa: E402
+from sql_app import schemas  # noqa: E402
+
+
+class FakeUserRow:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.email = "user%d@example.com" % user_id
+        self.is_active = True
+        self.items = [FakeItemRow(user_id * 10 + i, user_id) for i in range(3)]
+
+
+class FakeItemRow:
+    def __init__(self, item_id, owner_id):
+        self.id = item_id
+        self.owner_id = owner_id
+        self.title = "item%d" % item_id
+        self.description = "description of item%d" % item_id
+
+
+def make_item():
+    return Item(
+        name="Foo", description="A very nice Item", price=35.4, tax=3.2,
+        tags={"rock", "metal", "pop"},
+        images=[
+            Image(url="http://example.com/%d.jpg" % i, name="image%d" % i) for i in range(10)
+        ],
+    )
+
+
+async def baseline(route, result):
+    content = await serialize_response(field=route.response_field, response_content=result)
+    return JSONResponse(content).body
+
+
+async def fast(route, result):
+    return route.render_fast(result, {}).body
+
+
+async def measure(func, route, result, number):
+    await func(route, result)
+    start = time.perf_counter()
+    for _ in range(number):
+        await func(route, result)
+    return (time.perf_counter() - start) / number * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=5000)
+    args = parser.parse_args()
+
+    cases = [
+        # ハンドラが response_model のインスタンスを返す場合 (create_item)
+        ("Item (nested images)", Item, make_item()),
+        # ハンドラが ORM オブジェクトのリストを返す場合 (sql_app の GET /users/)
+        ("List[schemas.User] x100", List[schemas.User], [FakeUserRow(i) for i in range(100)]),
+    ]
+    print("encoder: %s" % os.getenv("FAST_RESPONSE_ENCODER", "ujson"))
+    print("%-26s %12s %12s %8s" % ("case", "fastapi µs", "fast µs", "speedup"))
+    for name, response_model, result in cases:
+        route = FastResponseRoute("/bench", lambda: None, response_model=response_model)
+        number = args.number if response_model is Item else max(args.number // 50, 1)
+        assert sorted(await baseline(route, result)) == sorted(await fast(route, result))
+        slow_us = await measure(baseline, route, result, number)
+        fast_us = await measure(fast, route, result, number)
+        print("%-26s %12.1f %12.1f %7.1fx" % (name, slow_us, fast_us, slow_us / fast_us))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
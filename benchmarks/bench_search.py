@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# SearchIndex の検索レイテンシ (p50 / p99) をアイテム数ごとに計測します
+# 単語1つ、AND (2単語)、前方一致 + AND の3種類のクエリと、1件の更新 (upsert) の時間を比較します
+#
+# % python benchmarks/bench_search.py
+# % python benchmarks/bench_search.py --sizes 10000 100000 1000000 --queries 200
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from search_index import SearchIndex  # noqa: E402
+
+SYLLABLES = ["ka", "ro", "mi", "ta", "ne", "so", "ru", "pi", "do", "ga", "zu", "be", "ho", "ly", "qu"]
+
+
+def make_vocabulary(rng, size):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_item(rng, vocabulary, tags):
+    return {
+        "name": " ".join(rng.choice(vocabulary) for _ in range(2)),
+        "description": " ".join(rng.choice(vocabulary) for _ in range(8)),
+        "tags": rng.sample(tags, 2),
+    }
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def measure(func, number):
+    latencies = []
+    for i in range(number):
+        start = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - start)
+    return percentile(latencies, 50) * 1e3, percentile(latencies, 99) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocabulary = make_vocabulary(rng, 20000)
+    tags = ["tag%d" % i for i in range(50)]
+    print("%-10s %-22s %10s %10s" % ("items", "query", "p50 ms", "p99 ms"))
+    for size in args.sizes:
+        index = SearchIndex()
+        start = time.perf_counter()
+        for i in range(size):
+            index.update("item%d" % i, make_item(rng, vocabulary, tags))
+        build = time.perf_counter() - start
+        print("%-10d %-22s %10.1f %10s" % (size, "build (total)", build * 1e3, ""))
+
+        words = [rng.choice(vocabulary) for _ in range(args.queries)]
+        cases = [
+            ("term", lambda i: index.search(words[i], limit=args.limit)),
+            ("term AND tag", lambda i: index.search(
+                "%s %s" % (words[i], tags[i % len(tags)]), limit=args.limit)),
+            ("prefix AND tag", lambda i: index.search(
+                "%s* %s" % (words[i][:3], tags[i % len(tags)]), limit=args.limit)),
+            ("tag (large result)", lambda i: index.search(tags[i % len(tags)], limit=args.limit)),
+            ("upsert 1 item", lambda i: index.update(
+                "item%d" % rng.randrange(size), make_item(rng, vocabulary, tags))),
+        ]
+        for name, func in cases:
+            p50, p99 = measure(func, args.queries)
+            print("%-10d %-22s %10.3f %10.3f" % (size, name, p50, p99))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# 3つのアプリ (main, sql_app.main, code/main) の起動時間を計測します
+# - import 時間: `python -X importtime` の出力を集計し、合計と時間の掛かっているモジュールを表示します
+# - 最初のレスポンスまでの時間: uvicorn を起動してから、最初のリクエストに応答するまでの時間です
+# それぞれ --runs 回計測した中央値です。--json を指定すると結果をファイルに書き出します (比較用)
+#
+# % python benchmarks/bench_startup.py
+# % python benchmarks/bench_startup.py --runs 10 --top 15 --json startup.json
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# (名前, import するモジュール, 作業ディレクトリ, 最初のリクエストのパス)
+APPS = [
+    ("main", "main", ROOT, "/"),
+    ("sql_app", "sql_app.main", ROOT, "/internal/pool-stats"),
+    # code/main.py は code ディレクトリで起動します (docker/api/Dockerfile と同じ)
+    ("code", "main", os.path.join(ROOT, "code"), "/internal/pool-stats"),
+]
+
+_line_pattern = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def app_env(cwd):
+    return dict(
+        os.environ, PYTHONPATH=ROOT,
+        # APM サーバーへの接続や、MySQL の無い環境での起動失敗を避けます
+        ELASTIC_APM_ENABLED="false",
+        DATABASE_URL="sqlite:///%s" % os.path.join(tempfile.mkdtemp(), "startup.db"),
+        PASSWORD_POOL_WORKERS="0",
+    )
+
+
+# 戻り値は (module の累積時間, {module が直接 import したモジュール: 累積時間}) [µs]
+# importtime は子のモジュールを親より先に出力するため、module の行の直前にある深さ 1 の行が直接の import です
+# (インタプリタの起動時に site が import するモジュールは含めません)
+def parse_importtime(stderr, module):
+    children = {}
+    for line in stderr.splitlines():
+        match = _line_pattern.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, name = match.groups()
+        depth = len(indent) // 2
+        if depth == 0:
+            if name == module:
+                return int(cumulative), children
+            children = {}
+        elif depth == 1:
+            children[name] = int(cumulative)
+    raise RuntimeError("module not found in importtime output: " + module)
+
+
+def measure_import(module, cwd):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        cwd=cwd, env=app_env(cwd), capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return parse_importtime(result.stderr, module)
+
+
+def measure_first_response(module, cwd, path):
+    port = free_port()
+    url = "http://127.0.0.1:%d%s" % (port, path)
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module + ":app", "--port", str(port), "--log-level", "warning"],
+        cwd=cwd, env=app_env(cwd), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                httpx.get(url)
+                return time.perf_counter() - start
+            except httpx.TransportError:
+                if server.poll() is not None:
+                    raise RuntimeError("server exited: %s" % module)
+                time.sleep(0.005)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    report = {}
+    for name, module, cwd, path in APPS:
+        totals = []
+        runs = []
+        for _ in range(args.runs):
+            total, children = measure_import(module, cwd)
+            totals.append(total)
+            runs.append(children)
+        first_responses = [measure_first_response(module, cwd, path) for _ in range(args.runs)]
+        # 中央値の回のモジュールごとの内訳を使います
+        children = runs[totals.index(sorted(totals)[len(totals) // 2])]
+        # 直接 import しているモジュールを累積時間の順に表示します
+        heaviest = sorted(children.items(), key=lambda x: -x[1])[:args.top]
+        report[name] = {
+            "import_ms": statistics.median(totals) / 1e3,
+            "first_response_ms": statistics.median(first_responses) * 1e3,
+            "heaviest_imports_ms": {n: c / 1e3 for n, c in heaviest},
+        }
+
+        print("== %s (%s)" % (name, module))
+        print("  import:         %8.1f ms" % report[name]["import_ms"])
+        print("  first response: %8.1f ms" % report[name]["first_response_ms"])
+        for n, ms in report[name]["heaviest_imports_ms"].items():
+            print("    %-40s %8.1f ms" % (n, ms))
+    if args.json:
+        with open(args.json, mode="w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# /items-template/{item_id} のレンダリング回数/秒を計測します
+# - Jinja2Templates.TemplateResponse (以前の実装)
+# - CachedTemplates.render_response (レンダリングキャッシュなし / あり)
+# あわせて、ワーカー起動時のテンプレート読み込み時間をバイトコードキャッシュの有無で比較します
+#
+# % python benchmarks/bench_templates.py
+# % python benchmarks/bench_templates.py --seconds 3 --item-ids 100
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import jinja2
+from fastapi.templating import Jinja2Templates
+from starlette.requests import Request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from main import app  # noqa: E402
+from template_cache import CachedTemplates, create_environment  # noqa: E402
+
+TEMPLATES_DIR = os.path.join(ROOT, "templates")
+
+
+def make_request():
+    scope = {
+        "type": "http", "method": "GET", "path": "/items-template/foo", "root_path": "",
+        "scheme": "http", "server": ("testserver", 80), "query_string": b"",
+        "headers": [(b"host", b"testserver")], "app": app, "router": app.router,
+    }
+    return Request(scope)
+
+
+def measure(render, item_ids, seconds):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for item_id in item_ids:
+            render(item_id)
+        count += len(item_ids)
+    return count / (time.perf_counter() - start)
+
+
+def measure_load(bytecode_dir, number=50):
+    start = time.perf_counter()
+    for _ in range(number):
+        if bytecode_dir is None:
+            env = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATES_DIR), autoescape=True)
+        else:
+            env = create_environment(TEMPLATES_DIR, bytecode_dir)
+        env.get_template("item.html")
+    return (time.perf_counter() - start) / number * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--item-ids", type=int, default=10, help="number of distinct item_id values")
+    args = parser.parse_args()
+
+    request = make_request()
+    item_ids = ["item%d" % i for i in range(args.item_ids)]
+    bytecode_dir = tempfile.mkdtemp()
+    try:
+        plain = Jinja2Templates(env=jinja2.Environment(
+            loader=jinja2.FileSystemLoader(TEMPLATES_DIR), autoescape=True
+        ))
+        uncached = CachedTemplates(TEMPLATES_DIR, bytecode_dir=bytecode_dir, maxsize=0)
+        cached = CachedTemplates(TEMPLATES_DIR, bytecode_dir=bytecode_dir, maxsize=1024)
+        cases = [
+            ("Jinja2Templates", lambda i: plain.TemplateResponse(
+                request, "item.html", {"item_id": i}).body),
+            ("CachedTemplates (no cache)", lambda i: uncached.render_response(
+                "item.html", {"request": request, "item_id": i}).body),
+            ("CachedTemplates (cache)", lambda i: cached.render_response(
+                "item.html", {"request": request, "item_id": i}).body),
+        ]
+        print("%-28s %14s" % ("case", "renders/sec"))
+        for name, render in cases:
+            print("%-28s %14.0f" % (name, measure(render, item_ids, args.seconds)))
+
+        print()
+        print("template load without bytecode cache: %.3f ms" % measure_load(None))
+        print("template load with bytecode cache:    %.3f ms" % measure_load(bytecode_dir))
+    finally:
+        shutil.rmtree(bytecode_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
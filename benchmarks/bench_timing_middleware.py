@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# GET / に対する計測用ミドルウェアのオーバーヘッド [µs/request] を計測します
+# ネットワークを介さず ASGI アプリを直接呼び出し、次の3つを比較します
+# - ミドルウェアなし
+# - @app.middleware("http") + time.time() (以前の add_process_time_header)
+# - TimingMiddleware (ヘッダなし / あり)
+#
+# % python benchmarks/bench_timing_middleware.py
+# % python benchmarks/bench_timing_middleware.py --requests 50000
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from fastapi import FastAPI, Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from timing_middleware import Metrics, TimingMiddleware  # noqa: E402
+
+
+def make_app(kind):
+    app = FastAPI()
+
+    @app.get("/")
+    async def read_root():
+        return {"Hello": "World"}
+
+    if kind == "base_http_middleware":
+        @app.middleware("http")
+        async def add_process_time_header(request: Request, call_next):
+            start_time = time.time()
+            response = await call_next(request)
+            response.headers["X-Process-Time"] = str(time.time() - start_time)
+            return response
+    elif kind.startswith("timing_middleware"):
+        app.add_middleware(TimingMiddleware, metrics=Metrics(), header=kind.endswith("header"))
+    return app
+
+
+async def call(app):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/", "raw_path": b"/", "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"localhost")], "client": ("127.0.0.1", 1234),
+        "server": ("localhost", 8000),
+    }
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    # 2回目以降は実際のサーバーと同様に切断されるまで待ちます
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Future()
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(app, requests):
+    for _ in range(100):
+        await call(app)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await call(app)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    kinds = ["none", "base_http_middleware", "timing_middleware", "timing_middleware_header"]
+    results = {kind: [] for kind in kinds}
+    # 順番による影響を減らすため、交互に複数回計測して最小値を使います
+    for _ in range(args.rounds):
+        for kind in kinds:
+            results[kind].append(await measure(make_app(kind), args.requests))
+    baseline = min(results["none"])
+    print("%-26s %12s %12s" % ("middleware", "µs/request", "overhead µs"))
+    for kind in kinds:
+        value = min(results[kind])
+        print("%-26s %12.2f %12.2f" % (kind, value, value - baseline))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
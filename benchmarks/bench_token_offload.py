@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# /token (bcrypt) に負荷をかけている間の GET / のレイテンシを計測します
+# PASSWORD_POOL_WORKERS=0 (イベントループ上で bcrypt を実行する以前の動作) と
+# プロセスプールで実行する場合を比較します
+#
+# % python benchmarks/bench_token_offload.py
+# % python benchmarks/bench_token_offload.py --login-clients 16 --seconds 10 --workers 4
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run_load(url, login_clients, seconds):
+    deadline = time.perf_counter() + seconds
+    logins = {"ok": 0, "rejected": 0}
+    latencies = []
+
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        async def login():
+            while time.perf_counter() < deadline:
+                response = await client.post(
+                    "/token", data={"username": "john_doe", "password": "secret"}
+                )
+                logins["ok" if response.status_code == 200 else "rejected"] += 1
+
+        async def probe():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get("/")
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.05)
+
+        await asyncio.gather(probe(), *(login() for _ in range(login_clients)))
+    return logins, latencies
+
+
+def measure(workers, args):
+    port = free_port()
+    # ログインの処理量を計測するため、rate_limit.py の制限 (/token は IP ごとに 1 rps) は無効にします
+    env = dict(os.environ, PASSWORD_POOL_WORKERS=str(workers), RATE_LIMIT_ENABLED="0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = "http://127.0.0.1:%d" % port
+        for _ in range(100):
+            try:
+                httpx.get(url + "/")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        return asyncio.run(run_load(url, args.login_clients, args.seconds))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--login-clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    print("%-12s %8s %9s %10s %10s %10s" % ("bcrypt", "logins", "rejected", "/ p50 ms", "/ p99 ms", "/ max ms"))
+    for name, workers in [("event loop", 0), ("pool x%d" % args.workers, args.workers)]:
+        logins, latencies = measure(workers, args)
+        print("%-12s %8d %9d %10.1f %10.1f %10.1f" % (
+            name, logins["ok"], logins["rejected"],
+            percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, max(latencies) * 1000,
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# PUT /users (code/main.py) の一括更新ベンチマーク
+# MySQL の代わりにローカルの SQLite ファイルを使い、rows/sec を計測します
+#
+# % python benchmarks/bench_update_users.py
+# % python benchmarks/bench_update_users.py --sizes 100 10000 100000 --naive-max 10000
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+import crud  # noqa: E402
+from db import Base  # noqa: E402
+from model import UserTable, User  # noqa: E402
+
+
+# 以前の実装 (1行ごとに SELECT + commit)
+def naive_update_users(db, users):
+    for new_user in users:
+        user = db.query(UserTable).filter(UserTable.id == new_user.id).first()
+        user.name = new_user.name
+        user.age = new_user.age
+        db.commit()
+
+
+def prepare(size):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine("sqlite:///" + path)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(
+            UserTable.__table__.insert(),
+            [{"id": i, "name": "user%d" % i, "age": i % 100} for i in range(1, size + 1)],
+        )
+    payload = [User(id=i, name="renamed%d" % i, age=(i + 1) % 100) for i in range(1, size + 1)]
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine), payload
+
+
+def measure(func, size):
+    make_session, payload = prepare(size)
+    db = make_session()
+    try:
+        start = time.perf_counter()
+        func(db, payload)
+        elapsed = time.perf_counter() - start
+    finally:
+        db.close()
+    return size / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000])
+    # 1行ごとに commit する旧実装は遅いため、この件数までで計測を止めます
+    parser.add_argument("--naive-max", type=int, default=10_000)
+    args = parser.parse_args()
+
+    print("%10s %15s %15s" % ("rows", "naive rows/s", "bulk rows/s"))
+    for size in args.sizes:
+        naive = measure(naive_update_users, size) if size <= args.naive_max else None
+        bulk = measure(crud.update_users, size)
+        print("%10d %15s %15.0f" % (size, "-" if naive is None else "%.0f" % naive, bulk))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# launcher.py で3つのアプリ (main, sql_app.main, code/main) を複数ワーカーで起動し、ワーカーごとの RPS を計測します
+# 別プロセスから --clients 本の接続でリクエストを送り続け、launcher.py の stats_file の処理件数の差分から RPS を求めます
+# preload の有無で、ワーカーのメモリ使用量 (PSS: 共有ページをプロセス数で割った値) も比較します
+#
+# % python benchmarks/bench_workers.py
+# % python benchmarks/bench_workers.py --workers 4 --clients 16 --seconds 10 --max-requests 2000
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# (名前, アプリ, --app-dir, 計測に使うパス)
+# main は状態をプロセスのメモリに持つため、launcher.py が1ワーカーに制限します (比較の基準として計測します)
+APPS = [
+    ("main", "main:app", ROOT, "/"),
+    ("sql_app", "sql_app.main:app", ROOT, "/internal/pool-stats"),
+    ("code", "main:app", os.path.join(ROOT, "code"), "/internal/pool-stats"),
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url):
+    for _ in range(200):
+        try:
+            httpx.get(url)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start: " + url)
+
+
+def read_stats(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# 共有ページを按分したメモリ使用量 [MB]
+def pss_mb(pid):
+    try:
+        with open("/proc/%d/smaps_rollup" % pid) as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, TypeError):
+        pass
+    return 0.0
+
+
+async def flood(url, clients, seconds):
+    deadline = time.perf_counter() + seconds
+    statuses = collections.Counter()
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        async def worker():
+            while time.perf_counter() < deadline:
+                try:
+                    response = await client.get(url)
+                    statuses[response.status_code] += 1
+                except httpx.TransportError:
+                    statuses["error"] += 1
+
+        await asyncio.gather(*(worker() for _ in range(clients)))
+    return statuses
+
+
+def run_flood(url, clients, seconds, results):
+    results.put(dict(asyncio.run(flood(url, clients, seconds))))
+
+
+def measure(app, app_dir, path, preload, args):
+    port = free_port()
+    workdir = tempfile.mkdtemp()
+    stats_file = os.path.join(workdir, "stats.json")
+    command = [
+        sys.executable, os.path.join(ROOT, "launcher.py"), app, "--app-dir", app_dir,
+        "--port", str(port), "--workers", str(args.workers), "--max-requests", str(args.max_requests),
+        "--max-requests-jitter", str(args.max_requests // 10), "--stats-interval", "0.5",
+        "--stats-file", stats_file, "--no-access-log", "--log-level", "warning",
+    ]
+    if not preload:
+        command.append("--no-preload")
+    env = dict(
+        os.environ, ELASTIC_APM_ENABLED="false", RATE_LIMIT_ENABLED="0", PASSWORD_POOL_WORKERS="0",
+        DATABASE_URL="sqlite:///%s" % os.path.join(workdir, "bench.db"),
+    )
+    # main.py は static/ 等を相対パスで参照するため、リポジトリのルートで起動します
+    server = subprocess.Popen(command, cwd=ROOT if app_dir == ROOT else app_dir, env=env)
+    try:
+        url = "http://127.0.0.1:%d%s" % (port, path)
+        wait_ready(url)
+        results = multiprocessing.Queue()
+        flooder = multiprocessing.Process(target=run_flood, args=(url, args.clients, args.seconds + 2, results))
+        flooder.start()
+        # 負荷が掛かり始めてからの件数の差分を使います
+        time.sleep(1)
+        before = read_stats(stats_file)
+        time.sleep(args.seconds)
+        after = read_stats(stats_file)
+        memory = sum(pss_mb(worker["pid"]) for worker in after["workers"])
+        statuses = results.get()
+        flooder.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    elapsed = after["time"] - before["time"]
+    workers = [
+        ((b["requests"] - a["requests"]) / elapsed, b["restarts"])
+        for a, b in zip(before["workers"], after["workers"])
+    ]
+    return workers, memory, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=max(2, os.cpu_count() or 1))
+    # httpx の AsyncClient は接続数を増やすと送信側が詰まるため (1 CPU で 64 接続だと 1/7 程度)、少なめにしています
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--max-requests", type=int, default=0)
+    args = parser.parse_args()
+
+    print("%-8s %-10s %-7s %10s %9s %11s %s" % (
+        "app", "mode", "worker", "req/s", "restarts", "PSS MB", "responses"))
+    for name, app, app_dir, path in APPS:
+        for mode, preload in [("preload", True), ("no-preload", False)]:
+            workers, memory, statuses = measure(app, app_dir, path, preload, args)
+            for i, (rps, restarts) in enumerate(workers, 1):
+                print("%-8s %-10s %-7d %10.1f %9d" % (name, mode, i, rps, restarts))
+            print("%-8s %-10s %-7s %10.1f %9d %11.1f %s" % (
+                name, mode, "total", sum(rps for rps, _ in workers), sum(r for _, r in workers), memory,
+                " ".join("%s=%d" % item for item in sorted(statuses.items(), key=str)),
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# Elastic APM の設定
+# @see https://www.elastic.co/guide/en/apm/agent/python/master/starlette-support.html
+# @see https://www.elastic.co/guide/en/apm/agent/python/current/configuration.html
+#
+# ここでの値は既定値で、ELASTIC_APM_* 環境変数があればそちらが優先されます
+# - ELASTIC_APM_TRANSACTION_SAMPLE_RATE=0.1  トランザクションの 10% だけを詳細に記録します
+# - ELASTIC_APM_TRANSACTION_MAX_SPANS=100    1トランザクションで記録する span (SQL など) の上限
+# - ELASTIC_APM_ENABLED=false                ミドルウェア自体を追加しません (APM サーバーが無い環境用)
+# ローカルで負荷試験をする場合は elastic-apm/intake_stub.py を APM サーバーの代わりに使えます
+#
+# sql_app/apm.py と code/apm.py は同じ内容です (変更する場合は両方を変更してください)
+# code/ はコンテナに単独でマウントして起動するため (docker-compose.yml)、共通のモジュールを import できません
+import os
+
+APM_DEFAULTS = {
+    "SERVER_URL": "http://127.0.0.1:8200",
+    "TRANSACTION_SAMPLE_RATE": 1.0,
+    "TRANSACTION_MAX_SPANS": 500,
+    # これより短い span はスタックトレースを取得しません
+    "SPAN_STACK_TRACE_MIN_DURATION": "5ms",
+}
+
+
+def apm_enabled() -> bool:
+    return os.getenv("ELASTIC_APM_ENABLED", "true").lower() not in ("false", "0", "off", "no")
+
+
+# APM が有効な場合のみ、クライアントを作成してミドルウェアを追加します
+def install_apm(app, service_name: str, **settings):
+    if not apm_enabled():
+        return None
+    # 無効な場合は elasticapm 自体を import しません (起動時間を短くするため)
+    from elasticapm.contrib.starlette import make_apm_client, ElasticAPM
+
+    client = make_apm_client({**APM_DEFAULTS, "SERVICE_NAME": service_name, **settings})
+    app.add_middleware(ElasticAPM, client=client)
+    return client
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# DB操作 (sql_app/crud.py と同じ構成)
+from typing import List
+
+from sqlalchemy.orm import Session
+
+from model import UserTable, User, UserUpdateResult
+
+# 1クエリの IN 句に含める id の最大数
+# MySQL の max_allowed_packet や SQLite の変数上限を超えないように分割します
+BULK_CHUNK_SIZE = 1000
+
+
+# 複数のユーザ情報をまとめて更新します
+# 対象 id はチャンク単位で1クエリで読み込み、コミットは最後に1回だけ行います
+def update_users(db: Session, users: List[User], chunk_size: int = BULK_CHUNK_SIZE):
+    results = []
+    try:
+        for start in range(0, len(users), chunk_size):
+            chunk = users[start:start + chunk_size]
+            ids = {new_user.id for new_user in chunk}
+            found = {
+                user.id: user
+                for user in db.query(UserTable).filter(UserTable.id.in_(ids))
+            }
+            for new_user in chunk:
+                user = found.get(new_user.id)
+                if user is None:
+                    results.append(UserUpdateResult(id=new_user.id, status="missing"))
+                    continue
+                user.name = new_user.name
+                user.age = new_user.age
+                results.append(UserUpdateResult(id=new_user.id, status="updated"))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return results
@@ -1,31 +1,119 @@
 # -*- coding: utf-8 -*-
 # DBへの接続設定
+import os
+import threading
+import time
+
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 
 
-# 接続したいDBの基本情報を設定
-user_name = "user"
-password = "password"
-host = "fastapi-mysql"  # docker-composeで定義したMySQLのサービス名
-database_name = "sample_db"
+# 接続したいDBの基本情報を設定 (環境変数で上書きできます)
+user_name = os.getenv("DB_USER", "user")
+password = os.getenv("DB_PASSWORD", "password")
+host = os.getenv("DB_HOST", "fastapi-mysql")  # docker-composeで定義したMySQLのサービス名
+database_name = os.getenv("DB_NAME", "sample_db")
 
-DATABASE = 'mysql+pymysql://%s:%s@%s/%s?charset=utf8' % (
+# DATABASE_URL を指定した場合はそちらを優先します
+DATABASE = os.getenv("DATABASE_URL") or 'mysql+pymysql://%s:%s@%s/%s?charset=utf8' % (
     user_name,
     password,
     host,
     database_name,
 )
 
+# コネクションプールの設定
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# MySQL の wait_timeout で切断される前に接続を作り直します [sec]
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+# チェックアウト時に接続が生きているか確認します
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# SQL のログ出力 (リクエスト処理中に同期で標準出力に書かれるため、本番では無効にします)
+ECHO = os.getenv("DB_ECHO", "0") == "1"
+
+# チェックアウトの待ち時間の集計
+_wait_lock = threading.Lock()
+_wait_stats = {"wait_count": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+
+# 接続の取得にかかった時間を記録する QueuePool
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            elapsed = time.perf_counter() - start
+            with _wait_lock:
+                _wait_stats["wait_count"] += 1
+                _wait_stats["wait_seconds_total"] += elapsed
+                _wait_stats["wait_seconds_max"] = max(_wait_stats["wait_seconds_max"], elapsed)
+
+
+def create_db_engine(url: str = DATABASE, **kwargs):
+    settings = dict(
+        poolclass=TimedQueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=POOL_PRE_PING,
+        echo=ECHO,
+    )
+    settings.update(kwargs)
+    return create_engine(url, **settings)
+
+
 # DBとの接続
-ENGINE = create_engine(
-    DATABASE,
-    encoding="utf-8",
-    echo=True
+# 文字コードは DATABASE の charset で指定します (SQLAlchemy 2.0 で encoding 引数は廃止)
+ENGINE = create_db_engine()
+
+# launcher.py で import 後に fork した場合、親プロセスのプールの接続を子プロセスで使わないようにします
+# @see https://docs.sqlalchemy.org/en/20/core/pooling.html#using-connection-pools-with-multiprocessing-or-os-fork
+os.register_at_fork(after_in_child=lambda: ENGINE.dispose(close=False))
+
+
+# コネクションプールの利用状況
+def pool_stats(engine=ENGINE):
+    pool = engine.pool
+    with _wait_lock:
+        stats = dict(_wait_stats)
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        **stats,
+    }
+
+
+# リクエストごとのSessionの作成に使用します
+SessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=ENGINE
 )
 
-# Sessionの作成
+
+# Dependency
+# リクエストごとに新しいセッションを作り、処理後は必ず閉じます
+# 例外が発生した場合はコミットされていない変更をロールバックします
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+# Sessionの作成 (スレッドローカル。model.py の Base.query で使用します)
 session = scoped_session(
     # ORM実行時の設定。自動コミットするか、自動反映するか
     sessionmaker(
@@ -1,16 +1,15 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from typing import List  # ネストされたBodyを定義するために必要
+from sqlalchemy.orm import Session
 from starlette.middleware.cors import CORSMiddleware  # CORSを回避するために必要
-from db import session  # DBと接続するためのセッション
-from model import UserTable, User  # 今回使うモデルをインポート
+from db import get_db, pool_stats  # DBと接続するためのセッション
+from model import UserTable, User, UserUpdateResult  # 今回使うモデルをインポート
+import crud
+from apm import install_apm
 
-from elasticapm.contrib.starlette import make_apm_client, ElasticAPM
-
-elastic_apm = make_apm_client({
-    'SERVER_URL': 'http://127.0.0.1:8200'
-})
 app = FastAPI()
-app.add_middleware(ElasticAPM, client=elastic_apm)
+# サンプリング率などは ELASTIC_APM_* 環境変数で変更できます (apm.py)
+elastic_apm = install_apm(app, "code")
 
 # CORSを回避するために設定
 app.add_middleware(
@@ -23,17 +22,25 @@ app.add_middleware(
 
 
 # ----------APIの実装------------
+# DBアクセスはブロッキングI/Oのため、ルートはすべて通常の def で定義します
+# (スレッドプールで実行され、イベントループを止めません)
+# コネクションプールの利用状況 (内部用)
+@app.get("/internal/pool-stats", include_in_schema=False)
+def read_pool_stats():
+    return pool_stats()
+
+
 # テーブルにいる全ユーザ情報を取得 GET
 @app.get("/users")
-def read_users():
-    users = session.query(UserTable).all()
+def read_users(db: Session = Depends(get_db)):
+    users = db.query(UserTable).all()
     return users
 
 
 # idにマッチするユーザ情報を取得 GET
 @app.get("/users/{user_id}")
-def read_user(user_id: int):
-    user = session.query(UserTable). \
+def read_user(user_id: int, db: Session = Depends(get_db)):
+    user = db.query(UserTable). \
         filter(UserTable.id == user_id).first()
     return user
 
@@ -42,22 +49,18 @@ def read_user(user_id: int):
 @app.post("/user")
 # クエリでnameとstrを受け取る
 # /user?name="三郎"&age=10
-async def create_user(name: str, age: int):
+def create_user(name: str, age: int, db: Session = Depends(get_db)):
     user = UserTable()
     user.name = name
     user.age = age
-    session.add(user)
-    session.commit()
+    db.add(user)
+    db.commit()
 
 
 # 複数のユーザ情報を更新 PUT
-@app.put("/users")
+@app.put("/users", response_model=List[UserUpdateResult])
 # modelで定義したUserモデルのリクエストbodyをリストに入れた形で受け取る
 # users=[{"id": 1, "name": "一郎", "age": 16},{"id": 2, "name": "二郎", "age": 20}]
-async def update_users(users: List[User]):
-    for new_user in users:
-        user = session.query(UserTable). \
-            filter(UserTable.id == new_user.id).first()
-        user.name = new_user.name
-        user.age = new_user.age
-        session.commit()
+# 存在しない id は更新せず status="missing" として返します
+def update_users(users: List[User], db: Session = Depends(get_db)):
+    return crud.update_users(db, users)
@@ -21,6 +21,12 @@ class User(BaseModel):
     age: int
 
 
+# PUT /users の結果 (1行ごとに updated / missing を返す)
+class UserUpdateResult(BaseModel):
+    id: int
+    status: str
+
+
 def main():
     # テーブルが存在しなければ、テーブルを作成
     Base.metadata.create_all(bind=ENGINE)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# APM Server の代わりにイベントを受け取って数えるだけのサーバー
+# APM サーバー (Elasticsearch / Kibana) を起動せずに、トレースを有効にしたまま負荷試験をするために使います
+# - POST /intake/v2/events  NDJSON (gzip / deflate) を受け取り、種類 (transaction, span など) ごとに数えます
+# - GET  /                  サーバー情報 (エージェントがバージョンの確認に使用します)
+# - GET  /stats             受け取ったイベント数 (DELETE /stats で 0 に戻します)
+#
+# % python elastic-apm/intake_stub.py --port 8200
+# % ELASTIC_APM_SERVER_URL=http://127.0.0.1:8200 uvicorn sql_app.main:app
+# @see https://www.elastic.co/guide/en/apm/server/current/events-api.html
+import argparse
+import gzip
+import json
+import threading
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVER_INFO = {"build_date": "2024-01-01T00:00:00Z", "build_sha": "stub", "version": "8.11.0"}
+
+
+class IntakeStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = Counter()
+        self.requests = 0
+        self.bytes = 0
+
+    def add(self, events: Counter, size: int):
+        with self._lock:
+            self._events.update(events)
+            self.requests += 1
+            self.bytes += size
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "bytes": self.bytes, "events": dict(self._events)}
+
+    def reset(self):
+        with self._lock:
+            self._events.clear()
+            self.requests = 0
+            self.bytes = 0
+
+
+class IntakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b"".join(chunks)
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _reply(self, status: int, body: dict = None):
+        data = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._reply(200, self.stats.snapshot())
+        elif self.path.startswith("/config/v1/agents"):
+            # 中央設定 (central config) は使いません
+            self._reply(200, {})
+        else:
+            self._reply(200, SERVER_INFO)
+
+    def do_DELETE(self):
+        if self.path == "/stats":
+            self.stats.reset()
+            self._reply(200, self.stats.snapshot())
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self._read_body()
+        if not self.path.startswith("/intake/v2/"):
+            self._reply(200, {})
+            return
+        encoding = self.headers.get("Content-Encoding", "").lower()
+        if encoding == "gzip":
+            data = gzip.decompress(body)
+        elif encoding == "deflate":
+            data = zlib.decompress(body)
+        else:
+            data = body
+        events = Counter()
+        for line in data.splitlines():
+            if line.strip():
+                events.update(json.loads(line).keys())
+        self.stats.add(events, len(body))
+        self._reply(202)
+
+
+def create_server(host: str = "127.0.0.1", port: int = 8200) -> ThreadingHTTPServer:
+    handler = type("Handler", (IntakeHandler,), {"stats": IntakeStats()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the APM Server intake API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8200)
+    args = parser.parse_args()
+    server = create_server(args.host, args.port)
+    print("APM intake stub listening on http://%s:%d" % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# response_model を使うルートのレスポンスを高速にシリアライズします
+# @see https://fastapi.tiangolo.com/advanced/custom-response/
+# @see https://fastapi.tiangolo.com/advanced/custom-request-and-route/
+#
+# 通常の FastAPI は、ハンドラの戻り値を response_model で再検証し、
+# jsonable_encoder で dict / list に変換してから json.dumps します
+# FastResponseRoute では
+# - 戻り値がすでに response_model のインスタンスであれば再検証しません
+# - それ以外 (dict, ORM オブジェクト, 別のモデル) は response_model への変換だけを行います
+# - jsonable_encoder を通さず、ujson (FAST_RESPONSE_ENCODER=orjson の場合は orjson) で直接 bytes にします
+#
+# 使い方 (ルートごとに opt-in)
+#     router = APIRouter(route_class=FastResponseRoute)
+#     @router.post("/items/", response_model=Item)
+import asyncio
+import datetime
+import decimal
+import enum
+import functools
+import os
+import uuid
+from typing import List, Union, get_args, get_origin
+
+import ujson
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, ValidationError
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+FAST_RESPONSE_ENCODER = os.getenv("FAST_RESPONSE_ENCODER", "ujson")
+
+
+# ujson / orjson が直接扱えない値の変換
+def _default(obj):
+    if isinstance(obj, BaseModel):
+        return obj.dict(by_alias=True)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+def dumps(content) -> bytes:
+    if FAST_RESPONSE_ENCODER == "orjson" and orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return ujson.dumps(
+        content, ensure_ascii=False, escape_forward_slashes=False, default=_default
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+# 1件を response_model に変換します (変換出来ない場合は ValidationError / TypeError)
+def _to_model(model, value):
+    if type(value) is model:
+        return value
+    if isinstance(value, BaseModel):
+        return model.parse_obj(value.dict())
+    if isinstance(value, dict) or not model.__config__.orm_mode:
+        return model.parse_obj(value)
+    return model.from_orm(value)
+
+
+# response_model から変換関数を作ります (BaseModel と List[BaseModel] のみ対応)
+def _build_converter(response_model):
+    if isinstance(response_model, type) and issubclass(response_model, BaseModel):
+        return functools.partial(_to_model, response_model)
+    if get_origin(response_model) in (list, List):
+        (item_model,) = get_args(response_model)
+        if isinstance(item_model, type) and issubclass(item_model, BaseModel):
+            return lambda values: [_to_model(item_model, value) for value in values]
+    return None
+
+
+class FastResponseRoute(APIRoute):
+    def __init__(self, path, endpoint, **kwargs):
+        kwargs.setdefault("response_class", FastJSONResponse)
+        super().__init__(path, endpoint, **kwargs)
+        self.fast_converter = None
+        # include / exclude などを指定したルートは通常の処理に任せます
+        if not any([
+            self.response_model_include, self.response_model_exclude,
+            self.response_model_exclude_unset, self.response_model_exclude_defaults,
+            self.response_model_exclude_none,
+        ]):
+            self.fast_converter = _build_converter(self.response_model)
+        if self.fast_converter is None:
+            return
+        # リクエストハンドラは dependant.call を呼び出すため、これを差し替えます
+        call = self.dependant.call
+        if asyncio.iscoroutinefunction(call):
+            @functools.wraps(call)
+            async def fast_call(**values):
+                return self.render_fast(await call(**values), values)
+        else:
+            @functools.wraps(call)
+            def fast_call(**values):
+                return self.render_fast(call(**values), values)
+        self.dependant.call = fast_call
+
+    # 戻り値を FastJSONResponse にします
+    # 変換出来ない場合はそのまま返し、FastAPI の通常の検証に任せます (エラーの形式を変えないため)
+    def render_fast(self, result, values: dict) -> Union[FastJSONResponse, object]:
+        if isinstance(result, Response):
+            return result
+        try:
+            content = self.fast_converter(result)
+        except (ValidationError, TypeError, ValueError):
+            return result
+        response = FastJSONResponse(content, status_code=self.status_code or 200)
+        # `response: Response` 引数で設定されたヘッダ・ステータスコードを引き継ぎます
+        sub_response = values.get(self.dependant.response_param_name)
+        if sub_response is not None:
+            if sub_response.status_code:
+                response.status_code = sub_response.status_code
+            # Set-Cookie など同じ名前のヘッダが複数あっても、すべて引き継ぎます (FastAPI と同じ)
+            response.headers.raw.extend(
+                (key, value) for key, value in sub_response.headers.raw if key != b"content-length"
+            )
+        return response
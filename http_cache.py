@@ -0,0 +1,73 @@
+# 事前に生成したレスポンス (bytes) を返すための共通処理
+# - Accept-Encoding に応じた圧縮済みデータの選択
+# - ETag / If-None-Match による 304 Not Modified
+# @see https://developer.mozilla.org/ja/docs/Web/HTTP/Headers/Accept-Encoding
+# @see https://developer.mozilla.org/ja/docs/Web/HTTP/Headers/If-None-Match
+import gzip
+import hashlib
+import zlib
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# 優先する順に並べています
+ENCODINGS = ("br", "gzip")
+# compress_variants が作る圧縮方式
+AVAILABLE_ENCODINGS = tuple(e for e in ENCODINGS if e != "br" or brotli is not None)
+# decompress が送出する例外 (壊れた・途中までのデータ)
+DECOMPRESS_ERRORS = (OSError, EOFError, zlib.error) + ((brotli.error,) if brotli is not None else ())
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+# 圧縮済みのデータを作ります (brotli が無い場合は gzip のみ)
+# gzip の mtime を 0 にして、同じ内容からは常に同じ bytes (同じ ETag) になるようにします
+def compress_variants(body: bytes) -> dict:
+    variants = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=11)
+    return variants
+
+
+# compress_variants で圧縮したデータを展開します
+def decompress(encoding: str, data: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.decompress(data)
+    return gzip.decompress(data)
+
+
+# Accept-Encoding から使用する圧縮方式を選びます (使えるものが無い場合は None)
+def select_encoding(accept_encoding: str, available) -> str:
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+# If-None-Match にいずれかの ETag が含まれているか (弱い比較)
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == etag:
+            return True
+    return False
@@ -0,0 +1,161 @@
+# アイテムのインメモリストア (main.py の items, main_b.py の fake_db)
+# - レコードは __slots__ のクラスで、更新時は新しいレコードに置き換えます (コピーオンライト)
+#   読み込みはロックを取らず、その時点のレコードをそのまま返します
+# - 書き込みはロックで直列化し、レコードごとのバージョンを1ずつ増やします
+# - バージョンから ETag を作り、If-Match が一致しない更新は PreconditionFailed にします
+# - 名前・タグの副インデックスを持ちます
+#   キーごとの集合は書き込みのロック内で直接変更し (1件の書き込みは O(変更したキーの数))、
+#   読み込みには変更後に最初に読まれたときに作るスナップショット (frozenset) を返します
+# - subscribe で登録した関数は、書き込みのたびに (古いレコード, 新しいレコード) で呼ばれます
+#   (書き込みのロック内で呼ばれるため、ストアと同じ順序で反映されます。検索インデックスなどに使用します)
+import threading
+
+
+# 既に同じ id のアイテムがある場合に送出します
+class ItemExists(Exception):
+    pass
+
+
+# If-Match が現在の ETag と一致しない場合に送出します (412 を返すために使用します)
+class PreconditionFailed(Exception):
+    pass
+
+
+class ItemRecord:
+    __slots__ = ("id", "version", "name", "tags", "data")
+
+    def __init__(self, item_id: str, version: int, name, tags: frozenset, data: dict):
+        self.id = item_id
+        self.version = version
+        self.name = name
+        self.tags = tags
+        # 変更しないでください (更新は ItemStore.put で新しいレコードを作ります)
+        self.data = data
+
+    @property
+    def etag(self) -> str:
+        return '"%d"' % self.version
+
+
+# 副インデックス (キー → アイテムの id の集合)
+class _Index:
+    __slots__ = ("_ids", "_snapshots", "_lock")
+
+    def __init__(self, lock: threading.Lock):
+        self._ids = {}
+        self._snapshots = {}
+        self._lock = lock
+
+    # add / remove は書き込みのロック内で呼びます
+    def add(self, key, item_id: str):
+        if key is not None:
+            self._ids.setdefault(key, set()).add(item_id)
+            self._snapshots.pop(key, None)
+
+    def remove(self, key, item_id: str):
+        ids = self._ids.get(key)
+        if ids is None:
+            return
+        ids.discard(item_id)
+        if not ids:
+            del self._ids[key]
+        self._snapshots.pop(key, None)
+
+    # スナップショットがあればロックを取らずに返します
+    # (書き込みと同時に読んだ場合は、書き込み前のスナップショットになることがあります)
+    def get(self, key) -> frozenset:
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            ids = self._ids.get(key)
+            if ids is None:
+                # 存在しないキーはスナップショットを保持しません
+                return frozenset()
+            snapshot = self._snapshots[key] = frozenset(ids)
+            return snapshot
+
+
+def _etag_matches(if_match: str, record: ItemRecord) -> bool:
+    if if_match.strip() == "*":
+        return record is not None
+    if record is None:
+        return False
+    return record.etag in [tag.strip() for tag in if_match.split(",")]
+
+
+class ItemStore:
+    def __init__(self, name_field: str = "name", tags_field: str = "tags"):
+        self.name_field = name_field
+        self.tags_field = tags_field
+        self._records = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._by_name = _Index(self._lock)
+        self._by_tag = _Index(self._lock)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._records
+
+    def subscribe(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+            for record in self._records.values():
+                listener(None, record)
+
+    def get(self, item_id: str) -> ItemRecord:
+        return self._records.get(item_id)
+
+    def values(self) -> list:
+        return list(self._records.values())
+
+    # インデックスを読んだ後に更新されたレコードは除きます
+    def find_by_name(self, name: str) -> list:
+        records = (self._records.get(item_id) for item_id in self._by_name.get(name))
+        return [record for record in records if record is not None and record.name == name]
+
+    def find_by_tag(self, tag: str) -> list:
+        records = (self._records.get(item_id) for item_id in self._by_tag.get(tag))
+        return [record for record in records if record is not None and tag in record.tags]
+
+    # 新しいアイテムを追加します
+    def create(self, item_id: str, data: dict) -> ItemRecord:
+        with self._lock:
+            if item_id in self._records:
+                raise ItemExists(item_id)
+            return self._write(item_id, None, dict(data))
+
+    # 既存のアイテムには changes をマージし、無ければ作成します
+    # 戻り値は (レコード, 作成したかどうか)
+    def put(self, item_id: str, changes: dict, if_match: str = None):
+        with self._lock:
+            current = self._records.get(item_id)
+            if if_match is not None and not _etag_matches(if_match, current):
+                raise PreconditionFailed(item_id)
+            data = dict(changes) if current is None else {**current.data, **changes}
+            return self._write(item_id, current, data), current is None
+
+    def _write(self, item_id: str, current: ItemRecord, data: dict) -> ItemRecord:
+        record = ItemRecord(
+            item_id,
+            1 if current is None else current.version + 1,
+            data.get(self.name_field),
+            frozenset(data.get(self.tags_field) or ()),
+            data,
+        )
+        old_name = None if current is None else current.name
+        old_tags = frozenset() if current is None else current.tags
+        if old_name != record.name:
+            self._by_name.remove(old_name, item_id)
+            self._by_name.add(record.name, item_id)
+        for tag in old_tags - record.tags:
+            self._by_tag.remove(tag, item_id)
+        for tag in record.tags - old_tags:
+            self._by_tag.add(tag, item_id)
+        self._records[item_id] = record
+        for listener in self._listeners:
+            listener(current, record)
+        return record
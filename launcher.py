@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+# 本番用の起動スクリプト (uvicorn のワーカーを複数のプロセスで起動します)
+# - ワーカー数の既定は CPU のコア数です (WEB_CONCURRENCY で変更できます)
+# - イベントループは uvloop、HTTP パーサーは httptools を使います
+#   (インストールされていない場合は asyncio と h11 を使い、警告を出します)
+# - アプリは fork の前に親プロセスで import し (preload)、gc.freeze() の後に fork します
+#   import したモジュールのメモリはワーカー間で copy-on-write で共有されます
+# - SO_REUSEPORT が使える場合は、ワーカーごとに listen するソケットを作り、接続の振り分けをカーネルに任せます
+#   ソケットは親プロセスが保持するため、ワーカーの入れ替え中に届いた接続も取りこぼしません
+# - SIGTERM / SIGINT を受けると新しい接続の受け付けを止め、処理中のリクエストが終わるのを待って終了します
+#   graceful_timeout を過ぎても終わらないワーカーは SIGKILL します (もう一度シグナルを送った場合も同様です)
+# - max_requests 件を処理したワーカーは終了させ、新しいワーカーに入れ替えます (メモリリーク対策)
+#   全てのワーカーが同時に入れ替わらないよう、件数に 0〜max_requests_jitter の乱数を足します
+# - ワーカーごとの処理件数と RPS を stats_interval 秒ごとにログと stats_file (JSON) に出力します
+#
+# 複数ワーカーで起動できるのは、状態をプロセスの外 (DB) に持つアプリだけです
+# - sql_app.main, code/main: データは DB にあるため複数ワーカーで起動できます
+#   ただしレート制限 (sql_app) やプールの統計はワーカーごとのため、全体の上限はワーカー数倍になります
+# - main: アイテム・検索インデックス・レスポンスキャッシュ・レート制限をプロセスのメモリに持つため、1ワーカーのみです
+#   アプリの app.state.launcher_max_workers でワーカー数の上限を宣言します (超える指定は上限に減らして警告します。
+#   --no-preload の場合は親プロセスで確認できないため、上限を超えたワーカーが起動に失敗し、全体を終了します)
+#
+# % python launcher.py main:app --host 0.0.0.0 --port 8000
+# % python launcher.py sql_app.main:app --workers 4 --max-requests 10000 --max-requests-jitter 1000
+# % python launcher.py --app-dir code main:app
+# @see https://www.uvicorn.org/deployment/
+# @see https://docs.gunicorn.org/en/stable/design.html
+import argparse
+import gc
+import importlib.util
+import json
+import logging.config
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from multiprocessing.sharedctypes import RawArray
+
+import uvicorn
+from uvicorn.config import LOGGING_CONFIG
+from uvicorn.importer import import_from_string
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def _cpu_count() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+LAUNCHER_WORKERS = int(os.getenv("WEB_CONCURRENCY", "0")) or _cpu_count()
+# 0 の場合はワーカーを入れ替えません
+LAUNCHER_MAX_REQUESTS = int(os.getenv("LAUNCHER_MAX_REQUESTS", "0"))
+LAUNCHER_MAX_REQUESTS_JITTER = int(os.getenv("LAUNCHER_MAX_REQUESTS_JITTER", "0"))
+# SIGTERM を受けてから、処理中のリクエストを待つ時間の上限 [秒]
+LAUNCHER_GRACEFUL_TIMEOUT = float(os.getenv("LAUNCHER_GRACEFUL_TIMEOUT", "30"))
+# ワーカーごとの RPS を出力する間隔 [秒] (0 の場合は終了時のみ)
+LAUNCHER_STATS_INTERVAL = float(os.getenv("LAUNCHER_STATS_INTERVAL", "60"))
+LAUNCHER_REUSE_PORT = os.getenv("LAUNCHER_REUSE_PORT", "1") == "1"
+
+# lifespan の startup に失敗したワーカーの終了コード (uvicorn と同じ値)
+# 入れ替えても同じ結果になるため、起動スクリプト全体を終了します
+_STARTUP_FAILURE = 3
+
+
+# ワーカーごとの処理件数を共有メモリに数えます
+class _RequestCounter:
+    def __init__(self, app, counters, slot: int):
+        self.app = app
+        self.counters = counters
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.counters[self.slot] += 1
+        await self.app(scope, receive, send)
+
+
+# アプリが宣言したワーカー数の上限 (宣言していない場合は None)
+def max_workers(app):
+    return getattr(getattr(app, "state", None), "launcher_max_workers", None)
+
+
+def _implementation(name: str, fallback: str) -> str:
+    module = {"uvloop": "uvloop", "httptools": "httptools"}.get(name)
+    if module and importlib.util.find_spec(module) is None:
+        logger.warning("%s is not installed, using %s", module, fallback)
+        return fallback
+    return name
+
+
+class Launcher:
+    def __init__(
+            self,
+            app,
+            host: str = "127.0.0.1",
+            port: int = 8000,
+            workers: int = LAUNCHER_WORKERS,
+            loop: str = "uvloop",
+            http: str = "httptools",
+            preload: bool = True,
+            reuse_port: bool = LAUNCHER_REUSE_PORT,
+            max_requests: int = LAUNCHER_MAX_REQUESTS,
+            max_requests_jitter: int = LAUNCHER_MAX_REQUESTS_JITTER,
+            graceful_timeout: float = LAUNCHER_GRACEFUL_TIMEOUT,
+            stats_interval: float = LAUNCHER_STATS_INTERVAL,
+            stats_file: str = None,
+            backlog: int = 2048,
+            timeout_keep_alive: int = 5,
+            log_level: str = "info",
+            access_log: bool = True,
+    ):
+        # "module:attribute" またはアプリのオブジェクト (オブジェクトの場合は常に preload と同じです)
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.loop = loop
+        self.http = http
+        self.preload = preload
+        self.reuse_port = reuse_port and hasattr(socket, "SO_REUSEPORT")
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.stats_interval = stats_interval
+        self.stats_file = stats_file
+        self.backlog = backlog
+        self.timeout_keep_alive = timeout_keep_alive
+        self.log_level = log_level
+        self.access_log = access_log
+
+        self.sockets = []
+        # {pid: ワーカーの番号}
+        self.children = {}
+        self._allocate_slots()
+        self.should_exit = False
+        self.force_exit = False
+        self.exit_code = 0
+
+    def _allocate_slots(self):
+        self.pids = [None] * self.workers
+        # 実行中のワーカーの処理件数 (ワーカーが書き込みます) と、終了したワーカーの分を含む累計
+        self.counters = RawArray("Q", self.workers)
+        self.totals = [0] * self.workers
+        self.restarts = [0] * self.workers
+        self._reported = [0] * self.workers
+
+    # アプリが宣言したワーカー数の上限に合わせます (fork の前に呼びます)
+    def limit_workers(self):
+        limit = max_workers(self.app)
+        if limit and self.workers > limit:
+            logger.warning(
+                "The app keeps its state in process memory, using %d worker(s) instead of %d", limit, self.workers
+            )
+            self.workers = limit
+            self._allocate_slots()
+
+    def run(self) -> int:
+        logging.config.dictConfig(LOGGING_CONFIG)
+        logger.setLevel(self.log_level.upper())
+        self.loop = _implementation(self.loop, "asyncio")
+        self.http = _implementation(self.http, "h11")
+        logger.info("Started parent process [%d]", os.getpid())
+        if self.preload and isinstance(self.app, str):
+            self.app = import_from_string(self.app)
+        self.limit_workers()
+        self._bind()
+        if not isinstance(self.app, str):
+            # import 時に作られたオブジェクトを GC の対象から外し、fork 後の参照カウント以外の書き込みを減らします
+            # @see https://docs.python.org/ja/3/library/gc.html#gc.freeze
+            gc.collect()
+            gc.freeze()
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self._handle_exit)
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        started_at = reported_at = time.monotonic()
+        try:
+            while not self.should_exit:
+                self._reap()
+                now = time.monotonic()
+                if self.stats_interval and now - reported_at >= self.stats_interval:
+                    self._report(now - reported_at)
+                    reported_at = now
+                time.sleep(0.1)
+        finally:
+            self._drain()
+            # 終了時は起動からの平均を出力します
+            self._reported = [0] * self.workers
+            self._report(time.monotonic() - started_at)
+            logger.info("Finished parent process [%d]", os.getpid())
+        return self.exit_code
+
+    def _handle_exit(self, sig, frame):
+        if self.should_exit:
+            self.force_exit = True
+        self.should_exit = True
+
+    def _bind(self):
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        port = self.port
+        for _ in range(self.workers if self.reuse_port else 1):
+            # proto を明示します。0 のままだと asyncio が受け付けた接続に TCP_NODELAY を設定せず、
+            # Nagle アルゴリズムと遅延 ACK でレスポンスごとに約 40ms 待たされます
+            sock = socket.socket(family, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((self.host, port))
+            sock.listen(self.backlog)
+            # port=0 の場合は、最初のソケットに割り当てられたポートを残りのソケットでも使います
+            port = sock.getsockname()[1]
+            self.sockets.append(sock)
+        self.port = port
+        logger.info(
+            "Listening on http://%s:%d with %d worker(s) (%s, %s%s)",
+            self.host, port, self.workers, self.loop, self.http, ", SO_REUSEPORT" if self.reuse_port else "",
+        )
+
+    def _spawn(self, slot: int):
+        self.counters[slot] = 0
+        limit = None
+        if self.max_requests:
+            limit = self.max_requests + random.randint(0, self.max_requests_jitter)
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._serve(slot, limit)
+            except SystemExit as exc:
+                code = exc.code if isinstance(exc.code, int) else 1
+            except BaseException:
+                logger.exception("Worker %d failed", slot + 1)
+                code = 1
+            finally:
+                logging.shutdown()
+            os._exit(code)
+        self.pids[slot] = pid
+        self.children[pid] = slot
+
+    # ワーカーのプロセスで実行します
+    def _serve(self, slot: int, limit: int):
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+        random.seed()
+        sock = self.sockets[slot if self.reuse_port else 0]
+        for other in self.sockets:
+            if other is not sock:
+                other.close()
+        app = import_from_string(self.app) if isinstance(self.app, str) else self.app
+        supported = max_workers(app)
+        if supported and slot >= supported:
+            logger.error("The app supports at most %d worker(s), run it with --workers %d", supported, supported)
+            sys.exit(_STARTUP_FAILURE)
+        config = uvicorn.Config(
+            _RequestCounter(app, self.counters, slot),
+            loop=self.loop,
+            http=self.http,
+            limit_max_requests=limit,
+            backlog=self.backlog,
+            timeout_keep_alive=self.timeout_keep_alive,
+            log_level=self.log_level,
+            access_log=self.access_log,
+        )
+        server = uvicorn.Server(config)
+        server.run(sockets=[sock])
+        if not server.started:
+            sys.exit(_STARTUP_FAILURE)
+
+    # 終了したワーカーを回収し、終了処理中でなければ入れ替えます
+    def _reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = self.children.pop(pid, None)
+            if slot is None:
+                continue
+            requests = self.counters[slot]
+            self.totals[slot] += requests
+            self.counters[slot] = 0
+            self.pids[slot] = None
+            code = os.waitstatus_to_exitcode(status)
+            if self.should_exit:
+                continue
+            if code == _STARTUP_FAILURE:
+                logger.error("Worker %d [%d] failed to boot, shutting down", slot + 1, pid)
+                self.should_exit = True
+                self.exit_code = 1
+                continue
+            if code == 0:
+                logger.info("Worker %d [%d] exited after %d requests, restarting", slot + 1, pid, requests)
+            else:
+                logger.warning("Worker %d [%d] exited with code %d, restarting", slot + 1, pid, code)
+            self.restarts[slot] += 1
+            self._spawn(slot)
+
+    def _drain(self):
+        # 親プロセスが持つソケットを閉じます (ワーカーが自分のソケットを閉じた時点で、接続の受け付けが止まります)
+        for sock in self.sockets:
+            sock.close()
+        logger.info("Waiting for %d worker(s) to finish", len(self.children))
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.children and not self.force_exit and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid, slot in list(self.children.items()):
+            logger.warning("Worker %d [%d] did not finish in time, killing", slot + 1, pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while self.children:
+            pid, _ = os.waitpid(next(iter(self.children)), 0)
+            slot = self.children.pop(pid)
+            self.totals[slot] += self.counters[slot]
+            self.counters[slot] = 0
+
+    def stats(self) -> list:
+        return [
+            {
+                "worker": slot + 1,
+                "pid": self.pids[slot],
+                "requests": self.totals[slot] + self.counters[slot],
+                "restarts": self.restarts[slot],
+            }
+            for slot in range(self.workers)
+        ]
+
+    # 前回からの経過時間 elapsed [秒] で割った RPS を出力します
+    def _report(self, elapsed: float):
+        workers = self.stats()
+        for slot, worker in enumerate(workers):
+            worker["rps"] = round((worker["requests"] - self._reported[slot]) / elapsed, 1) if elapsed else 0.0
+            self._reported[slot] = worker["requests"]
+            logger.info(
+                "Worker %d [%s]: %.1f req/s (%d requests, %d restarts)",
+                worker["worker"], worker["pid"], worker["rps"], worker["requests"], worker["restarts"],
+            )
+        rps = round(sum(worker["rps"] for worker in workers), 1)
+        logger.info("Total: %.1f req/s", rps)
+        if self.stats_file:
+            tmp = self.stats_file + ".tmp"
+            with open(tmp, mode="w") as f:
+                json.dump({"time": time.time(), "rps": rps, "workers": workers}, f)
+            os.replace(tmp, self.stats_file)
+
+
+def run(app, **kwargs) -> int:
+    return Launcher(app, **kwargs).run()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Run an ASGI app with multiple uvicorn workers")
+    parser.add_argument("app", help="module:attribute, e.g. main:app or sql_app.main:app")
+    parser.add_argument("--app-dir", default=".", help="directory added to sys.path (e.g. code)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=LAUNCHER_WORKERS)
+    parser.add_argument("--loop", choices=["uvloop", "asyncio"], default="uvloop")
+    parser.add_argument("--http", choices=["httptools", "h11"], default="httptools")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="import the app in each worker instead of before fork")
+    parser.add_argument("--no-reuse-port", dest="reuse_port", action="store_false", default=LAUNCHER_REUSE_PORT,
+                        help="share a single listening socket instead of one SO_REUSEPORT socket per worker")
+    parser.add_argument("--max-requests", type=int, default=LAUNCHER_MAX_REQUESTS)
+    parser.add_argument("--max-requests-jitter", type=int, default=LAUNCHER_MAX_REQUESTS_JITTER)
+    parser.add_argument("--graceful-timeout", type=float, default=LAUNCHER_GRACEFUL_TIMEOUT)
+    parser.add_argument("--stats-interval", type=float, default=LAUNCHER_STATS_INTERVAL)
+    parser.add_argument("--stats-file", help="write per-worker request counts and RPS to this JSON file")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--timeout-keep-alive", type=int, default=5)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-access-log", dest="access_log", action="store_false")
+    args = vars(parser.parse_args(argv))
+    sys.path.insert(0, os.path.abspath(args.pop("app_dir")))
+    sys.exit(run(args.pop("app"), **args))
+
+
+if __name__ == "__main__":
+    main()
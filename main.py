@@ -8,9 +8,10 @@
 # @see https://fastapi.tiangolo.com/tutorial/handling-errors/
 # @see https://fastapi.tiangolo.com/tutorial/security/first-steps/
 # @see https://fastapi.tiangolo.com/tutorial/middleware/
-import time
+import os
+import uuid
 from fastapi import FastAPI, Query, Path, Body, Header, status, \
-    HTTPException, Depends, Request, Security
+    HTTPException, Depends, Request, Response, Security, APIRouter
 # @see https://fastapi.tiangolo.com/tutorial/security/simple-oauth2/
 # @see https://fastapi.tiangolo.com/advanced/security/oauth2-scopes/
 from fastapi.security import (
@@ -26,12 +27,8 @@ from fastapi.middleware.cors import CORSMiddleware
 # from fastapi.middleware.trustedhost import TrustedHostMiddleware
 # @see https://fastapi.tiangolo.com/advanced/additional-status-codes/
 # @see https://fastapi.tiangolo.com/advanced/custom-response/
-from fastapi.responses import JSONResponse, RedirectResponse, \
-    StreamingResponse
+from fastapi.responses import JSONResponse, RedirectResponse, PlainTextResponse
 
-# @see https://fastapi.tiangolo.com/advanced/templates/
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 
 # @see https://fastapi.tiangolo.com/advanced/extending-openapi/
 from fastapi.openapi.utils import get_openapi
@@ -52,21 +49,51 @@ from typing import Optional, List, Set
 
 # @see https://fastapi.tiangolo.com/tutorial/security/oauth2-jwt/
 from datetime import datetime, timedelta
-import jwt
-from jwt import PyJWTError
-from passlib.context import CryptContext
 
-# @see https://www.elastic.co/guide/en/apm/agent/python/master/starlette-support.html
-from elasticapm.contrib.starlette import make_apm_client, ElasticAPM
+from token_cache import TokenCache
+from password_pool import PasswordPool, PasswordPoolBusy, get_pwd_context
+from fast_response import FastResponseRoute
+from item_store import ItemStore, PreconditionFailed
+from media_stream import media_response
+from batch import BatchIn, dispatch_batch
+from search_index import SEARCH_NEXT_CURSOR_HEADER, SearchIndex
+from openapi_cache import OpenAPIDocument
+from precompressed_static import PrecompressedStaticFiles
+from response_cache import ResponseCache, ResponseCacheMiddleware, cacheable
+from rate_limit import (
+    PRIORITY_BULK, PRIORITY_CRITICAL, RATE_LIMIT_BURST, RATE_LIMIT_ENABLED, RATE_LIMIT_RATE,
+    RateLimiter, RateLimitMiddleware, RateLimitRule, bearer_subject,
+)
+from timing_middleware import Metrics, TimingMiddleware
 
-# @see https://fastapi.tiangolo.com/tutorial/debugging/
-import uvicorn
+# 起動時間を短くするため、次のモジュールは使うときに import します
+# - jwt: トークンの発行・検証時 (create_access_token, verify_token)
+# - passlib / bcrypt: パスワードの検証時 (password_pool.get_pwd_context)
+# - jinja2: 最初のテンプレートの描画時 (get_templates)
+# - uvicorn: python main.py で起動した場合のみ
+# - elasticapm: 使用していません (有効にする場合は下のコメントを参照してください)
 
 # このような文字列を取得するには↓を実行
 # openssl rand -hex 32
 SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# 検証済みトークンのキャッシュ (件数 / 秒)
+TOKEN_CACHE_MAXSIZE = 10000
+TOKEN_CACHE_TTL = 300
+# bcrypt を実行するプロセス数 (0 の場合はイベントループ上で実行します) と、実行中 + 待ちの上限
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", os.cpu_count() or 1))
+PASSWORD_POOL_MAX_PENDING = int(os.getenv("PASSWORD_POOL_MAX_PENDING", "64"))
+# デプロイ時に書き出した OpenAPI スキーマ (python openapi_cache.py main:app openapi.json)
+OPENAPI_SCHEMA_FILE = os.getenv("OPENAPI_SCHEMA_FILE")
+OPENAPI_URL = "/openapi.json"
+# X-Process-Time ヘッダを付けるか (処理時間は /metrics でも確認できます)
+PROCESS_TIME_HEADER = os.getenv("PROCESS_TIME_HEADER", "1") == "1"
+METRICS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# GET のレスポンスキャッシュの容量 [bytes] (@cacheable を付けたルートのみ)
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# /fake-video-streamer で返すファイル (Range リクエストに対応します)
+VIDEO_FILE = os.getenv("VIDEO_FILE", "media/fake-video.mp4")
 
 
 class ModelName(str, Enum):
@@ -157,8 +184,14 @@ def fake_decode_token(token):
     return user
 
 
+# @see https://www.elastic.co/guide/en/apm/agent/python/master/starlette-support.html
+# from elasticapm.contrib.starlette import make_apm_client, ElasticAPM
 # elastic_apm = make_apm_client({})
-app = FastAPI(docs_url=None, redoc_url=None)
+# /openapi.json は事前に JSON 化したものを返すため、FastAPI 標準のルートは使いません
+app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+# アイテム (ItemStore)・検索インデックス・レスポンスキャッシュ・レート制限の状態をプロセスのメモリに持つため、
+# 複数のワーカーで起動するとワーカーごとに内容が食い違います。launcher.py は1ワーカーに制限します
+app.state.launcher_max_workers = 1
 # app.add_middleware(ElasticAPM, client=elastic_apm)
 # app.add_middleware(HTTPSRedirectMiddleware)
 # app.add_middleware(
@@ -167,11 +200,28 @@ app = FastAPI(docs_url=None, redoc_url=None)
 
 
 # @see https://fastapi.tiangolo.com/advanced/templates/
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
-
-
-items = {"foo": "The Foo Wrestlers"}
+# 圧縮済みのデータを返し、内容のハッシュを ETag にします
+static_files = PrecompressedStaticFiles(directory="static")
+app.mount("/static", static_files, name="static")
+# コンパイル結果はバイトコードキャッシュに、レンダリング結果はメモリに保持します
+# Jinja2 の import と環境の作成は最初の描画まで遅らせます
+templates = None
+
+
+def get_templates():
+    global templates
+    if templates is None:
+        from template_cache import CachedTemplates
+        templates = CachedTemplates(directory="templates")
+    return templates
+
+
+# PUT /items/{item_id} と GET /items-header/{item_id} で使用します
+items = ItemStore(name_field="name")
+items.create("foo", {"name": "The Foo Wrestlers"})
+# GET /items/?q= の検索用インデックス (items の更新時に単語の差分だけ更新されます)
+search_index = SearchIndex()
+items.subscribe(search_index.on_store_write)
 fake_db = {}
 fake_users_db = {
     "john_doe": {
@@ -189,6 +239,35 @@ origins = [
     "http://localhost",
     "http://localhost:8080",
 ]
+# CORS のヘッダはリクエストの Origin ごとに変わるため、キャッシュは CORS の内側に置きます
+response_cache = ResponseCache(max_bytes=RESPONSE_CACHE_MAX_BYTES)
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache, router=app.router)
+# bcrypt を実行するルートはクライアント (IP) ごとに厳しく制限し、それ以外は検証済みのトークンのユーザーごとに制限します
+# (トークンが無い・無効な場合は IP ごと。verified_username は後で定義します)
+# 過負荷時はドキュメント・内部用のルートを優先し、重いルートから 503 にします
+rate_limiter = RateLimiter(
+    rules=[
+        RateLimitRule("token", "/token", rate=1, burst=10, methods=("POST",)),
+        RateLimitRule("create_user", "/user/", rate=1, burst=10, methods=("POST",)),
+        RateLimitRule("api", "/*", rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST,
+                      key_func=bearer_subject(lambda token: verified_username(token))),
+    ],
+    priorities=[
+        ("/metrics", PRIORITY_CRITICAL),
+        ("/internal/*", PRIORITY_CRITICAL),
+        ("/docs", PRIORITY_CRITICAL),
+        ("/redoc", PRIORITY_CRITICAL),
+        (OPENAPI_URL, PRIORITY_CRITICAL),
+        ("/static/*", PRIORITY_CRITICAL),
+        ("/token", PRIORITY_BULK),
+        ("/user/", PRIORITY_BULK),
+        ("/batch", PRIORITY_BULK),
+        ("/fake-video-streamer", PRIORITY_BULK),
+    ],
+)
+# 429 / 503 にも CORS のヘッダが付くよう、CORS の内側に置きます
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -196,39 +275,57 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 最後に追加したミドルウェアが一番外側になるため、CORS の処理も含めて計測します
+metrics = Metrics()
+app.add_middleware(TimingMiddleware, metrics=metrics, header=PROCESS_TIME_HEADER)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_pool = PasswordPool(
+    workers=PASSWORD_POOL_WORKERS, max_pending=PASSWORD_POOL_MAX_PENDING
+)
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="/token",
     scopes={"me": "Read information about the current user.", "items": "Read items."},
 )
+# ユーザーを無効化・削除した場合は token_cache.invalidate_user(username) を呼び出します
+token_cache = TokenCache(maxsize=TOKEN_CACHE_MAXSIZE, ttl=TOKEN_CACHE_TTL)
 
 
 # @see https://fastapi.tiangolo.com/advanced/events/
+@app.on_event("startup")
+def startup_event():
+    # スキーマのファイルがあれば起動時に読み込みます (無い場合は最初のリクエストで生成します)
+    if OPENAPI_SCHEMA_FILE:
+        get_openapi_document()
+
+
 @app.on_event("shutdown")
 def shutdown_event():
+    password_pool.shutdown()
     with open("application.log", mode="a") as log:
         log.write("Application shutdown")
 
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 
-def authenticate_user(fake_db_param, username: str, password: str):
+# パスワードの検証 (bcrypt) は password_pool で実行します
+async def authenticate_user(fake_db_param, username: str, password: str):
     user = get_user(fake_db_param, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await password_pool.verify(password, user.hashed_password):
         return False
     return user
 
 
 def create_access_token(*, data: dict, expires_delta: timedelta = None):
+    import jwt
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -239,6 +336,35 @@ def create_access_token(*, data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
+# トークンを検証し (token_data, user) を返します (無効なトークンは None)
+# 検証結果はトークンの有効期限 (exp) を超えない範囲で token_cache に保持します
+def verify_token(token: str):
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
+    import jwt
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            return None
+        token_data = TokenData(scopes=payload.get("scopes", []), username=username)
+    except (jwt.PyJWTError, ValidationError):
+        return None
+    user = get_user(fake_users_db, username=token_data.username)
+    if user is None:
+        return None
+    token_cache.set(token, user.username, (token_data, user), exp=payload.get("exp"))
+    return token_data, user
+
+
+# レート制限のキー (検証結果は token_cache に入るため、ルートでの認証では再計算しません)
+def verified_username(token: str):
+    verified = verify_token(token)
+    return verified[1].username if verified else None
+
+
 # DBに該当ユーザーが存在しているかチェック
 async def get_current_user(
         security_scopes: SecurityScopes, token: str = Depends(oauth2_scheme)
@@ -252,18 +378,10 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": authenticate_value},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_scopes = payload.get("scopes", [])
-        token_data = TokenData(scopes=token_scopes, username=username)
-    except (PyJWTError, ValidationError):
-        raise credentials_exception
-    user = get_user(fake_users_db, username=token_data.username)
-    if user is None:
+    verified = verify_token(token)
+    if verified is None:
         raise credentials_exception
+    token_data, user = verified
     for scope in security_scopes.scopes:
         if scope not in token_data.scopes:
             raise HTTPException(
@@ -283,15 +401,13 @@ async def get_current_active_user(
     return current_user
 
 
-async def fake_video_streamer():
-    for i in range(10):
-        yield b"some fake video bytes"
-
-
 # @see https://fastapi.tiangolo.com/advanced/extending-openapi/
 def custom_openapi():
     if app.openapi_schema:
         return app.openapi_schema
+    if OPENAPI_SCHEMA_FILE:
+        app.openapi_schema = get_openapi_document().schema()
+        return app.openapi_schema
     openapi_schema = get_openapi(
         title="OpenAPI Custom title",
         version="2.5.0",
@@ -306,16 +422,33 @@ def custom_openapi():
 
 
 app.openapi = custom_openapi
+openapi_document = None
+
+
+def get_openapi_document():
+    global openapi_document
+    if openapi_document is None:
+        if OPENAPI_SCHEMA_FILE:
+            openapi_document = OpenAPIDocument.load(OPENAPI_SCHEMA_FILE)
+        else:
+            openapi_document = OpenAPIDocument.from_schema(app.openapi())
+    return openapi_document
+
+
+# JSON 化・圧縮済みのスキーマを返します (If-None-Match が一致すれば 304)
+@app.get(OPENAPI_URL, include_in_schema=False)
+async def read_openapi(request: Request):
+    return get_openapi_document().response(request)
 
 
 @app.get("/docs", include_in_schema=False)
 async def custom_swagger_ui_html():
     return get_swagger_ui_html(
-        openapi_url=app.openapi_url,
+        openapi_url=OPENAPI_URL,
         title=app.title + " - Swagger UI",
         oauth2_redirect_url=app.swagger_ui_oauth2_redirect_url,
-        swagger_js_url="/static/swagger-ui-bundle.js",
-        swagger_css_url="/static/swagger-ui.css",
+        swagger_js_url=static_files.versioned_url("/static", "swagger-ui-bundle.js"),
+        swagger_css_url=static_files.versioned_url("/static", "swagger-ui.css"),
     )
 
 
@@ -327,19 +460,40 @@ async def swagger_ui_redirect():
 @app.get("/redoc", include_in_schema=False)
 async def redoc_html():
     return get_redoc_html(
-        openapi_url=app.openapi_url,
+        openapi_url=OPENAPI_URL,
         title=app.title + " - ReDoc",
-        redoc_js_url="/static/redoc.standalone.js",
+        redoc_js_url=static_files.versioned_url("/static", "redoc.standalone.js"),
     )
 
 
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+# Prometheus のテキスト形式でルートごとの処理時間を返します
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type=METRICS_MEDIA_TYPE)
+
+
+# トークンキャッシュの利用状況 (内部用)
+@app.get("/internal/token-cache", include_in_schema=False)
+async def read_token_cache_stats():
+    return token_cache.stats()
+
+
+# レスポンスキャッシュの利用状況 (内部用)
+@app.get("/internal/response-cache", include_in_schema=False)
+async def read_response_cache_stats():
+    return response_cache.stats()
+
+
+# レート制限・同時実行数の状況 (内部用)
+@app.get("/internal/rate-limit", include_in_schema=False)
+async def read_rate_limit_stats():
+    return rate_limiter.stats()
+
+
+# パスワード検証用プロセスプールの利用状況 (内部用)
+@app.get("/internal/password-pool", include_in_schema=False)
+async def read_password_pool_stats():
+    return password_pool.stats()
 
 
 @app.post(
@@ -433,7 +587,14 @@ async def auth_authorize(
 
 @app.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(fake_users_db, form_data.username, form_data.password)
+    try:
+        user = await authenticate_user(fake_users_db, form_data.username, form_data.password)
+    except PasswordPoolBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress",
+            headers={"Retry-After": "1"},
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -449,6 +610,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
 
 @app.get("/")
+@cacheable(ttl=300)
 async def read_root():
     return {"Hello": "World"}
 
@@ -460,23 +622,29 @@ async def read_typer():
 
 @app.get("/fake-video-streamer")
 async def main():
-    return StreamingResponse(fake_video_streamer())
+    try:
+        return await media_response(VIDEO_FILE)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Video not found")
 
 
 @app.get("/items-header/{item_id}", tags=["items"])
-async def read_item_header(item_id: str):
-    if item_id not in items:
+@cacheable(ttl=60, tags=("item:{item_id}",))
+async def read_item_header(item_id: str, response: Response):
+    record = items.get(item_id)
+    if record is None:
         raise HTTPException(
             status_code=404,
             detail="Item not found",
             headers={"X-Error": "There goes my error"},
         )
-    return {"item": items[item_id]}
+    response.headers["ETag"] = record.etag
+    return {"item": record.data}
 
 
 @app.get("/items-template/{item_id}")
 async def read_item(request: Request, item_id: str):
-    return templates.TemplateResponse("item.html", {"request": request, "item_id": item_id})
+    return get_templates().render_response("item.html", {"request": request, "item_id": item_id})
 
 
 @app.get("/items/{item_id}", tags=["items"])
@@ -487,49 +655,78 @@ async def read_item(
     return {"item_id": item_id, "limit": limit}
 
 
+# If-Match を指定した場合は、ETag が一致するときだけ更新します (一致しなければ 412)
 @app.put("/items/{item_id}", tags=["items"])
-async def upsert_item(item_id: str, name: str = Body(None), size: int = Body(None)):
-    if item_id in items:
-        item = items[item_id]
-        item["name"] = name
-        item["size"] = size
-        return item
-    else:
-        item = {"name": name, "size": size}
-        items[item_id] = item
-        return JSONResponse(status_code=status.HTTP_201_CREATED, content=item)
+async def upsert_item(
+        item_id: str, response: Response, name: str = Body(None), size: int = Body(None),
+        if_match: str = Header(None),
+):
+    try:
+        record, created = items.put(item_id, {"name": name, "size": size}, if_match=if_match)
+    except PreconditionFailed:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="ETag mismatch")
+    response_cache.invalidate("item:%s" % item_id, "items")
+    if created:
+        return JSONResponse(
+            status_code=status.HTTP_201_CREATED, content=record.data, headers={"ETag": record.etag}
+        )
+    response.headers["ETag"] = record.etag
+    return record.data
 
 
 # http://127.0.0.1:8000/docs#/items/some_specific_id_you_define
 # http://127.0.0.1:8000/redoc#operation/some_specific_id_you_define
 # ↑ この url で参照出来るようになる
+# 検索結果は items の更新で変わるため、更新系のルートで "items" を invalidate します
 @app.get("/items/", tags=["items"], operation_id="some_specific_id_you_define")
+@cacheable(ttl=10, vary=("User-Agent",), tags=("items",))
 async def read_items(
+        response: Response,
         q: str = Query(
             None,
-            description="Query string for the items to search in the database that have a good match",
-            min_length=3,
+            description="Search words (all must match). A trailing `*` matches by prefix, e.g. `roc*`",
+            min_length=1,
             max_length=50,
-            regex="^fixed_query$",
-            deprecated=True,
         ),
+        limit: int = Query(20, ge=1, le=100),
+        cursor: str = Query(None, description="X-Next-Cursor of the previous page"),
         user_agent: str = Header(None)
 ):
-    results = {
+    if not q:
+        return {
+            "items": [
+                {"item_id": "Foo"},
+                {"item_id": "Bar"}
+            ],
+            "User-Agent": user_agent
+        }
+    try:
+        hits, next_cursor = search_index.search(q, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if next_cursor:
+        response.headers[SEARCH_NEXT_CURSOR_HEADER] = next_cursor
+    return {
         "items": [
-            {"item_id": "Foo"},
-            {"item_id": "Bar"}
+            {"item_id": item_id, "score": score, **items.get(item_id).data}
+            for item_id, score in hits
         ],
+        "q": q,
         "User-Agent": user_agent
     }
-    if q:
-        results.update({"q": q})
-    return results
+
+
+# response_model のインスタンスを返すルートは FastResponseRoute で再検証を省略します
+# (ルートはファイルの最後で app に追加します)
+fast_router = APIRouter(route_class=FastResponseRoute)
 
 
 # docstring での説明にも対応します
-@app.post("/items/", status_code=status.HTTP_201_CREATED, tags=["items"], response_model=Item, summary="Create an item")
+@fast_router.post(
+    "/items/", status_code=status.HTTP_201_CREATED, tags=["items"], response_model=Item, summary="Create an item"
+)
 async def create_item(
+        response: Response,
         item: Item = Body(
             ...,
             example={
@@ -559,6 +756,11 @@ async def create_item(
     - **tax**: if the item doesn't have tax, you can omit this
     - **tags**: a set of unique tag strings for this item
     """
+    # 保存すると search_index にも反映されます (GET /items/?q= で検索できます)
+    item_id = uuid.uuid4().hex
+    items.create(item_id, {**item.dict(), "tags": sorted(item.tags)})
+    response_cache.invalidate("items")
+    response.headers["Location"] = "/items-header/%s" % item_id
     return item
 
 
@@ -577,17 +779,19 @@ async def read_own_items(current_user: UserBase = Depends(get_current_active_use
 
 
 @app.get("/users/{user_id}", tags=["users"])
+@cacheable(ttl=300)
 async def read_user(user_id: str):
     return {"user_id": user_id}
 
 
-@app.post("/user/", response_model=UserOut, tags=["users"])
+@fast_router.post("/user/", response_model=UserOut, tags=["users"])
 async def create_user(*, user_in: UserIn):
     user_saved = fake_save_user(user_in)
     return user_saved
 
 
 @app.get("/model/{model_name}")
+@cacheable(ttl=300)
 async def get_model(model_name: ModelName):
     if model_name == ModelName.alexnet:
         return {"model_name": model_name, "message": "Deep Learning FTW!"}
@@ -597,12 +801,39 @@ async def get_model(model_name: ModelName):
 
 
 @app.get("/elements/", tags=["items"], deprecated=True)
+@cacheable(ttl=300)
 async def read_elements():
     return [{"item_id": "Foo"}]
 
 
+# 複数の API 呼び出しをまとめて実行します (サブリクエストは並行に実行します)
+# 認証はここで1回だけ行い、サブリクエストは token_cache の検証結果を使います
+@app.post("/batch", tags=["batch"])
+async def run_batch(batch_in: BatchIn, request: Request, authorization: str = Header(None)):
+    if authorization:
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or verify_token(token) is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+    body = await dispatch_batch(app, request.scope, batch_in.requests)
+    return Response(content=body, media_type="application/json")
+
+
+app.include_router(fast_router)
+
+
 # python main.py と呼ばれた時に実行されます
 # ↓ 次のように、別のファイルがインポートするときには実行されません
 # from main import app
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # @see https://fastapi.tiangolo.com/tutorial/debugging/
+    # 状態をプロセスのメモリに持つため、1ワーカーで起動します (app.state.launcher_max_workers)
+    # 複数ワーカーで起動できるアプリは launcher.py を参照してください
+    import sys
+
+    import launcher
+
+    sys.exit(launcher.run(app, host="0.0.0.0", port=8000, workers=1))
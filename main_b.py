@@ -1,14 +1,19 @@
-from fastapi import FastAPI, Header, HTTPException
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Response
 from pydantic import BaseModel
 
+from fast_response import FastResponseRoute
+from item_store import ItemExists, ItemStore
+
 fake_secret_token = "coneofsilence"
 
-fake_db = {
-    "foo": {"id": "foo", "title": "Foo", "description": "There goes my hero"},
-    "bar": {"id": "bar", "title": "Bar", "description": "The bartenders"},
-}
+# 値は dict で保持します (Item は create_item で dict にしてから保存します)
+fake_db = ItemStore(name_field="title")
+fake_db.create("foo", {"id": "foo", "title": "Foo", "description": "There goes my hero"})
+fake_db.create("bar", {"id": "bar", "title": "Bar", "description": "The bartenders"})
 
 app = FastAPI()
+# response_model への変換と JSON 化を FastResponseRoute で行います
+router = APIRouter(route_class=FastResponseRoute)
 
 
 class Item(BaseModel):
@@ -17,20 +22,26 @@ class Item(BaseModel):
     description: str = None
 
 
-@app.get("/items/{item_id}", response_model=Item)
-async def read_main(item_id: str, x_token: str = Header(...)):
+@router.get("/items/{item_id}", response_model=Item)
+async def read_main(item_id: str, response: Response, x_token: str = Header(...)):
     if x_token != fake_secret_token:
         raise HTTPException(status_code=400, detail="Invalid X-Token header")
-    if item_id not in fake_db:
+    record = fake_db.get(item_id)
+    if record is None:
         raise HTTPException(status_code=404, detail="Item not found")
-    return fake_db[item_id]
+    response.headers["ETag"] = record.etag
+    return record.data
 
 
-@app.post("/items/", response_model=Item)
+@router.post("/items/", response_model=Item)
 async def create_item(item: Item, x_token: str = Header(...)):
     if x_token != fake_secret_token:
         raise HTTPException(status_code=400, detail="Invalid X-Token header")
-    if item.id in fake_db:
+    try:
+        fake_db.create(item.id, item.dict())
+    except ItemExists:
         raise HTTPException(status_code=400, detail="Item already exists")
-    fake_db[item.id] = item
     return item
+
+
+app.include_router(router)
@@ -0,0 +1,210 @@
+# 動画などの大きなファイルを Range リクエストに対応して返すレスポンス (/fake-video-streamer)
+# - `Range: bytes=...` には 206 Partial Content、複数の範囲には multipart/byteranges で返します
+#   範囲外の場合は 416 (Content-Range: bytes */<サイズ>) です
+# - If-Range の ETag / Last-Modified がファイルと一致しない場合は、Range を無視して全体を返します
+# - ファイル全体をメモリに読み込まず、chunk_size ずつ読み込んで送信します (クライアントごとのメモリは O(chunk))
+#   send は送信バッファが空くまで待つため、遅いクライアントに対して読み込みが先行することはありません
+# - サーバーが `http.response.zerocopy` 拡張に対応している場合は、ファイルを渡して sendfile で送信させます
+#   (uvicorn は未対応のため、その場合は os.pread をスレッドで実行して読み込みます)
+# @see https://developer.mozilla.org/ja/docs/Web/HTTP/Range_requests
+# @see https://asgi.readthedocs.io/en/latest/extensions.html#zero-copy-send
+import mimetypes
+import os
+import secrets
+import stat
+from email.utils import formatdate
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from http_cache import etag_matches
+
+# 1回に読み込んで送信するサイズ [bytes]
+MEDIA_CHUNK_SIZE = int(os.getenv("MEDIA_CHUNK_SIZE", str(256 * 1024)))
+# 1リクエストで受け付ける範囲の数 (超える場合は Range を無視して全体を返します)
+MAX_RANGES = 16
+
+
+# Range が全てファイルの範囲外の場合に送出します (416 を返すために使用します)
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+# `bytes=0-99,200-` を [(0, 99), (200, size - 1)] にします (end を含みます)
+# 解釈できない場合は None (Range を無視して全体を返します)
+def parse_range(header: str, size: int):
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        first, sep, last = spec.strip().partition("-")
+        if not sep or not (first.isdigit() or last.isdigit()) or (first and not first.isdigit()) \
+                or (last and not last.isdigit()):
+            return None
+        if not first:
+            # `-500` は末尾の 500 bytes です
+            start, end = max(size - int(last), 0), size - 1
+            if int(last) == 0:
+                continue
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+        if start < size:
+            ranges.append((start, end))
+    if not ranges:
+        raise RangeNotSatisfiable(header)
+    # 重なる範囲・隣接する範囲はまとめます
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged if len(merged) <= MAX_RANGES else None
+
+
+class MediaFileResponse(Response):
+    def __init__(
+            self,
+            path: str,
+            stat_result: os.stat_result,
+            media_type: str = None,
+            chunk_size: int = MEDIA_CHUNK_SIZE,
+            headers: dict = None,
+    ):
+        self.path = path
+        self.size = stat_result.st_size
+        self.chunk_size = chunk_size
+        self.status_code = 200
+        self.media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.background = None
+        self.init_headers(headers)
+        self.etag = '"%x-%x"' % (stat_result.st_mtime_ns, stat_result.st_size)
+        self.last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers.update({
+            "accept-ranges": "bytes",
+            "etag": self.etag,
+            "last-modified": self.last_modified,
+        })
+
+    # If-Range が無い、または ETag (強い比較) / Last-Modified が一致する場合に Range を使います
+    def _if_range_matches(self, if_range: str) -> bool:
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"'):
+            return if_range == self.etag
+        return if_range == self.last_modified
+
+    def _ranges(self, request_headers: Headers):
+        range_header = request_headers.get("range")
+        if range_header is None or not self._if_range_matches(request_headers.get("if-range")):
+            return None
+        return parse_range(range_header, self.size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        request_headers = Headers(scope=scope)
+        if etag_matches(request_headers.get("if-none-match"), self.etag):
+            await self._send_start(send, 304)
+            await send({"type": "http.response.body", "body": b""})
+            return
+        try:
+            ranges = self._ranges(request_headers)
+        except RangeNotSatisfiable:
+            self.headers["content-range"] = "bytes */%d" % self.size
+            self.headers["content-length"] = "0"
+            await self._send_start(send, 416)
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if ranges is None:
+            status_code, parts = 200, [(b"", 0, self.size - 1)]
+            self.headers["content-length"] = str(self.size)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            status_code, parts = 206, [(b"", start, end)]
+            self.headers["content-range"] = "bytes %d-%d/%d" % (start, end, self.size)
+            self.headers["content-length"] = str(end - start + 1)
+        else:
+            boundary = secrets.token_hex(16)
+            status_code, parts = 206, [
+                (("\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n" % (
+                    boundary, self.media_type, start, end, self.size)).encode("latin-1"), start, end)
+                for start, end in ranges
+            ]
+            self.headers["content-type"] = "multipart/byteranges; boundary=" + boundary
+            trailer = ("\r\n--%s--\r\n" % boundary).encode("latin-1")
+            self.headers["content-length"] = str(
+                sum(len(head) + end - start + 1 for head, start, end in parts) + len(trailer))
+
+        await self._send_start(send, status_code)
+        if scope["method"].upper() == "HEAD" or self.size == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        if len(parts) > 1:
+            parts.append((trailer, 0, -1))
+
+        # 切断されたら送信を止めます (StreamingResponse と同様に http.disconnect を待ちます)
+        async with anyio.create_task_group() as task_group:
+            async def stream_and_cancel():
+                await self._stream(scope, send, parts)
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(stream_and_cancel)
+            await self._listen_for_disconnect(receive)
+            task_group.cancel_scope.cancel()
+
+    async def _send_start(self, send: Send, status_code: int):
+        await send({"type": "http.response.start", "status": status_code, "headers": self.raw_headers})
+
+    @staticmethod
+    async def _listen_for_disconnect(receive: Receive):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+
+    # parts は [(前に送るバイト列, 開始位置, 終了位置), ...] (終了位置 < 開始位置 の場合はバイト列のみ)
+    async def _stream(self, scope: Scope, send: Send, parts: list):
+        zerocopy = "http.response.zerocopy" in scope.get("extensions", {})
+        with open(self.path, mode="rb") as file:
+            fd = file.fileno()
+            for i, (head, start, end) in enumerate(parts):
+                last_part = i == len(parts) - 1
+                if head:
+                    await send({"type": "http.response.body", "body": head, "more_body": True})
+                if end < start:
+                    if last_part:
+                        await send({"type": "http.response.body", "body": b""})
+                    continue
+                if zerocopy:
+                    await send({
+                        "type": "http.response.zerocopy", "file": file,
+                        "offset": start, "count": end - start + 1, "more_body": not last_part,
+                    })
+                    continue
+                offset = start
+                while offset <= end:
+                    count = min(self.chunk_size, end - offset + 1)
+                    chunk = await anyio.to_thread.run_sync(os.pread, fd, count, offset)
+                    if not chunk:
+                        # 送信中にファイルが短くなった場合は打ち切ります
+                        raise RuntimeError("File at path %s was truncated" % self.path)
+                    offset += len(chunk)
+                    await send({
+                        "type": "http.response.body", "body": chunk,
+                        "more_body": not last_part or offset <= end,
+                    })
+
+
+# ファイルが無い・通常のファイルでない場合は FileNotFoundError
+async def media_response(path: str, **kwargs) -> MediaFileResponse:
+    stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise FileNotFoundError(path)
+    return MediaFileResponse(path, stat_result, **kwargs)
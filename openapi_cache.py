@@ -0,0 +1,74 @@
+# OpenAPI スキーマ (/openapi.json) を JSON の bytes として1度だけ生成し、
+# gzip / brotli で圧縮したものと一緒に保持します
+# リクエストごとに dict から JSON へのエンコードを行わず、ETag が一致すれば 304 を返します
+#
+# デプロイ時にファイルへ書き出しておくと、起動時に app.routes を辿らずに読み込めます
+# % python openapi_cache.py main:app openapi.json
+# % OPENAPI_SCHEMA_FILE=openapi.json uvicorn main:app
+# @see https://fastapi.tiangolo.com/advanced/extending-openapi/
+import argparse
+import importlib
+import json
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from http_cache import compress_variants, etag_matches, make_etag, select_encoding
+
+
+class OpenAPIDocument:
+    media_type = "application/json"
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = make_etag(body)
+        self.variants = compress_variants(body)
+        self._schema = None
+
+    @classmethod
+    def from_schema(cls, schema: dict) -> "OpenAPIDocument":
+        document = cls(json.dumps(schema, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        document._schema = schema
+        return document
+
+    @classmethod
+    def load(cls, path: str) -> "OpenAPIDocument":
+        with open(path, mode="rb") as f:
+            return cls(f.read())
+
+    def save(self, path: str):
+        with open(path, mode="wb") as f:
+            f.write(self.body)
+
+    # app.openapi() 用の dict (ファイルから読み込んだ場合は必要になった時にデコードします)
+    def schema(self) -> dict:
+        if self._schema is None:
+            self._schema = json.loads(self.body)
+        return self._schema
+
+    def response(self, request: Request) -> Response:
+        encoding = select_encoding(request.headers.get("accept-encoding"), self.variants)
+        # 圧縮方式ごとに内容が異なるため、ETag も別にします
+        etag = self.etag if encoding is None else self.etag[:-1] + "-" + encoding + '"'
+        headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding is None:
+            return Response(self.body, media_type=self.media_type, headers=headers)
+        headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+
+# デプロイ時にスキーマをファイルへ書き出します
+def main():
+    parser = argparse.ArgumentParser(description="Write the OpenAPI schema of an app to a file")
+    parser.add_argument("app", help="module:attribute (e.g. main:app)")
+    parser.add_argument("output")
+    args = parser.parse_args()
+    module_name, _, attribute = args.app.partition(":")
+    app = getattr(importlib.import_module(module_name), attribute or "app")
+    OpenAPIDocument.from_schema(app.openapi()).save(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# bcrypt のハッシュ化・検証を専用のプロセスプールで実行します
+# bcrypt (cost 12) は1回あたり数百 ms の CPU を使うため、イベントループ上で実行すると
+# その間ワーカー内の他のリクエストがすべて止まってしまいます
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+_pwd_context = None
+
+
+# passlib (bcrypt) は最初に使うときに import します (起動時間を短くするため)
+def get_pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
+
+
+# プロセスプールで実行される関数 (pickle 出来るようにモジュールの関数にしています)
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+
+def _hash(password: str) -> str:
+    return get_pwd_context().hash(password)
+
+
+# 待ちが上限に達している場合に送出します (503 を返すために使用します)
+class PasswordPoolBusy(Exception):
+    pass
+
+
+class PasswordPool:
+    # workers=0 の場合はプールを使わず、呼び出したスレッドで実行します
+    # max_pending は実行中 + 待ちの上限です
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+        # pending はプールのスレッド (完了時のコールバック) からも減らすため、ロックで保護します
+        self._lock = threading.Lock()
+
+    # プロセスは最初に使われたときに起動します
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordPoolBusy()
+        if self.workers <= 0:
+            return func(*args)
+        future = self._get_executor().submit(func, *args)
+        with self._lock:
+            self.pending += 1
+        # リクエストがキャンセルされても実行中のハッシュ計算は止まらないため、
+        # pending はコルーチンの終了時ではなく、プールでの実行が終わったときに減らします
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,210 @@
+# /static のファイルを事前に圧縮して返す StaticFiles
+# - gzip / brotli の圧縮は1ファイルにつき1度だけ行います (ファイルが更新された場合は作り直します)
+# - 小さいファイルは元データ・圧縮データともにメモリに保持して返します
+# - 大きいファイルは圧縮データを元ファイルの隣 (`*.gz`, `*.br`) に書き出し、FileResponse で返します
+#   一時ファイルに書いてから os.replace で置き換えるため、他のワーカーが書き込み途中のファイルを返すことはありません
+#   既存の圧縮ファイルは展開して元ファイルと比較し、一致する場合だけ使います (mtime だけでは内容の変更を検出できません)
+#   (サーバーが `http.response.pathsend` に対応していれば sendfile で送信されます)
+# - ETag は内容のハッシュです。`?v=<バージョン>` 付きの URL (versioned_url) は immutable としてキャッシュさせます
+#
+# デプロイ時に圧縮済みファイルを作っておく場合
+# % python precompressed_static.py static
+# @see https://www.starlette.io/staticfiles/
+import argparse
+import hashlib
+import mimetypes
+import os
+import stat
+import tempfile
+from urllib.parse import parse_qs
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from http_cache import (
+    AVAILABLE_ENCODINGS, DECOMPRESS_ERRORS, compress_variants, decompress, etag_matches, select_encoding,
+)
+
+# これ以下のサイズのファイルはメモリから返します [bytes]
+STATIC_MEMORY_MAX_BYTES = int(os.getenv("STATIC_MEMORY_MAX_BYTES", str(256 * 1024)))
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# バージョンの無い URL はキャッシュしてよいが、毎回 ETag で確認させます
+REVALIDATE_CACHE_CONTROL = "no-cache"
+# 圧縮しても効果の無い形式 (画像など) は圧縮しません
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/xml", "image/svg+xml")
+SUFFIXES = {"gzip": ".gz", "br": ".br"}
+# 圧縮ファイルを書き込み中の一時ファイル
+TMP_SUFFIX = ".tmp"
+
+
+def _content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, mode="rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+class _Asset:
+    def __init__(self, path: str, stat_result: os.stat_result, memory_max_bytes: int):
+        self.path = path
+        self.mtime = stat_result.st_mtime
+        self.mode = stat.S_IMODE(stat_result.st_mode)
+        self.size = stat_result.st_size
+        self.version = _content_hash(path)
+        self.media_type = mimetypes.guess_type(path)[0] or "text/plain"
+        # encoding -> bytes (メモリ) または str (ファイルのパス)
+        self.variants = {}
+        self.body = None
+        in_memory = self.size <= memory_max_bytes
+        if not self.media_type.startswith(COMPRESSIBLE_TYPES) and not in_memory:
+            return
+        with open(path, mode="rb") as f:
+            body = f.read()
+        if in_memory:
+            self.body = body
+        if not self.media_type.startswith(COMPRESSIBLE_TYPES):
+            return
+        self.variants = self._load_variants(body, in_memory)
+
+    def _load_variants(self, body: bytes, in_memory: bool) -> dict:
+        if in_memory:
+            return {
+                encoding: data for encoding, data in compress_variants(body).items()
+                if len(data) < len(body)
+            }
+        variants = {}
+        existing = {
+            encoding: self.path + SUFFIXES[encoding] for encoding in AVAILABLE_ENCODINGS
+            if self._is_fresh(self.path + SUFFIXES[encoding], encoding, body)
+        }
+        compressed = {} if len(existing) == len(AVAILABLE_ENCODINGS) else compress_variants(body)
+        for encoding, data in compressed.items():
+            if encoding in existing:
+                continue
+            try:
+                self._write_atomic(self.path + SUFFIXES[encoding], data)
+                existing[encoding] = self.path + SUFFIXES[encoding]
+            except OSError:
+                # 書き込めないディレクトリの場合はメモリに保持します
+                variants[encoding] = data
+        variants.update(existing)
+        return variants
+
+    # 元ファイルより古いものは展開せずに作り直します
+    def _is_fresh(self, path: str, encoding: str, body: bytes) -> bool:
+        try:
+            if os.stat(path).st_mtime < self.mtime:
+                return False
+            with open(path, mode="rb") as f:
+                return decompress(encoding, f.read()) == body
+        except DECOMPRESS_ERRORS:
+            return False
+
+    def _write_atomic(self, path: str, data: bytes):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=TMP_SUFFIX)
+        try:
+            with os.fdopen(fd, mode="wb") as f:
+                f.write(data)
+            # mkstemp は 0600 で作るため、元ファイルと同じ権限にします
+            os.chmod(tmp, self.mode)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def is_stale(self, stat_result: os.stat_result) -> bool:
+        return stat_result.st_mtime != self.mtime or stat_result.st_size != self.size
+
+    def response(self, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        encoding = select_encoding(request_headers.get("accept-encoding"), self.variants)
+        etag = '"%s"' % self.version if encoding is None else '"%s-%s"' % (self.version, encoding)
+        versioned = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("v") == [self.version[:12]]
+        headers = {
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if versioned else REVALIDATE_CACHE_CONTROL,
+        }
+        if etag_matches(request_headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        data = self.body if encoding is None else self.variants[encoding]
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        if isinstance(data, bytes):
+            return Response(data, status_code=status_code, media_type=self.media_type, headers=headers)
+        path = self.path if data is None else data
+        response = FileResponse(
+            path, status_code=status_code, media_type=self.media_type, stat_result=os.stat(path)
+        )
+        # FileResponse の ETag (mtime + size) の代わりに内容のハッシュを使います
+        del response.headers["etag"]
+        response.headers.update(headers)
+        return response
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    def __init__(self, *, memory_max_bytes: int = STATIC_MEMORY_MAX_BYTES, **kwargs):
+        super().__init__(**kwargs)
+        self.memory_max_bytes = memory_max_bytes
+        self._assets = {}
+        self._versions = {}
+
+    def _get_asset(self, full_path: str, stat_result: os.stat_result) -> _Asset:
+        asset = self._assets.get(full_path)
+        if asset is None or asset.is_stale(stat_result):
+            asset = _Asset(full_path, stat_result, self.memory_max_bytes)
+            self._assets[full_path] = asset
+        return asset
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+            if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+                asset = self._assets.get(full_path)
+                if asset is None or asset.is_stale(stat_result):
+                    # ハッシュの計算と圧縮は初回のみのため、スレッドで実行します
+                    asset = await anyio.to_thread.run_sync(self._get_asset, full_path, stat_result)
+                return asset.response(scope)
+        return await super().get_response(path, scope)
+
+    # 内容のバージョンを付けた URL を返します (テンプレートやドキュメントのページで使用します)
+    # 圧縮は行わず、ハッシュだけを計算します
+    def versioned_url(self, prefix: str, path: str) -> str:
+        full_path, stat_result = self.lookup_path(path)
+        if stat_result is None:
+            return prefix + "/" + path
+        asset = self._assets.get(full_path)
+        if asset is not None and not asset.is_stale(stat_result):
+            version = asset.version
+        else:
+            key = (full_path, stat_result.st_mtime, stat_result.st_size)
+            version = self._versions.get(key) or self._versions.setdefault(key, _content_hash(full_path))
+        return "%s/%s?v=%s" % (prefix, path, version[:12])
+
+    # ディレクトリ内の全ファイルを圧縮します (デプロイ時・起動時用)
+    def precompress(self):
+        for directory in self.all_directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if name.endswith(tuple(SUFFIXES.values()) + (TMP_SUFFIX,)):
+                        continue
+                    full_path = os.path.join(root, name)
+                    self._get_asset(full_path, os.stat(full_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompress static files (gzip / brotli)")
+    parser.add_argument("directory")
+    args = parser.parse_args()
+    PrecompressedStaticFiles(directory=args.directory).precompress()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# レート制限と過負荷時のリクエストの切り捨てを行う ASGI ミドルウェア
+# - RateLimitRule ごとのトークンバケット (クライアントの IP / 検証済みの Bearer トークンのユーザー / ルート単位)
+#   バケットが空の場合は 429 Too Many Requests (Retry-After はトークンが貯まるまでの秒数)
+# - 同時に処理するリクエスト数の上限と、上限を超えた分の待ち行列 (長さ・待ち時間の上限あり)
+#   待ち行列は優先度の高い順に処理し、一杯の場合は優先度の低いものから 503 Service Unavailable にします
+#   PRIORITY_CRITICAL (ヘルスチェック・ドキュメント等) は上限に関係なく即座に処理します
+# - バケットの保存先は backend で差し替えられます (既定はプロセス内のメモリ)
+#   複数ワーカーで共有する場合は、同じ take のインターフェースで Redis 等を使う backend を渡します
+# パスの指定は完全一致で、末尾が `*` の場合は前方一致です (例: "/internal/*", "/*")
+# @see https://developer.mozilla.org/ja/docs/Web/HTTP/Status/429
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# 全体のレート制限 (クライアントごと) [リクエスト/秒] とバースト
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "50"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "100"))
+# 同時に処理するリクエスト数 (0 の場合は制限しません)、待ち行列の長さ、待ち時間の上限 [秒]
+RATE_LIMIT_MAX_CONCURRENT = int(os.getenv("RATE_LIMIT_MAX_CONCURRENT", "64"))
+RATE_LIMIT_MAX_QUEUE = int(os.getenv("RATE_LIMIT_MAX_QUEUE", "128"))
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "2"))
+
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+# 同時実行数の枠を確保しているタスク内 (POST /batch のサブリクエスト等) では、枠を重ねて確保しません
+_holding_slot = contextvars.ContextVar("rate_limit_holding_slot", default=False)
+
+
+def _path_matches(pattern: str, path: str) -> bool:
+    if pattern.endswith("*"):
+        return path.startswith(pattern[:-1])
+    return path == pattern
+
+
+def client_ip(scope: Scope) -> str:
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+# Bearer トークンのユーザー単位のキーを返す key_func を作ります
+# verify(token) は署名を検証したうえでユーザー名を返します (無効なトークンは None で、IP 単位になります)
+# 検証せずに sub を使うと、sub を変えるだけで新しいバケットを得たり、他人のバケットを使い切らせたりできます
+def bearer_subject(verify):
+    def key_func(scope: Scope) -> str:
+        scheme, _, token = Headers(scope=scope).get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and token:
+            subject = verify(token)
+            if subject:
+                return "sub:" + subject
+        return client_ip(scope)
+
+    return key_func
+
+
+# ルート全体で1つのバケットです
+def route_key(scope: Scope) -> str:
+    return "route"
+
+
+class RateLimitRule:
+    __slots__ = ("name", "path", "methods", "rate", "burst", "key_func")
+
+    def __init__(self, name: str, path: str, rate: float, burst: float, methods: tuple = None, key_func=client_ip):
+        self.name = name
+        self.path = path
+        self.methods = methods
+        self.rate = rate
+        self.burst = burst
+        self.key_func = key_func
+
+    def matches(self, scope: Scope) -> bool:
+        return (self.methods is None or scope["method"] in self.methods) and _path_matches(self.path, scope["path"])
+
+
+# プロセス内のトークンバケット (イベントループ上からのみ呼び出すため、ロックは使いません)
+# キーの数は max_keys までで、超えた場合は最も長く使われていないものから破棄します
+class MemoryBackend:
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    # cost 分のトークンを取り出します。戻り値は許可されるまでの秒数 (0 なら許可)
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+# 同時実行数の上限と、優先度付きの待ち行列
+class ConcurrencyLimiter:
+    def __init__(self, max_concurrent: int, max_queue: int, max_wait: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        # [優先度, 順番, Future] のヒープ (タイムアウト・追い出し済みのものは取り出すときに捨てます)
+        self._queue = []
+        self._counter = itertools.count()
+
+    # 枠を確保できた場合は True (False の場合は release を呼ばないでください)
+    async def acquire(self, priority: int) -> bool:
+        if self.active < self.max_concurrent and not self.waiting:
+            self.active += 1
+            return True
+        entry = [priority, next(self._counter), None]
+        if self.waiting >= self.max_queue:
+            worst = max((e for e in self._queue if not e[2].done()), default=None)
+            if worst is None or worst[:2] < entry[:2]:
+                return False
+            # 自分より優先度の低い待ちを追い出します
+            worst[2].set_result(False)
+            self.waiting -= 1
+        future = entry[2] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, entry)
+        self.waiting += 1
+        try:
+            return await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(future)
+            return False
+        except asyncio.CancelledError:
+            # クライアントの切断・サーバーの終了・バッチの制限時間切れ等でキャンセルされた場合
+            self._abandon(future)
+            raise
+
+    # 待ちをやめたときの後始末
+    # 既に release から枠を渡されていた場合は、その枠を次の待ちに渡します (追い出された場合は何もしません)
+    def _abandon(self, future):
+        if not future.done() or future.cancelled():
+            future.cancel()
+            self.waiting -= 1
+        elif future.result():
+            self.release()
+
+    def release(self):
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                # 枠をそのまま待ちの先頭に渡します
+                self.waiting -= 1
+                future.set_result(True)
+                return
+        self.active -= 1
+
+
+class RateLimiter:
+    def __init__(
+            self,
+            rules: list = (),
+            priorities: list = (),
+            backend=None,
+            max_concurrent: int = RATE_LIMIT_MAX_CONCURRENT,
+            max_queue: int = RATE_LIMIT_MAX_QUEUE,
+            max_wait: float = RATE_LIMIT_MAX_WAIT,
+    ):
+        self.rules = list(rules)
+        # [(パス, 優先度), ...] (最初に一致したもの。どれにも一致しない場合は PRIORITY_NORMAL)
+        self.priorities = list(priorities)
+        self.backend = backend or MemoryBackend()
+        self.concurrency = ConcurrencyLimiter(max_concurrent, max_queue, max_wait) if max_concurrent else None
+        self.limited = 0
+        self.shed = 0
+
+    def priority(self, path: str) -> int:
+        for pattern, priority in self.priorities:
+            if _path_matches(pattern, path):
+                return priority
+        return PRIORITY_NORMAL
+
+    # 許可されるまでの秒数 (0 なら許可)
+    async def check(self, scope: Scope) -> float:
+        wait = 0.0
+        for rule in self.rules:
+            if rule.matches(scope):
+                key = "%s:%s" % (rule.name, rule.key_func(scope))
+                wait = max(wait, await self.backend.take(key, rule.rate, rule.burst))
+        return wait
+
+    def stats(self) -> dict:
+        concurrency = self.concurrency
+        return {
+            "active": concurrency.active if concurrency else 0,
+            "waiting": concurrency.waiting if concurrency else 0,
+            "limited": self.limited,
+            "shed": self.shed,
+        }
+
+
+class RateLimitMiddleware:
+    def __init__(self, app: ASGIApp, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limiter = self.limiter
+        wait = await limiter.check(scope)
+        if wait > 0:
+            limiter.limited += 1
+            response = JSONResponse(
+                {"detail": "Too Many Requests"}, status_code=429, headers={"Retry-After": str(math.ceil(wait))}
+            )
+            await response(scope, receive, send)
+            return
+        concurrency = limiter.concurrency
+        priority = limiter.priority(scope["path"])
+        if concurrency is None or _holding_slot.get() or priority == PRIORITY_CRITICAL:
+            await self.app(scope, receive, send)
+            return
+        if not await concurrency.acquire(priority):
+            limiter.shed += 1
+            response = JSONResponse(
+                {"detail": "Service Unavailable"}, status_code=503,
+                headers={"Retry-After": str(math.ceil(concurrency.max_wait))},
+            )
+            await response(scope, receive, send)
+            return
+        token = _holding_slot.set(True)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _holding_slot.reset(token)
+            concurrency.release()
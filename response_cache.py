@@ -0,0 +1,260 @@
+# GET のレスポンスをメモリにキャッシュする ASGI ミドルウェア
+# - キャッシュするルートはエンドポイントに @cacheable(ttl=...) を付けて指定します (付けていないルートは素通りします)
+# - キーはパス + クエリ文字列 + vary に指定したリクエストヘッダの値です (レスポンスにも Vary を付けます)
+# - 容量はボディとヘッダのバイト数の合計で制限し、超えた場合は古い順 (LRU) に破棄します
+# - ETag が無いレスポンスにはボディのハッシュから ETag を付け、If-None-Match が一致すれば 304 を返します
+# - tags に指定した名前 (パスパラメータで置き換えます) で、更新系のルートから invalidate できます
+#   例: @cacheable(ttl=60, tags=("item:{item_id}",)) と response_cache.invalidate("item:foo")
+# 200 以外、Set-Cookie 付き、Cache-Control: no-store / private のレスポンスはキャッシュしません
+# @see https://developer.mozilla.org/ja/docs/Web/HTTP/Caching
+import threading
+import time
+from collections import OrderedDict
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.routing import Match, Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from http_cache import etag_matches, make_etag
+
+# エントリごとのヘッダ等の大きさの見積もり [bytes]
+ENTRY_OVERHEAD = 256
+
+
+class CachePolicy:
+    __slots__ = ("ttl", "vary", "tags")
+
+    def __init__(self, ttl: float, vary: tuple, tags: tuple):
+        self.ttl = ttl
+        self.vary = tuple(vary)
+        self.tags = tags
+
+
+# エンドポイントに付けてキャッシュを有効にします (エンドポイント自体は変更しません)
+def cacheable(ttl: float = 60, vary: tuple = (), tags: tuple = ()):
+    def decorator(endpoint):
+        endpoint.response_cache_policy = CachePolicy(ttl, vary, tags)
+        return endpoint
+    return decorator
+
+
+class _Entry:
+    __slots__ = ("status", "headers", "body", "etag", "expires_at", "size", "tags")
+
+    def __init__(self, status: int, headers: list, body: bytes, etag: str, expires_at: float, tags: tuple):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers) + ENTRY_OVERHEAD
+        self.tags = tags
+
+
+# LRU + TTL のキャッシュ (容量はバイト数)
+class ResponseCache:
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, max_entry_bytes: int = 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # invalidate のたびに増やします (処理中に invalidate されたレスポンスは保存しません)
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._keys_by_tag = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> _Entry:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: tuple, entry: _Entry, generation: int):
+        if entry.size > self.max_entry_bytes:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.size += entry.size
+            for tag in entry.tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    # tag を付けたエントリを全て破棄します
+    def invalidate(self, *tags: str):
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in self._keys_by_tag.pop(tag, set()):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._keys_by_tag.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries), "bytes": self.size,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            }
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry.size
+        for tag in entry.tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+def _cacheable_response(status: int, headers: Headers) -> bool:
+    cache_control = headers.get("cache-control", "").lower()
+    return status == 200 and "set-cookie" not in headers \
+        and "no-store" not in cache_control and "private" not in cache_control
+
+
+class ResponseCacheMiddleware:
+    def __init__(self, app: ASGIApp, cache: ResponseCache, router: Router):
+        self.app = app
+        self.cache = cache
+        self.router = router
+        self._routes = None
+
+    # ルーターと同じ順序で照合するため、キャッシュするルートより前のルートも含めます
+    def _cache_routes(self) -> list:
+        if self._routes is None:
+            routes = list(self.router.routes)
+            last = max(
+                (i for i, route in enumerate(routes)
+                 if hasattr(getattr(route, "endpoint", None), "response_cache_policy")),
+                default=-1,
+            )
+            self._routes = routes[:last + 1]
+        return self._routes
+
+    def _match(self, scope: Scope):
+        for route in self._cache_routes():
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                policy = getattr(getattr(route, "endpoint", None), "response_cache_policy", None)
+                return (route, child_scope, policy) if policy is not None else None
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+        matched = self._match(scope)
+        if matched is None:
+            await self.app(scope, receive, send)
+            return
+        _, child_scope, policy = matched
+        request_headers = Headers(scope=scope)
+        if "authorization" in request_headers and "authorization" not in [n.lower() for n in policy.vary]:
+            await self.app(scope, receive, send)
+            return
+        key = (
+            scope["path"], scope.get("query_string", b""),
+            tuple(request_headers.get(name) for name in policy.vary),
+        )
+        entry = self.cache.get(key)
+        if entry is not None:
+            # /metrics のラベル用に、ルーターが設定する値を設定します
+            scope.update(child_scope)
+            await self._send_entry(send, entry, request_headers)
+            return
+        await self._call_and_store(scope, receive, send, key, policy, child_scope, request_headers)
+
+    @staticmethod
+    async def _send_entry(send: Send, entry: _Entry, request_headers: Headers):
+        if etag_matches(request_headers.get("if-none-match"), entry.etag):
+            headers = [(k, v) for k, v in entry.headers if k not in (b"content-length", b"content-type")]
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await send({"type": "http.response.start", "status": entry.status, "headers": entry.headers})
+        await send({"type": "http.response.body", "body": entry.body})
+
+    async def _call_and_store(
+            self, scope: Scope, receive: Receive, send: Send, key: tuple, policy: CachePolicy,
+            child_scope: dict, request_headers: Headers,
+    ):
+        generation = self.cache.generation
+        start_message = None
+        chunks = []
+        size = 0
+        # 大きすぎる・キャッシュできないレスポンスは、それ以降そのまま送信します
+        passthrough = False
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message, size, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start_message = message
+                if not _cacheable_response(message["status"], Headers(raw=message.get("headers", []))):
+                    passthrough = True
+                    await send(message)
+                return
+            if message["type"] != "http.response.body":
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if size > self.cache.max_entry_bytes:
+                passthrough = True
+                await send(start_message)
+                await send({"type": "http.response.body", "body": b"".join(chunks), "more_body": True})
+                if not message.get("more_body", False):
+                    await send({"type": "http.response.body", "body": b""})
+                return
+            if message.get("more_body", False):
+                return
+            await self._store_and_send(
+                send, key, policy, child_scope, request_headers, start_message, b"".join(chunks), generation,
+            )
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _store_and_send(
+            self, send: Send, key: tuple, policy: CachePolicy, child_scope: dict,
+            request_headers: Headers, start_message: Message, body: bytes, generation: int,
+    ):
+        headers = MutableHeaders(raw=list(start_message.get("headers", [])))
+        etag = headers.get("etag")
+        if etag is None:
+            etag = headers["etag"] = make_etag(body)
+        for name in policy.vary:
+            headers.add_vary_header(name)
+        path_params = child_scope.get("path_params", {})
+        tags = tuple(tag.format(**path_params) for tag in policy.tags)
+        entry = _Entry(start_message["status"], headers.raw, body, etag, time.monotonic() + policy.ttl, tags)
+        self.cache.set(key, entry, generation)
+        await self._send_entry(send, entry, request_headers)
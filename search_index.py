@@ -0,0 +1,161 @@
+# アイテム検索用の転置インデックス (GET /items/?q=)
+# - name / tags / description を単語に分割し、単語 -> {アイテム id: 重み} を保持します
+# - アイテムの更新時は、増減した単語だけを更新します (全体の再構築はしません)
+# - 複数の単語は AND 検索、`foo*` は前方一致です (ソート済みの単語一覧を二分探索します)
+# - スコア (重み x IDF の合計) の高い順に返し、cursor で続きを取得できます
+import base64
+import bisect
+import binascii
+import heapq
+import json
+import math
+import re
+import threading
+from collections import Counter
+
+SEARCH_NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# フィールドごとの重み
+FIELD_WEIGHTS = {"name": 3.0, "tags": 2.0, "description": 1.0}
+# 前方一致で展開する単語数の上限
+MAX_PREFIX_EXPANSION = 1000
+
+_token_pattern = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    return _token_pattern.findall(text.lower()) if text else []
+
+
+# 不正な cursor の場合は ValueError
+def encode_cursor(score: float, doc_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([score, doc_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        score, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), str(doc_id)
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+class SearchIndex:
+    def __init__(self, field_weights: dict = None):
+        self.field_weights = field_weights or FIELD_WEIGHTS
+        self._postings = {}
+        self._doc_terms = {}
+        # 前方一致用のソート済みの単語一覧
+        self._terms = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def _weights(self, data: dict) -> Counter:
+        weights = Counter()
+        for field, weight in self.field_weights.items():
+            value = data.get(field)
+            if isinstance(value, (list, tuple, set, frozenset)):
+                value = " ".join(str(v) for v in value)
+            for term in tokenize(value if isinstance(value, str) else None):
+                weights[term] += weight
+        return weights
+
+    # アイテムを追加・更新します (data が None の場合は削除します)
+    def update(self, doc_id: str, data: dict = None):
+        new = self._weights(data) if data is not None else Counter()
+        with self._lock:
+            old = self._doc_terms.get(doc_id, Counter())
+            for term in old.keys() - new.keys():
+                postings = self._postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._postings[term]
+                    del self._terms[bisect.bisect_left(self._terms, term)]
+            for term, weight in new.items():
+                if old.get(term) == weight:
+                    continue
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    bisect.insort(self._terms, term)
+                postings[doc_id] = weight
+            if new:
+                self._doc_terms[doc_id] = new
+            else:
+                self._doc_terms.pop(doc_id, None)
+
+    # ItemStore.subscribe に渡して、ストアの更新をインデックスに反映します
+    def on_store_write(self, old_record, new_record):
+        self.update(new_record.id, new_record.data)
+
+    def _expand(self, term: str) -> list:
+        if not term.endswith("*"):
+            return [term] if term in self._postings else []
+        prefix = term[:-1]
+        start = bisect.bisect_left(self._terms, prefix)
+        expanded = []
+        for candidate in self._terms[start:start + MAX_PREFIX_EXPANSION]:
+            if not candidate.startswith(prefix):
+                break
+            expanded.append(candidate)
+        return expanded
+
+    def _idf(self, term: str) -> float:
+        return math.log(1 + len(self._doc_terms) / len(self._postings[term]))
+
+    # 単語の {id: スコア}。前方一致の場合は展開した単語の最大値です
+    def _term_scores(self, terms: list) -> dict:
+        scores = {}
+        for term in terms:
+            idf = self._idf(term)
+            for doc_id, weight in self._postings[term].items():
+                score = weight * idf
+                if score > scores.get(doc_id, 0):
+                    scores[doc_id] = score
+        return scores
+
+    # 戻り値は ([(id, スコア), ...], 次の cursor または None)
+    def search(self, query: str, limit: int = 20, cursor: str = None):
+        after = decode_cursor(cursor) if cursor else None
+        # `foo*` は前方一致として扱います
+        terms = [t + "*" if prefix else t for t, prefix in re.findall(r"(\w+)(\*?)", query.lower())]
+        if not terms:
+            return [], None
+        with self._lock:
+            expanded = [self._expand(term) for term in terms]
+            if not all(expanded):
+                return [], None
+            # 候補の少ない単語のスコアを求め、残りの単語は候補ごとに引いて AND を取ります
+            expanded.sort(key=lambda words: sum(len(self._postings[w]) for w in words))
+            scores = self._term_scores(expanded[0])
+            for words in expanded[1:]:
+                size = sum(len(self._postings[w]) for w in words)
+                if len(scores) * len(words) > size:
+                    # 前方一致で単語が多い場合は、その単語のスコアをまとめて求めた方が速くなります
+                    term_scores = self._term_scores(words)
+                    matched = {
+                        doc_id: score + term_scores[doc_id]
+                        for doc_id, score in scores.items() if doc_id in term_scores
+                    }
+                else:
+                    postings = [(self._postings[w], self._idf(w)) for w in words]
+                    matched = {}
+                    for doc_id, score in scores.items():
+                        best = max((p[doc_id] * idf for p, idf in postings if doc_id in p), default=0)
+                        if best:
+                            matched[doc_id] = score + best
+                scores = matched
+                if not scores:
+                    return [], None
+        ranked = ((-score, doc_id) for doc_id, score in scores.items())
+        if after is not None:
+            key = (-after[0], after[1])
+            ranked = (entry for entry in ranked if entry > key)
+        page = heapq.nsmallest(limit + 1, ranked)
+        results = [(doc_id, -score) for score, doc_id in page[:limit]]
+        next_cursor = None
+        if len(page) > limit:
+            last_id, last_score = results[-1]
+            next_cursor = encode_cursor(last_score, last_id)
+        return results, next_cursor
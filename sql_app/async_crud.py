@@ -0,0 +1,81 @@
+# crud.py と同じ関数名のコルーチン版 (AsyncSession 用)
+# @see https://docs.sqlalchemy.org/en/20/orm/extensions/asyncio.html
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from . import models, schemas
+from .crud import items_loader
+
+
+# AsyncSession では参照時の遅延読み込みが出来ないため、
+# "lazy" の場合も selectinload で読み込みます
+def _users_select(items_loading: str = None):
+    loader = items_loader(items_loading) or selectinload(models.User.items)
+    return select(models.User).options(loader)
+
+
+# user_id から単一のユーザーを読み取ります
+async def get_user(db: AsyncSession, user_id: int, items_loading: str = None):
+    result = await db.execute(
+        _users_select(items_loading).where(models.User.id == user_id)
+    )
+    return result.unique().scalars().first()
+
+
+# mail_addr から単一のユーザーを読み取ります
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
+
+# 複数のユーザーを取得します
+# after_id を指定すると offset の代わりに `WHERE id > after_id` で続きを読み込みます
+async def get_users(
+        db: AsyncSession, skip: int = 0, limit: int = 100, after_id: int = None,
+        items_loading: str = None
+):
+    query = _users_select(items_loading)
+    if after_id is not None:
+        query = query.where(models.User.id > after_id).order_by(models.User.id)
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.unique().scalars().all()
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    fake_hashed_password = user.password + "notreallyhashed"
+    # 作成直後のユーザーは items を持たないため、空のリストで初期化しておきます
+    db_user = models.User(email=user.email, hashed_password=fake_hashed_password, items=[])
+    db.add(db_user)
+    await db.commit()
+    # 引数なしの refresh は items も未ロードに戻してしまうため、列の属性だけを読み直します
+    await db.refresh(db_user, ["id", "email", "hashed_password", "is_active"])
+    return db_user
+
+
+async def get_items(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: int = None):
+    query = select(models.Item)
+    if after_id is not None:
+        query = query.where(models.Item.id > after_id).order_by(models.Item.id)
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.scalars().all()
+
+
+# crud.iter_items の非同期版
+async def iter_items(db: AsyncSession, batch_size: int = 1000):
+    async with AsyncSession(bind=db.bind) as stream_db:
+        query = select(models.Item).order_by(models.Item.id).execution_options(yield_per=batch_size)
+        async for item in await stream_db.stream_scalars(query):
+            yield item
+
+
+async def create_user_item(db: AsyncSession, item: schemas.ItemCreate, user_id: int):
+    db_item = models.Item(**item.dict(), owner_id=user_id)
+    db.add(db_item)
+    await db.commit()
+    await db.refresh(db_item)
+    return db_item
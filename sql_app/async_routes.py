@@ -0,0 +1,74 @@
+# routes.py の AsyncSession 版 (SQL_APP_ASYNC_ORM=1 の場合に使用します)
+# @see https://fastapi.tiangolo.com/tutorial/bigger-applications/
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fast_response import FastResponseRoute
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import async_crud, schemas
+from .dependencies import get_async_db
+from .export import EXPORT_PATTERN, export_response
+from .pagination import NEXT_CURSOR_HEADER, decode_cursor, next_cursor
+
+# ORM オブジェクトは from_orm で response_model に変換し、ujson で直接 JSON にします
+router = APIRouter(route_class=FastResponseRoute)
+
+
+@router.post("/users/", response_model=schemas.User)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await async_crud.get_user_by_email(db, email=user.email)
+    if db_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return await async_crud.create_user(db=db, user=user)
+
+
+# cursor を指定するとカーソルページネーションになります (`?cursor=` で先頭から)
+# 続きがある場合は X-Next-Cursor ヘッダで次のカーソルを返します
+@router.get("/users/", response_model=List[schemas.User])
+async def read_users(
+        response: Response, skip: int = 0, limit: int = 100, cursor: str = None,
+        db: AsyncSession = Depends(get_async_db)
+):
+    if cursor is None:
+        return await async_crud.get_users(db, skip=skip, limit=limit)
+    users = await async_crud.get_users(db, limit=limit, after_id=decode_cursor(cursor))
+    cursor = next_cursor(users, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+    return users
+
+
+@router.get("/users/{user_id}", response_model=schemas.User)
+async def read_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_user = await async_crud.get_user(db, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+
+@router.post("/users/{user_id}/items/", response_model=schemas.Item)
+async def create_item_for_user(
+        user_id: int, item: schemas.ItemCreate, db: AsyncSession = Depends(get_async_db)
+):
+    return await async_crud.create_user_item(db=db, item=item, user_id=user_id)
+
+
+# export=ndjson / json を指定すると全件をストリーミングで返します (skip / limit は無視します)
+@router.get("/items/", response_model=List[schemas.Item])
+async def read_items(
+        response: Response, skip: int = 0, limit: int = 100, cursor: str = None,
+        export: str = Query(None, regex=EXPORT_PATTERN),
+        db: AsyncSession = Depends(get_async_db)
+):
+    if export:
+        return export_response(
+            async_crud.iter_items(db), export, lambda item: schemas.Item.from_orm(item).json()
+        )
+    if cursor is None:
+        return await async_crud.get_items(db, skip=skip, limit=limit)
+    items = await async_crud.get_items(db, limit=limit, after_id=decode_cursor(cursor))
+    cursor = next_cursor(items, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+    return items
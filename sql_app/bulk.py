@@ -0,0 +1,98 @@
+# notes の一括登録
+# リクエストボディを少しずつ読みながら NoteIn に変換し、バッチ単位で INSERT します
+import codecs
+import json
+from typing import AsyncIterator, List
+
+from pydantic import parse_obj_as
+
+from .database import database, notes
+from .models import NoteIn
+
+# 1回の INSERT に含める行数
+NOTES_BULK_BATCH_SIZE = 500
+
+_decoder = json.JSONDecoder()
+
+
+# NDJSON (1行に1件の JSON) を1件ずつ返します
+async def iter_ndjson(chunks: AsyncIterator[bytes]):
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if buffer.strip():
+        yield json.loads(buffer)
+
+
+# JSON 配列 `[{...}, {...}]` を全体を読み込まずに1要素ずつ返します
+async def iter_json_array(chunks: AsyncIterator[bytes]):
+    buffer = ""
+    # "[" の前 -> "start", 要素の前 -> "value", 要素の後 -> "separator", "]" の後 -> "end"
+    state = "start"
+    # マルチバイト文字が chunk の境界で分割されていても正しくデコードします
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        while True:
+            buffer = buffer.lstrip()
+            if not buffer:
+                break
+            if state == "start" and buffer[0] == "[":
+                buffer = buffer[1:]
+                state = "value"
+            elif state == "value" and buffer[0] == "]":
+                buffer = buffer[1:]
+                state = "end"
+            elif state == "value":
+                try:
+                    obj, end = _decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    # 要素の途中で chunk が切れている場合は次の chunk を待ちます
+                    break
+                buffer = buffer[end:]
+                state = "separator"
+                yield obj
+            elif state == "separator" and buffer[0] in ",]":
+                state = "value" if buffer[0] == "," else "end"
+                buffer = buffer[1:]
+            else:
+                raise ValueError("Invalid JSON array")
+    if state != "end" or buffer.strip():
+        raise ValueError("Invalid JSON array")
+
+
+# 先に全件を検証してからまとめて INSERT する場合に使用します
+async def iter_list(items: list):
+    for item in items:
+        yield item
+
+
+async def _insert_batch(batch: List[NoteIn]) -> List[int]:
+    values = [note.dict() for note in batch]
+    query = notes.insert().values(values)
+    if database.url.dialect == "mysql":
+        # MySQL は RETURNING 非対応のため、複数行 INSERT の LAST_INSERT_ID() (先頭の id) から求めます
+        # (innodb_autoinc_lock_mode <= 1 の場合、1文で割り当てられる id は連番です)
+        first_id = await database.execute(query)
+        return list(range(first_id, first_id + len(batch)))
+    rows = await database.fetch_all(query.returning(notes.c.id))
+    return [row[0] for row in rows]
+
+
+# 1トランザクションでバッチごとに INSERT し、割り当てられた id を返します
+async def insert_notes(items: AsyncIterator[dict], batch_size: int = NOTES_BULK_BATCH_SIZE):
+    ids = []
+    batch = []
+    async with database.transaction():
+        async for item in items:
+            batch.append(parse_obj_as(NoteIn, item))
+            if len(batch) >= batch_size:
+                ids.extend(await _insert_batch(batch))
+                batch = []
+        if batch:
+            ids.extend(await _insert_batch(batch))
+    return ids
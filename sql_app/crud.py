@@ -1,12 +1,40 @@
 # @see https://fastapi.tiangolo.com/tutorial/sql-databases/
-from sqlalchemy.orm import Session
+import os
+
+from sqlalchemy.orm import Session, joinedload, selectinload
 
 from . import models, schemas
 
+# User.items の読み込み方法
+# - "selectin": ユーザー取得後に `WHERE owner_id IN (...)` を1回だけ発行します
+# - "joined": ユーザーと同じクエリで LEFT OUTER JOIN して読み込みます
+# - "lazy": 参照されたときにユーザーごとに読み込みます (N+1 が発生します)
+ITEMS_LOADING = os.getenv("SQL_APP_ITEMS_LOADING", "selectin")
+
+
+# User.items の loader option を返します ("lazy" の場合は None)
+def items_loader(items_loading: str = None):
+    items_loading = items_loading or ITEMS_LOADING
+    if items_loading == "selectin":
+        return selectinload(models.User.items)
+    if items_loading == "joined":
+        return joinedload(models.User.items)
+    if items_loading == "lazy":
+        return None
+    raise ValueError("Unknown items_loading: %s" % items_loading)
+
+
+def _users_query(db: Session, items_loading: str = None):
+    query = db.query(models.User)
+    loader = items_loader(items_loading)
+    if loader is not None:
+        query = query.options(loader)
+    return query
+
 
 # user_id から単一のユーザーを読み取ります
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+def get_user(db: Session, user_id: int, items_loading: str = None):
+    return _users_query(db, items_loading).filter(models.User.id == user_id).first()
 
 
 # mail_addr から単一のユーザーを読み取ります
@@ -15,8 +43,15 @@ def get_user_by_email(db: Session, email: str):
 
 
 # 複数のユーザーを取得します
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+# after_id を指定すると offset の代わりに `WHERE id > after_id` で続きを読み込みます
+def get_users(
+        db: Session, skip: int = 0, limit: int = 100, after_id: int = None,
+        items_loading: str = None
+):
+    query = _users_query(db, items_loading)
+    if after_id is not None:
+        return query.filter(models.User.id > after_id).order_by(models.User.id).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
 
 
 def create_user(db: Session, user: schemas.UserCreate):
@@ -31,8 +66,21 @@ def create_user(db: Session, user: schemas.UserCreate):
     return db_user
 
 
-def get_items(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Item).offset(skip).limit(limit).all()
+def get_items(db: Session, skip: int = 0, limit: int = 100, after_id: int = None):
+    query = db.query(models.Item)
+    if after_id is not None:
+        return query.filter(models.Item.id > after_id).order_by(models.Item.id).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
+
+
+# 全件を yield_per で少しずつ読み込みます (ストリーミング出力用)
+# レスポンスの送信中にリクエストのセッションは閉じられるため、同じ接続先で専用のセッションを使います
+def iter_items(db: Session, batch_size: int = 1000):
+    stream_db = Session(bind=db.get_bind())
+    try:
+        yield from stream_db.query(models.Item).order_by(models.Item.id).yield_per(batch_size)
+    finally:
+        stream_db.close()
 
 
 def create_user_item(db: Session, item: schemas.ItemCreate, user_id: int):
@@ -0,0 +1,24 @@
+# @see https://fastapi.tiangolo.com/tutorial/bigger-applications/
+from fastapi import Request
+
+from .database import SessionLocal, get_async_sessionmaker
+
+
+# Dependency
+# リクエストごとに独立したデータベースセッション/接続（）を用意し、
+# すべてのリクエストで同じセッションを使用し、リクエストの終了後にセッションを閉じる
+# セッションは request.state.db に保持し、db_session_middleware と共有します
+# リクエスト後のクローズは db_session_middleware が行います (例外が発生した場合でも)
+def get_db(request: Request):
+    db = getattr(request.state, "db", None)
+    if db is None:
+        db = request.state.db = SessionLocal()
+    return db
+
+
+# get_db の AsyncSession 版
+async def get_async_db(request: Request):
+    db = getattr(request.state, "db", None)
+    if db is None:
+        db = request.state.db = get_async_sessionmaker()()
+    return db
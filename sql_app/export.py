@@ -0,0 +1,68 @@
+# 一覧のストリーミング出力
+# 全件をリストにせず、1行ずつ読み込みながら NDJSON / JSON 配列として少しずつ返します
+from starlette.responses import StreamingResponse
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+EXPORT_PATTERN = "^(ndjson|json)$"
+
+# 1回の送信にまとめる行数
+EXPORT_CHUNK_ROWS = 100
+
+
+class _Encoder:
+    def __init__(self, export: str, encode):
+        self.export = export
+        self.encode = encode
+        self.lines = []
+        self.count = 0
+
+    def start(self) -> str:
+        return "[" if self.export == "json" else ""
+
+    def add(self, row):
+        line = self.encode(row)
+        if self.export == "ndjson":
+            line += "\n"
+        elif self.count:
+            line = "," + line
+        self.lines.append(line)
+        self.count += 1
+        return len(self.lines) >= EXPORT_CHUNK_ROWS
+
+    def flush(self) -> bytes:
+        chunk = "".join(self.lines).encode()
+        self.lines = []
+        return chunk
+
+    def end(self) -> bytes:
+        return self.flush() + (b"]" if self.export == "json" else b"")
+
+
+def _iter_chunks(rows, encoder: _Encoder):
+    yield encoder.start().encode()
+    for row in rows:
+        if encoder.add(row):
+            yield encoder.flush()
+    yield encoder.end()
+
+
+async def _aiter_chunks(rows, encoder: _Encoder):
+    yield encoder.start().encode()
+    async for row in rows:
+        if encoder.add(row):
+            yield encoder.flush()
+    yield encoder.end()
+
+
+# rows は同期/非同期どちらのイテレータでも構いません
+# encode は1行を JSON 文字列に変換する関数です
+def export_response(rows, export: str, encode) -> StreamingResponse:
+    encoder = _Encoder(export, encode)
+    if hasattr(rows, "__aiter__"):
+        body = _aiter_chunks(rows, encoder)
+    else:
+        body = _iter_chunks(rows, encoder)
+    return StreamingResponse(body, media_type=EXPORT_MEDIA_TYPES[export])
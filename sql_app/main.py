@@ -1,35 +1,73 @@
 # @see https://fastapi.tiangolo.com/tutorial/sql-databases/
+import inspect
 from typing import List
 
-from fastapi import Depends, FastAPI, HTTPException, Request, Response
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from pydantic import ValidationError, parse_obj_as
 
-from . import crud, models, schemas
-from .database import SessionLocal, engine, database, notes
-from .models import Note, NoteIn
+from rate_limit import (
+    PRIORITY_BULK, PRIORITY_CRITICAL, RATE_LIMIT_BURST, RATE_LIMIT_ENABLED, RATE_LIMIT_RATE,
+    RateLimiter, RateLimitMiddleware, RateLimitRule,
+)
 
-# @see https://www.elastic.co/guide/en/apm/agent/python/master/starlette-support.html
-from elasticapm.contrib.starlette import make_apm_client, ElasticAPM
+from . import models
+from .apm import install_apm
+from .bulk import insert_notes, iter_json_array, iter_list, iter_ndjson
+from .database import ASYNC_ORM, engine, database, notes, pool_stats
+from .dependencies import get_async_db, get_db  # noqa: F401
+from .export import EXPORT_PATTERN, export_response
+from .models import Note, NoteBulkOut, NoteIn
 
 # データベーステーブルを作成する
 models.Base.metadata.create_all(bind=engine)
 
-elastic_apm = make_apm_client({})
 app = FastAPI()
-app.add_middleware(ElasticAPM, client=elastic_apm)
 
 
+# セッションは get_db で最初に使われたときに作成されます
+# ORM を使わないルート (/notes/ や 404) ではセッションもプールのチェックアウトも発生しません
 @app.middleware("http")
 async def db_session_middleware(request: Request, call_next):
     response = Response("Internal server error", status_code=500)
     try:
-        request.state.db = SessionLocal()
         response = await call_next(request)
     finally:
-        request.state.db.close()
+        db = getattr(request.state, "db", None)
+        if db is not None:
+            # AsyncSession の close はコルーチンです
+            # (sqlalchemy.ext.asyncio を import しないよう、isinstance ではなく戻り値で判定します)
+            closed = db.close()
+            if inspect.isawaitable(closed):
+                await closed
     return response
 
 
+# 書き込みはクライアント (IP) ごとに制限し、過負荷時は一覧・一括登録のルートから 503 にします
+# DB のセッションを作る前に判定するよう、db_session_middleware の外側に置きます
+rate_limiter = RateLimiter(
+    rules=[
+        RateLimitRule("bulk", "/notes/bulk", rate=1, burst=10, methods=("POST",)),
+        RateLimitRule("write", "/*", rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST, methods=("POST",)),
+    ],
+    priorities=[
+        ("/internal/*", PRIORITY_CRITICAL),
+        ("/docs", PRIORITY_CRITICAL),
+        ("/openapi.json", PRIORITY_CRITICAL),
+        ("/notes/bulk", PRIORITY_BULK),
+        ("/notes/", PRIORITY_BULK),
+        ("/users/", PRIORITY_BULK),
+        ("/items/", PRIORITY_BULK),
+    ],
+)
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
+# サンプリング率などは ELASTIC_APM_* 環境変数で変更できます (sql_app/apm.py)
+# トランザクションは contextvars で管理されるため、BaseHTTPMiddleware (call_next は別タスクで実行) より
+# 外側になるよう最後に追加します (内側にあるとトランザクションが終了されず、APM に送信されません)
+elastic_apm = install_apm(app, "sql_app")
+
+
 @app.on_event("startup")
 async def startup():
     await database.connect()
@@ -40,59 +78,34 @@ async def shutdown():
     await database.disconnect()
 
 
-# Dependency
-# リクエストごとに独立したデータベースセッション/接続（）を用意し、
-# すべてのリクエストで同じセッションを使用し、リクエストの終了後にセッションを閉じる
-def get_db():
-    db = None
-    try:
-        db = SessionLocal()
-        yield db
-    finally:
-        # リクエスト後にデータベースセッションが常に閉じられるようにします。
-        # リクエストの処理中に例外が発生した場合でも
-        db.close()
-
-
-@app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
-
+# ORM のルート
+# SQL_APP_ASYNC_ORM=1 の場合は AsyncSession を使う async def のルートに切り替えます
+# 使わない方のルート (と sqlalchemy.ext.asyncio) は import しません
+if ASYNC_ORM:
+    from . import async_routes
 
-@app.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud.get_users(db, skip=skip, limit=limit)
-    return users
+    app.include_router(async_routes.router)
+else:
+    from . import routes
 
+    app.include_router(routes.router)
 
-@app.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id=user_id)
-    if db_user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    return db_user
 
-
-@app.post("/users/{user_id}/items/", response_model=schemas.Item)
-def create_item_for_user(
-        user_id: int, item: schemas.ItemCreate, db: Session = Depends(get_db)
-):
-    return crud.create_user_item(db=db, item=item, user_id=user_id)
-
-
-@app.get("/items/", response_model=List[schemas.Item])
-def read_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    items = crud.get_items(db, skip=skip, limit=limit)
-    return items
+# コネクションプールの利用状況 (内部用)
+@app.get("/internal/pool-stats", include_in_schema=False)
+def read_pool_stats():
+    return {**pool_stats, "checked_out": engine.pool.checkedout()}
 
 
 # @see https://fastapi.tiangolo.com/advanced/async-sql-databases/
+# export=ndjson / json を指定すると database.iterate で1行ずつ読み込みながら返します
 @app.get("/notes/", response_model=List[Note])
-async def read_notes():
+async def read_notes(export: str = Query(None, regex=EXPORT_PATTERN)):
     query = notes.select()
+    if export:
+        return export_response(
+            database.iterate(query), export, lambda row: Note(**row._mapping).json()
+        )
     return await database.fetch_all(query)
 
 
@@ -117,3 +130,40 @@ async def create_note(note: NoteIn):
     #     "completed": False,
     # }
     return {**note.dict(), "id": last_record_id}
+
+
+# notes をまとめて登録します
+# - Content-Type: application/json の場合は NoteIn の配列
+# - Content-Type: application/x-ndjson の場合は1行に1件の NoteIn
+# stream=true の場合はボディを読み込みながら INSERT します (大きなアップロードでもメモリに溜めません)
+# 途中でエラーになった場合はトランザクションごとロールバックします
+@app.post(
+    "/notes/bulk", response_model=NoteBulkOut,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": {"$ref": "#/components/schemas/NoteIn"}}
+                },
+                "application/x-ndjson": {"schema": {"$ref": "#/components/schemas/NoteIn"}},
+            },
+        }
+    },
+)
+async def create_notes_bulk(request: Request, stream: bool = False):
+    ndjson = request.headers.get("content-type", "").startswith("application/x-ndjson")
+    parse = iter_ndjson if ndjson else iter_json_array
+    try:
+        if stream:
+            items = parse(request.stream())
+        else:
+            body = [item async for item in parse(request.stream())]
+            items = iter_list(parse_obj_as(List[NoteIn], body))
+        ids = await insert_notes(items)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    except ValueError as e:
+        # json.JSONDecodeError も ValueError のサブクラスです
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"ids": ids}
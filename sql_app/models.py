@@ -4,6 +4,8 @@ from sqlalchemy.orm import relationship
 
 from .database import Base
 # @see https://fastapi.tiangolo.com/advanced/async-sql-databases/
+from typing import List
+
 from pydantic import BaseModel
 
 
@@ -43,3 +45,8 @@ class Note(BaseModel):
     id: int
     text: str
     completed: bool
+
+
+# POST /notes/bulk のレスポンス
+class NoteBulkOut(BaseModel):
+    ids: List[int]
@@ -0,0 +1,35 @@
+# カーソル (keyset) ページネーション
+# offset はページが深くなるほど読み飛ばす行が増えるため、
+# 最後に返した id をカーソルにして `WHERE id > :cursor` で続きから読み込みます
+import base64
+import binascii
+from typing import Optional
+
+from fastapi import HTTPException
+
+# 次ページのカーソルを返すレスポンスヘッダ
+# ボディに next_cursor を入れると、/users/ と /items/ のレスポンス (配列) の形が offset 指定の場合と変わるため、
+# ボディは配列のままにしてヘッダで返します (GitHub API の Link ヘッダと同じ考え方です)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+# 空文字は先頭ページを表します (`?cursor=`)
+def decode_cursor(cursor: str) -> int:
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# ページが埋まっていれば続きがあるものとして次のカーソルを作ります
+def next_cursor(rows, limit: int) -> Optional[str]:
+    if not rows or len(rows) < limit:
+        return None
+    return encode_cursor(rows[-1].id)
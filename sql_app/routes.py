@@ -0,0 +1,73 @@
+# @see https://fastapi.tiangolo.com/tutorial/bigger-applications/
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fast_response import FastResponseRoute
+from sqlalchemy.orm import Session
+
+from . import crud, schemas
+from .dependencies import get_db
+from .export import EXPORT_PATTERN, export_response
+from .pagination import NEXT_CURSOR_HEADER, decode_cursor, next_cursor
+
+# ORM オブジェクトは from_orm で response_model に変換し、ujson で直接 JSON にします
+router = APIRouter(route_class=FastResponseRoute)
+
+
+@router.post("/users/", response_model=schemas.User)
+def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    db_user = crud.get_user_by_email(db, email=user.email)
+    if db_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return crud.create_user(db=db, user=user)
+
+
+# cursor を指定するとカーソルページネーションになります (`?cursor=` で先頭から)
+# 続きがある場合は X-Next-Cursor ヘッダで次のカーソルを返します
+@router.get("/users/", response_model=List[schemas.User])
+def read_users(
+        response: Response, skip: int = 0, limit: int = 100, cursor: str = None,
+        db: Session = Depends(get_db)
+):
+    if cursor is None:
+        return crud.get_users(db, skip=skip, limit=limit)
+    users = crud.get_users(db, limit=limit, after_id=decode_cursor(cursor))
+    cursor = next_cursor(users, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+    return users
+
+
+@router.get("/users/{user_id}", response_model=schemas.User)
+def read_user(user_id: int, db: Session = Depends(get_db)):
+    db_user = crud.get_user(db, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+
+@router.post("/users/{user_id}/items/", response_model=schemas.Item)
+def create_item_for_user(
+        user_id: int, item: schemas.ItemCreate, db: Session = Depends(get_db)
+):
+    return crud.create_user_item(db=db, item=item, user_id=user_id)
+
+
+# export=ndjson / json を指定すると全件をストリーミングで返します (skip / limit は無視します)
+@router.get("/items/", response_model=List[schemas.Item])
+def read_items(
+        response: Response, skip: int = 0, limit: int = 100, cursor: str = None,
+        export: str = Query(None, regex=EXPORT_PATTERN),
+        db: Session = Depends(get_db)
+):
+    if export:
+        return export_response(
+            crud.iter_items(db), export, lambda item: schemas.Item.from_orm(item).json()
+        )
+    if cursor is None:
+        return crud.get_items(db, skip=skip, limit=limit)
+    items = crud.get_items(db, limit=limit, after_id=decode_cursor(cursor))
+    cursor = next_cursor(items, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+    return items
@@ -0,0 +1,143 @@
+# Jinja2 テンプレートのコンパイル結果とレンダリング結果のキャッシュ
+# - バイトコードキャッシュ: コンパイル結果をディスクに保存し、ワーカーの起動時にコンパイルを省略します
+# - レンダリングキャッシュ: テンプレート名 + コンテキスト (+ url_for が使う URL) が同じなら前回の結果を返します
+#   ETag を付けて返し、If-None-Match が一致すれば 304 を返します
+#
+# デプロイ時にバイトコードを作っておく場合
+# % python template_cache.py templates
+# @see https://fastapi.tiangolo.com/advanced/templates/
+# @see https://jinja.palletsprojects.com/en/3.1.x/api/#bytecode-cache
+import argparse
+import hashlib
+import json
+import os
+import stat
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import jinja2
+from fastapi.templating import Jinja2Templates
+from starlette.responses import HTMLResponse, Response
+
+from http_cache import etag_matches, make_etag
+
+# 未指定の場合は Jinja2 の既定 (一時ディレクトリの _jinja2-cache-<uid>, 0700) を使います
+# バイトコードは読み込み時に実行されるため、他のユーザーが書き込めるディレクトリは使いません
+TEMPLATE_BYTECODE_DIR = os.getenv("TEMPLATE_BYTECODE_DIR")
+# レンダリング結果を保持する件数 (0 の場合はキャッシュしません)
+TEMPLATE_RENDER_CACHE_SIZE = int(os.getenv("TEMPLATE_RENDER_CACHE_SIZE", "1024"))
+
+
+# 指定されたディレクトリが自分の所有で、他のユーザーから読み書きできない (0700) ことを確認します
+# Jinja2 の既定のディレクトリと同じ確認です
+# @see https://github.com/pallets/jinja/blob/3.1.3/src/jinja2/bccache.py#L214
+def check_bytecode_dir(bytecode_dir: str):
+    try:
+        os.mkdir(bytecode_dir, stat.S_IRWXU)
+    except FileExistsError:
+        pass
+    actual = os.lstat(bytecode_dir)
+    if (
+            not stat.S_ISDIR(actual.st_mode)
+            or actual.st_uid != os.getuid()
+            or stat.S_IMODE(actual.st_mode) != stat.S_IRWXU
+    ):
+        raise RuntimeError(
+            "Bytecode cache directory must be a directory owned by the current user with mode 0700: %s"
+            % bytecode_dir
+        )
+
+
+def create_environment(directory: str, bytecode_dir: Optional[str] = TEMPLATE_BYTECODE_DIR) -> jinja2.Environment:
+    if bytecode_dir is None:
+        bytecode_cache = jinja2.FileSystemBytecodeCache()
+    else:
+        check_bytecode_dir(bytecode_dir)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_dir)
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(directory),
+        autoescape=True,
+        bytecode_cache=bytecode_cache,
+    )
+
+
+# すべてのテンプレートをコンパイルし、バイトコードキャッシュに保存します
+def precompile(env: jinja2.Environment):
+    for name in env.list_templates():
+        env.get_template(name)
+
+
+# レンダリングキャッシュ付きの Jinja2Templates
+# コンテキストの値は JSON にできるもの (str, int, dict など) を想定しています
+class CachedTemplates(Jinja2Templates):
+    def __init__(
+            self, directory: str, bytecode_dir: Optional[str] = TEMPLATE_BYTECODE_DIR,
+            maxsize: int = TEMPLATE_RENDER_CACHE_SIZE,
+    ):
+        super().__init__(env=create_environment(directory, bytecode_dir))
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # url_for の結果はリクエストのスキーム・ホスト・root_path で変わるため、キーに含めます
+    @staticmethod
+    def _key(name: str, context: dict) -> str:
+        request = context["request"]
+        values = {key: value for key, value in context.items() if key != "request"}
+        raw = json.dumps(
+            [name, str(request.base_url), values], sort_keys=True, default=str
+        )
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _render(self, name: str, context: dict):
+        body = self.get_template(name).render(context).encode("utf-8")
+        return body, make_etag(body)
+
+    def render_response(self, name: str, context: dict, status_code: int = 200) -> Response:
+        request = context["request"]
+        for processor in self.context_processors:
+            context.update(processor(request))
+        if self.maxsize <= 0:
+            body, etag = self._render(name, context)
+        else:
+            key = self._key(name, context)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if entry is None:
+                entry = self._render(name, context)
+                with self._lock:
+                    self._entries[key] = entry
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+            body, etag = entry
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        return HTMLResponse(body, status_code=status_code, headers={"ETag": etag})
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompile Jinja2 templates to the bytecode cache")
+    parser.add_argument("directory")
+    parser.add_argument("--bytecode-dir", default=TEMPLATE_BYTECODE_DIR)
+    args = parser.parse_args()
+    precompile(create_environment(args.directory, args.bytecode_dir))
+
+
+if __name__ == "__main__":
+    main()
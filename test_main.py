@@ -9,3 +9,613 @@ def test_read_main():
     response = client.get("/")
     assert response.status_code == 200
     assert response.json() == {"Hello": "World"}
+
+
+def get_access_token(scope="me"):
+    response = client.post(
+        "/token", data={"username": "john_doe", "password": "secret", "scope": scope}
+    )
+    assert response.status_code == 200
+    return response.json()["access_token"]
+
+
+def test_read_user_me_uses_token_cache():
+    token = get_access_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    before = client.get("/internal/token-cache").json()
+    for _ in range(3):
+        response = client.get("/users/me", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["username"] == "john_doe"
+    after = client.get("/internal/token-cache").json()
+    # レート制限のキー (RateLimitMiddleware) とルートの認証で2回ずつ参照し、検証 (jwt.decode) は最初の1回だけです
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 5
+
+
+def test_token_cache_invalidate_user():
+    from main import token_cache
+
+    headers = {"Authorization": f"Bearer {get_access_token()}"}
+    client.get("/users/me", headers=headers)
+    token_cache.invalidate_user("john_doe")
+    assert token_cache.stats()["size"] == 0
+    assert client.get("/users/me", headers=headers).status_code == 200
+
+
+def test_login_rejected_when_password_pool_is_busy():
+    from main import password_pool
+
+    max_pending = password_pool.max_pending
+    password_pool.max_pending = 0
+    try:
+        response = client.post(
+            "/token", data={"username": "john_doe", "password": "secret"}
+        )
+    finally:
+        password_pool.max_pending = max_pending
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_password_pool_counts_cancelled_jobs_until_they_finish():
+    import asyncio
+    import time
+    import pytest
+    from password_pool import PasswordPool, PasswordPoolBusy
+
+    pool = PasswordPool(workers=1, max_pending=1)
+
+    async def run():
+        # プロセスを起動しておきます
+        await pool._run(time.sleep, 0)
+        task = asyncio.ensure_future(pool._run(time.sleep, 1))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # キャンセルされてもプールではまだ実行中のため、次の処理は受け付けません
+        assert pool.pending == 1
+        with pytest.raises(PasswordPoolBusy):
+            await pool._run(time.sleep, 0)
+        for _ in range(100):
+            if pool.pending == 0:
+                break
+            await asyncio.sleep(0.05)
+        assert pool.pending == 0
+
+    try:
+        asyncio.run(run())
+    finally:
+        pool.shutdown()
+
+
+def test_create_item_fast_response():
+    item = {
+        "name": "Foo",
+        "price": 35.4,
+        "tags": ["rock", "metal", "rock"],
+        "images": [{"url": "http://example.com/baz.jpg", "name": "The Foo live"}],
+    }
+    response = client.post("/items/", json=item)
+    assert response.status_code == 201
+    body = response.json()
+    assert sorted(body.pop("tags")) == ["metal", "rock"]
+    assert body == {
+        "name": "Foo",
+        "description": None,
+        "price": 35.4,
+        "tax": None,
+        "images": [{"url": "http://example.com/baz.jpg", "name": "The Foo live"}],
+    }
+
+
+def test_create_user_fast_response_excludes_password():
+    response = client.post(
+        "/user/",
+        json={"username": "alice", "password": "secret", "email": "alice@example.com"},
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "username": "alice", "email": "alice@example.com",
+        "full_name": None, "disabled": None,
+    }
+
+
+def test_fast_response_keeps_repeated_headers():
+    from fastapi import APIRouter, FastAPI, Response
+    from pydantic import BaseModel
+    from fast_response import FastResponseRoute
+
+    class Login(BaseModel):
+        ok: bool
+
+    router = APIRouter(route_class=FastResponseRoute)
+
+    @router.get("/login", response_model=Login)
+    def login(response: Response):
+        response.set_cookie("session", "abc")
+        response.set_cookie("csrf", "xyz")
+        response.headers["X-Request-Id"] = "1"
+        return {"ok": True}
+
+    fast_app = FastAPI()
+    fast_app.include_router(router)
+    response = TestClient(fast_app).get("/login")
+    assert response.json() == {"ok": True}
+    cookies = [value for key, value in response.headers.multi_items() if key == "set-cookie"]
+    assert len(cookies) == 2
+    assert response.cookies["session"] == "abc" and response.cookies["csrf"] == "xyz"
+    assert response.headers["X-Request-Id"] == "1"
+    assert response.headers["Content-Length"] == str(len(response.content))
+
+
+def test_openapi_etag_and_compression():
+    response = client.get("/openapi.json", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.json()["info"]["title"] == "OpenAPI Custom title"
+    etag = response.headers["ETag"]
+    response = client.get(
+        "/openapi.json", headers={"Accept-Encoding": "identity", "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = client.get("/openapi.json", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] != etag
+    assert response.json()["info"]["title"] == "OpenAPI Custom title"
+
+
+def test_openapi_document_save_and_load(tmp_path):
+    from main import get_openapi_document
+    from openapi_cache import OpenAPIDocument
+
+    path = str(tmp_path / "openapi.json")
+    document = get_openapi_document()
+    document.save(path)
+    loaded = OpenAPIDocument.load(path)
+    assert loaded.etag == document.etag
+    assert loaded.schema() == document.schema()
+
+
+def test_static_precompressed_and_versioned():
+    from main import static_files
+
+    response = client.get("/static/swagger-ui.css", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Cache-Control"] == "no-cache"
+    etag = response.headers["ETag"]
+    response = client.get(
+        "/static/swagger-ui.css", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+    url = static_files.versioned_url("/static", "styles.css")
+    response = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert "immutable" in response.headers["Cache-Control"]
+    with open("static/styles.css", mode="rb") as f:
+        assert response.content == f.read()
+
+
+def test_static_precompressed_files_are_verified_and_replaced(tmp_path):
+    import gzip
+    import os
+    from precompressed_static import _Asset
+
+    path = tmp_path / "app.js"
+    path.write_bytes(b"console.log('hello');\n" * 1000)
+    # 元ファイルより新しいが内容の異なる (書き込み途中・古い内容の) 圧縮ファイルは作り直します
+    (tmp_path / "app.js.gz").write_bytes(gzip.compress(b"old"))
+    os.utime(tmp_path / "app.js.gz", (os.stat(path).st_mtime + 10,) * 2)
+    asset = _Asset(str(path), os.stat(path), memory_max_bytes=0)
+    assert asset.variants["gzip"] == str(path) + ".gz"
+    assert gzip.decompress((tmp_path / "app.js.gz").read_bytes()) == path.read_bytes()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+    assert os.stat(str(path) + ".gz").st_mode == os.stat(path).st_mode
+
+
+def test_items_template_render_cache():
+    from main import get_templates
+
+    templates = get_templates()
+
+    before = templates.stats()
+    response = client.get("/items-template/foo")
+    assert response.status_code == 200
+    assert "Item ID: foo" in response.text
+    etag = response.headers["ETag"]
+    response = client.get("/items-template/foo", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    after = templates.stats()
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 1
+
+
+def test_template_bytecode_dir_must_be_private(tmp_path):
+    import os
+    import pytest
+    from template_cache import create_environment
+
+    # 未指定の場合は Jinja2 の既定 (ユーザーごと・0700) のディレクトリを使います
+    assert create_environment("templates", None).bytecode_cache.directory.endswith(
+        "_jinja2-cache-%d" % os.getuid()
+    )
+    private = tmp_path / "private"
+    assert create_environment("templates", str(private)).bytecode_cache.directory == str(private)
+    assert os.stat(private).st_mode & 0o777 == 0o700
+    # 他のユーザーが書き込めるディレクトリや、シンボリックリンクは使いません
+    shared = tmp_path / "shared"
+    shared.mkdir(mode=0o777)
+    os.chmod(shared, 0o777)
+    link = tmp_path / "link"
+    link.symlink_to(private)
+    for directory in (shared, link):
+        with pytest.raises(RuntimeError):
+            create_environment("templates", str(directory))
+
+
+def test_metrics_records_route_template():
+    response = client.get("/items-template/metrics-test")
+    assert response.status_code == 200
+    assert float(response.headers["X-Process-Time"]) >= 0
+    body = client.get("/metrics").text
+    assert "# TYPE http_request_duration_seconds summary" in body
+    assert (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/items-template/{item_id}",status="200"}'
+    ) in body
+
+
+def test_upsert_item_if_match():
+    response = client.put("/items/store-test", json={"name": "Bar", "size": 1})
+    assert response.status_code == 201
+    etag = response.headers["ETag"]
+
+    response = client.put(
+        "/items/store-test", json={"name": "Baz", "size": 2}, headers={"If-Match": '"999"'}
+    )
+    assert response.status_code == 412
+
+    response = client.put(
+        "/items/store-test", json={"name": "Baz", "size": 2}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"name": "Baz", "size": 2}
+    new_etag = response.headers["ETag"]
+    assert new_etag != etag
+
+    response = client.get("/items-header/store-test")
+    assert response.json() == {"item": {"name": "Baz", "size": 2}}
+    assert response.headers["ETag"] == new_etag
+
+
+def test_item_store_indexes():
+    from item_store import ItemStore
+
+    store = ItemStore()
+    store.create("a", {"name": "Foo", "tags": ["rock", "metal"]})
+    store.create("b", {"name": "Foo", "tags": ["rock"]})
+    store.put("a", {"name": "Bar", "tags": ["pop"]})
+    assert [record.id for record in store.find_by_name("Foo")] == ["b"]
+    assert [record.id for record in store.find_by_name("Bar")] == ["a"]
+    assert [record.id for record in store.find_by_tag("rock")] == ["b"]
+    assert store.find_by_tag("metal") == []
+    assert store.get("a").version == 2
+
+
+def test_item_store_index_writes_do_not_copy_sets():
+    from item_store import ItemStore
+
+    store = ItemStore()
+    store.create("first", {"name": "Foo", "tags": ["shared"]})
+    before = store.find_by_tag("shared")
+    ids = store._by_tag._ids["shared"]
+    for i in range(100):
+        store.create("item%d" % i, {"name": "Foo", "tags": ["shared"]})
+    # 書き込みはキーの集合をそのまま更新し (コピーすると件数の2乗の時間がかかります)、
+    # スナップショットは次の読み込みまで作りません
+    assert store._by_tag._ids["shared"] is ids
+    assert "shared" not in store._by_tag._snapshots
+    # 読み込み済みの結果は変わらず、次の読み込みには追加分が含まれます
+    assert [record.id for record in before] == ["first"]
+    assert len(store.find_by_tag("shared")) == 101
+    store.put("first", {"tags": []})
+    assert store._by_tag._ids["shared"] is ids
+    assert len(store.find_by_tag("shared")) == 100
+
+
+def test_search_items():
+    for name, tags in [("Searchable Guitar", ["rock"]), ("Searchable Drum", ["rock", "jazz"]),
+                       ("Searchable Piano", ["jazz"])]:
+        response = client.post("/items/", json={"name": name, "price": 1.0, "tags": tags})
+        assert response.status_code == 201
+        assert response.headers["Location"].startswith("/items-header/")
+
+    response = client.get("/items/", params={"q": "searchable rock"})
+    assert sorted(item["name"] for item in response.json()["items"]) == [
+        "Searchable Drum", "Searchable Guitar"
+    ]
+
+    names = []
+    cursor = None
+    while True:
+        params = {"q": "searchab* jazz", "limit": 1}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/items/", params=params)
+        names.extend(item["name"] for item in response.json()["items"])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert sorted(names) == ["Searchable Drum", "Searchable Piano"]
+
+    assert client.get("/items/", params={"q": "rock", "cursor": "!!"}).status_code == 400
+
+
+def test_fake_video_streamer_ranges():
+    body = b"some fake video bytes" * 10
+    response = client.get("/fake-video-streamer")
+    assert response.status_code == 200
+    assert response.content == body
+    assert response.headers["Accept-Ranges"] == "bytes"
+    etag = response.headers["ETag"]
+
+    response = client.get("/fake-video-streamer", headers={"Range": "bytes=5-14"})
+    assert response.status_code == 206
+    assert response.content == body[5:15]
+    assert response.headers["Content-Range"] == "bytes 5-14/210"
+
+    response = client.get("/fake-video-streamer", headers={"Range": "bytes=-10"})
+    assert response.content == body[-10:]
+
+    response = client.get("/fake-video-streamer", headers={"Range": "bytes=0-3,10-13"})
+    assert response.status_code == 206
+    assert response.headers["Content-Type"].startswith("multipart/byteranges; boundary=")
+    assert int(response.headers["Content-Length"]) == len(response.content)
+    assert b"Content-Range: bytes 0-3/210\r\n\r\nsome\r\n" in response.content
+    assert b"Content-Range: bytes 10-13/210\r\n\r\nvide\r\n" in response.content
+
+    response = client.get("/fake-video-streamer", headers={"Range": "bytes=0-3", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    response = client.get("/fake-video-streamer", headers={"Range": "bytes=0-3", "If-Range": etag})
+    assert response.status_code == 206
+
+    response = client.get("/fake-video-streamer", headers={"Range": "bytes=500-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == "bytes */210"
+
+
+def test_response_cache_etag_and_invalidate():
+    from main import response_cache
+
+    response_cache.clear()
+    response = client.get("/model/alexnet")
+    etag = response.headers["ETag"]
+    assert client.get("/model/alexnet").json() == response.json()
+    assert response_cache.stats()["hits"] >= 1
+    response = client.get("/model/alexnet", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    response = client.get("/items/", headers={"User-Agent": "agent-a"})
+    assert response.headers["Vary"] == "User-Agent"
+    assert client.get("/items/", headers={"User-Agent": "agent-b"}).json()["User-Agent"] == "agent-b"
+
+    client.put("/items/cached", json={"name": "Before"})
+    assert client.get("/items-header/cached").json()["item"]["name"] == "Before"
+    client.put("/items/cached", json={"name": "After"})
+    assert client.get("/items-header/cached").json()["item"]["name"] == "After"
+
+
+def test_batch_requests():
+    headers = {"Authorization": f"Bearer {get_access_token()}"}
+    response = client.post("/batch", headers=headers, json={"requests": [
+        {"path": "/users/me"},
+        {"path": "/users/me/items/"},
+        {"path": "/items/5?limit=2"},
+        {"method": "PUT", "path": "/items/batched", "body": {"name": "Batched"}},
+        {"path": "/fake-video-streamer", "headers": {"Range": "bytes=0-3"}},
+        {"path": "/no-such-path"},
+    ]})
+    assert response.status_code == 200
+    results = response.json()
+    assert [r["status"] for r in results] == [200, 200, 200, 201, 206, 404]
+    assert results[0]["body"]["username"] == "john_doe"
+    assert results[2]["body"] == {"item_id": 5, "limit": 2}
+    assert results[3]["headers"]["etag"] == '"1"'
+    assert results[4]["body"] == "some"
+
+    response = client.post("/batch", json={"requests": [{"path": "/users/me"}]})
+    assert response.json()[0]["status"] == 401
+    response = client.post("/batch", headers={"Authorization": "Bearer invalid"},
+                           json={"requests": [{"path": "/"}]})
+    assert response.status_code == 401
+    assert client.post("/batch", json={"requests": [{"path": "/batch"}]}).status_code == 422
+    assert client.post("/batch", json={"requests": [{"path": "/"}] * 21}).status_code == 422
+
+
+def test_batch_timeout():
+    import asyncio
+    from batch import SubRequest, dispatch_batch
+
+    async def slow_app(scope, receive, send):
+        await asyncio.sleep(10)
+
+    parent = {"headers": []}
+    body = asyncio.run(dispatch_batch(slow_app, parent, [SubRequest(path="/")], timeout=0.01))
+    assert body.startswith(b'[{"status": 504')
+
+
+def test_batch_sub_response_errors_and_encoding():
+    import asyncio
+    import json
+    from batch import SubRequest, dispatch_batch
+    from main import OPENAPI_URL
+
+    # レスポンスを開始せずに終了したサブリクエストは、そのエントリだけ 500 になります
+    async def silent_app(scope, receive, send):
+        return
+
+    body = asyncio.run(dispatch_batch(silent_app, {"headers": []}, [SubRequest(path="/")]))
+    assert json.loads(body)[0]["status"] == 500
+
+    # ボディの途中で失敗した場合も、途中までのボディは埋め込まずに 500 になります
+    async def broken_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b'{"items": [1, ', "more_body": True})
+        raise RuntimeError("broken")
+
+    body = asyncio.run(dispatch_batch(broken_app, {"headers": []}, [SubRequest(path="/")]))
+    assert json.loads(body) == [{"status": 500, "headers": {}, "body": {"detail": "Internal Server Error"}}]
+
+    # パスのパラメータは直接のリクエストと同じくデコードされます
+    headers = {"Authorization": f"Bearer {get_access_token()}"}
+    response = client.post("/batch", headers=headers, json={"requests": [{"path": "/users/a%20b"}]})
+    assert response.json()[0]["body"] == client.get("/users/a%20b").json() == {"user_id": "a b"}
+
+    # Accept-Encoding は除くため、gzip に対応したルートでも JSON のまま埋め込まれます
+    headers = {"Authorization": f"Bearer {get_access_token()}", "Accept-Encoding": "gzip"}
+    response = client.post("/batch", headers=headers, json={"requests": [
+        {"path": OPENAPI_URL, "headers": {"Accept-Encoding": "gzip"}},
+    ]})
+    result = response.json()[0]
+    assert "content-encoding" not in result["headers"]
+    assert "openapi" in result["body"]
+
+
+def test_rate_limit_returns_429_with_retry_after():
+    from main import rate_limiter
+    from rate_limit import MemoryBackend
+
+    rate_limiter.backend = MemoryBackend()
+    for _ in range(10):
+        client.post("/token", data={"username": "nobody", "password": "x"})
+    response = client.post("/token", data={"username": "nobody", "password": "x"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert client.get("/").status_code == 200
+    rate_limiter.backend = MemoryBackend()
+
+
+def test_rate_limit_keys_on_verified_token_only():
+    import base64
+    import json
+    from main import rate_limiter
+
+    key_func = next(rule.key_func for rule in rate_limiter.rules if rule.name == "api")
+
+    def scope(token):
+        headers = [(b"authorization", b"Bearer " + token.encode())]
+        return {"type": "http", "client": ("10.0.0.1", 1234), "headers": headers}
+
+    assert key_func(scope(get_access_token())) == "sub:john_doe"
+    # 署名の無い (偽造した) トークンの sub は使わず、IP ごとのバケットになります
+    payload = base64.urlsafe_b64encode(json.dumps({"sub": "alice"}).encode()).decode().rstrip("=")
+    assert key_func(scope("e30." + payload + ".forged")) == "ip:10.0.0.1"
+
+
+def test_concurrency_limiter_prefers_high_priority():
+    import asyncio
+    from rate_limit import PRIORITY_BULK, PRIORITY_NORMAL, ConcurrencyLimiter
+
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=1, max_wait=1)
+        assert await limiter.acquire(PRIORITY_NORMAL)
+        bulk = asyncio.ensure_future(limiter.acquire(PRIORITY_BULK))
+        await asyncio.sleep(0)
+        normal = asyncio.ensure_future(limiter.acquire(PRIORITY_NORMAL))
+        await asyncio.sleep(0)
+        # 待ち行列が一杯のため、優先度の低い bulk が追い出されます
+        assert await bulk is False
+        limiter.release()
+        assert await normal is True
+        # 待ち時間の上限を超えると False (503) になります
+        limiter.max_wait = 0.01
+        assert await limiter.acquire(PRIORITY_NORMAL) is False
+        assert limiter.waiting == 0
+
+    asyncio.run(scenario())
+
+
+def test_concurrency_limiter_cancelled_waiter_releases_slot():
+    import asyncio
+    from rate_limit import PRIORITY_NORMAL, ConcurrencyLimiter
+
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=4, max_wait=1)
+        assert await limiter.acquire(PRIORITY_NORMAL)
+        # 待っている間にキャンセルされた場合
+        waiter = asyncio.ensure_future(limiter.acquire(PRIORITY_NORMAL))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert limiter.waiting == 0
+        limiter.release()
+        assert (limiter.active, limiter.waiting) == (0, 0)
+        # release で枠を渡された直後 (再開する前) にキャンセルされた場合
+        assert await limiter.acquire(PRIORITY_NORMAL)
+        waiter = asyncio.ensure_future(limiter.acquire(PRIORITY_NORMAL))
+        await asyncio.sleep(0)
+        limiter.release()
+        waiter.cancel()
+        result, = await asyncio.gather(waiter, return_exceptions=True)
+        if result is True:
+            # Python のバージョンによっては wait_for がキャンセルより結果を優先します (その場合は枠を持っています)
+            limiter.release()
+        assert (limiter.active, limiter.waiting) == (0, 0)
+        assert await limiter.acquire(PRIORITY_NORMAL)
+
+    asyncio.run(scenario())
+
+
+def test_launcher_recycles_workers_and_reports_stats(tmp_path):
+    import json
+    import os
+    import signal
+    import socket
+    import subprocess
+    import sys
+    import time
+
+    import httpx
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    stats_file = str(tmp_path / "stats.json")
+    server = subprocess.Popen(
+        [sys.executable, "launcher.py", "sql_app.main:app", "--port", str(port), "--workers", "2",
+         "--max-requests", "5", "--stats-interval", "0.2", "--stats-file", stats_file, "--no-access-log"],
+        env=dict(os.environ, ELASTIC_APM_ENABLED="false"), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            try:
+                httpx.get("http://127.0.0.1:%d/internal/pool-stats" % port)
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        # max-requests を超えたワーカーが入れ替わっても、リクエストは失敗しません
+        for _ in range(19):
+            assert httpx.get("http://127.0.0.1:%d/internal/pool-stats" % port).status_code == 200
+    finally:
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=30) == 0
+    with open(stats_file) as f:
+        workers = json.load(f)["workers"]
+    assert len(workers) == 2
+    assert sum(worker["requests"] for worker in workers) == 20
+    assert sum(worker["restarts"] for worker in workers) >= 1
+
+
+def test_launcher_keeps_main_app_to_one_worker():
+    from launcher import Launcher
+
+    # main.py は状態をプロセスのメモリに持つため、複数ワーカーを指定しても1ワーカーになります
+    launcher = Launcher(app, workers=4)
+    launcher.limit_workers()
+    assert launcher.workers == 1
+    assert len(launcher.counters) == 1
@@ -0,0 +1,252 @@
+import asyncio
+import json
+from contextlib import contextmanager
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from sql_app import async_crud, models, schemas
+from sql_app.main import app, get_db
+
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+models.Base.metadata.create_all(bind=engine)
+
+
+def override_get_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+# ブロック内で発行された SQL が上限以下であることを検証します (N+1 の検出用)
+@contextmanager
+def assert_max_queries(expected: int):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert len(statements) <= expected, "\n".join(statements)
+
+
+def create_users_with_items(prefix: str, count: int):
+    for i in range(count):
+        user = client.post(
+            "/users/", json={"email": f"{prefix}-{i}@example.com", "password": "secret"}
+        ).json()
+        client.post(
+            f"/users/{user['id']}/items/", json={"title": f"Item {i}"}
+        )
+
+
+def test_read_users_without_n_plus_one():
+    create_users_with_items("users", 5)
+    # users 1回 + items (selectinload) 1回 / joinedload なら1回
+    with assert_max_queries(2):
+        response = client.get("/users/")
+    assert response.status_code == 200
+    assert all(len(user["items"]) >= 1 for user in response.json())
+
+
+def test_read_user_without_n_plus_one():
+    create_users_with_items("user", 1)
+    user_id = client.get("/users/").json()[-1]["id"]
+    with assert_max_queries(2):
+        response = client.get(f"/users/{user_id}")
+    assert response.status_code == 200
+    assert response.json()["items"][0]["owner_id"] == user_id
+
+
+def test_cursor_pagination():
+    create_users_with_items("cursor", 7)
+    for path in ("/users/", "/items/"):
+        expected = [row["id"] for row in client.get(path, params={"limit": 1000}).json()]
+        # X-Next-Cursor ヘッダを辿って全ページを読み込みます
+        ids = []
+        pages = 0
+        cursor = ""
+        while cursor is not None:
+            response = client.get(path, params={"limit": 3, "cursor": cursor})
+            assert response.status_code == 200
+            page = [row["id"] for row in response.json()]
+            assert len(page) <= 3
+            ids.extend(page)
+            pages += 1
+            cursor = response.headers.get("X-Next-Cursor")
+        assert ids == sorted(expected)
+        assert pages == len(expected) // 3 + 1
+        # offset 指定の場合はカーソルを返しません
+        assert "X-Next-Cursor" not in client.get(path, params={"limit": 3}).headers
+        for cursor in ("!!!", "bm90LWFuLWlk"):
+            assert client.get(path, params={"cursor": cursor}).status_code == 400
+
+
+def test_no_session_for_routes_without_orm(monkeypatch):
+    from sql_app import dependencies
+
+    # 本物の get_db (request.state.db に遅延作成) を、テスト用のエンジンで使います
+    monkeypatch.setattr(dependencies, "SessionLocal", TestingSessionLocal)
+    monkeypatch.delitem(app.dependency_overrides, get_db)
+    checkouts = []
+    states = []
+
+    def count(dbapi_connection, connection_record, connection_proxy):
+        checkouts.append(connection_record)
+
+    # リクエスト後の scope["state"] (request.state) を記録します
+    async def probe(scope, receive, send):
+        await app(scope, receive, send)
+        states.append(dict(scope.get("state", {})))
+
+    probe_client = TestClient(probe)
+    event.listen(engine, "checkout", count)
+    try:
+        assert probe_client.get("/not-found").status_code == 404
+        assert "db" not in states[-1]
+        assert checkouts == []
+        assert probe_client.get("/users/").status_code == 200
+        assert "db" in states[-1]
+        assert len(checkouts) == 1
+    finally:
+        event.remove(engine, "checkout", count)
+
+
+def test_async_crud():
+    async def run():
+        async_engine = create_async_engine("sqlite+aiosqlite://")
+        async with async_engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+        make_session = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+        async with make_session() as db:
+            user = await async_crud.create_user(
+                db, schemas.UserCreate(email="async@example.com", password="secret")
+            )
+            # 作成直後のユーザーも遅延読み込みなしでシリアライズ出来ること
+            assert schemas.User.from_orm(user).items == []
+            await async_crud.create_user_item(db, schemas.ItemCreate(title="Async"), user.id)
+        async with make_session() as db:
+            users = await async_crud.get_users(db)
+        await async_engine.dispose()
+        return users
+
+    users = asyncio.run(run())
+    assert [item.title for item in users[0].items] == ["Async"]
+
+
+def test_create_notes_bulk():
+    with TestClient(app) as notes_client:
+        response = notes_client.post(
+            "/notes/bulk",
+            json=[{"text": "bulk 1", "completed": False}, {"text": "bulk 2", "completed": True}],
+        )
+        assert response.status_code == 200
+        ids = response.json()["ids"]
+        assert len(ids) == 2
+        texts = {note["id"]: note["text"] for note in notes_client.get("/notes/").json()}
+        assert [texts[i] for i in ids] == ["bulk 1", "bulk 2"]
+
+
+def test_create_notes_bulk_ndjson_stream():
+    body = "".join(
+        '{"text": "stream %d", "completed": false}\n' % i for i in range(1200)
+    )
+    with TestClient(app) as notes_client:
+        response = notes_client.post(
+            "/notes/bulk?stream=true",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        assert response.status_code == 200
+        assert len(set(response.json()["ids"])) == 1200
+
+
+def test_create_notes_bulk_invalid_rolls_back():
+    with TestClient(app) as notes_client:
+        before = len(notes_client.get("/notes/").json())
+        response = notes_client.post(
+            "/notes/bulk?stream=true",
+            json=[{"text": "ok", "completed": False}, {"text": "missing completed"}],
+        )
+        assert response.status_code == 422
+        assert len(notes_client.get("/notes/").json()) == before
+
+
+def test_read_notes_export_ndjson():
+    with TestClient(app) as notes_client:
+        notes_client.post("/notes/", json={"text": "export", "completed": True})
+        response = notes_client.get("/notes/?export=ndjson")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert lines == notes_client.get("/notes/").json()
+
+
+def test_read_items_export_json():
+    create_users_with_items("export", 2)
+    response = client.get("/items/?export=json")
+    assert response.status_code == 200
+    assert response.json() == client.get("/items/?limit=1000").json()
+
+
+def test_apm_middleware_is_outermost():
+    from elasticapm.contrib.starlette import ElasticAPM
+
+    # BaseHTTPMiddleware より内側にあるとトランザクションが終了されません
+    assert app.user_middleware[0].cls is ElasticAPM
+
+
+def test_apm_helpers_are_in_sync():
+    # code/ は単独で起動するため sql_app/apm.py を import できず、同じ内容のコピーを持ちます
+    with open("sql_app/apm.py") as f, open("code/apm.py") as g:
+        assert f.read() == g.read()
+
+
+def test_code_update_users_bulk(monkeypatch):
+    # code/ のモジュールは code/ をカレントディレクトリとして `from db import ...` の形で import します
+    monkeypatch.syspath_prepend("code")
+    import crud
+    from db import Base as CodeBase
+    from model import User, UserTable
+
+    code_engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    CodeBase.metadata.create_all(bind=code_engine)
+    CodeSession = sessionmaker(autocommit=False, autoflush=False, bind=code_engine)
+    with CodeSession() as db:
+        db.add_all([UserTable(id=i, name="user%d" % i, age=20 + i) for i in (1, 2, 3)])
+        db.commit()
+
+    users = [
+        User(id=3, name="carol", age=33),
+        User(id=404, name="nobody", age=0),
+        User(id=1, name="alice", age=11),
+        User(id=405, name="nobody", age=0),
+    ]
+    with CodeSession() as db:
+        # チャンクの境界をまたいでも、結果はリクエストの順に返します
+        results = crud.update_users(db, users, chunk_size=3)
+    assert [(result.id, result.status) for result in results] == [
+        (3, "updated"), (404, "missing"), (1, "updated"), (405, "missing"),
+    ]
+    with CodeSession() as db:
+        stored = {user.id: (user.name, user.age) for user in db.query(UserTable)}
+    assert stored == {1: ("alice", 11), 2: ("user2", 22), 3: ("carol", 33)}
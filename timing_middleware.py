@@ -0,0 +1,153 @@
+# リクエストの処理時間を計測する ASGI ミドルウェア
+# @app.middleware("http") (BaseHTTPMiddleware) はリクエストごとにタスクとメモリストリームを経由し、
+# StreamingResponse も一旦受け渡しが必要になるため、send をラップするだけの純粋な ASGI ミドルウェアにしています
+# - 計測には単調増加の time.perf_counter_ns を使います
+# - ルート (パスのテンプレート) ごとにヒストグラムへ記録し、/metrics で Prometheus のテキスト形式で返します
+# - X-Process-Time ヘッダ (レスポンス開始までの秒数) は header=True の場合のみ付けます
+# @see https://asgi.readthedocs.io/en/latest/specs/www.html
+# @see https://prometheus.io/docs/instrumenting/exposition_formats/
+import math
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# 1オクターブ (2倍) あたりのバケット数 = 2 ** SUB_BUCKET_BITS (相対誤差は 1/16 以下)
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+# HDR Histogram と同様の対数・線形バケットのヒストグラム (単位はマイクロ秒)
+# イベントループ上からのみ呼び出すため、ロックは使いません
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(value: int) -> int:
+        if value < 2 * SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        return SUB_BUCKETS * (shift + 1) + (value >> shift) - SUB_BUCKETS
+
+    @staticmethod
+    def _upper_bound(index: int) -> int:
+        if index < 2 * SUB_BUCKETS:
+            return index
+        shift = index // SUB_BUCKETS - 1
+        top = index % SUB_BUCKETS + SUB_BUCKETS
+        return ((top + 1) << shift) - 1
+
+    def record(self, value: int):
+        index = self._index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> int:
+        if self.count == 0:
+            return 0
+        target = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# (method, route, status) ごとのヒストグラム
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+
+    def record(self, method: str, route: str, status: int, microseconds: int):
+        key = (method, route, status)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+        histogram.record(microseconds)
+
+    def render_prometheus(self) -> str:
+        name = "http_request_duration_seconds"
+        lines = [
+            "# HELP %s Time until the last byte of the response was sent." % name,
+            "# TYPE %s summary" % name,
+        ]
+        max_lines = [
+            "# HELP %s_max Slowest request since start." % name,
+            "# TYPE %s_max gauge" % name,
+        ]
+        for (method, route, status), histogram in sorted(self.histograms.items()):
+            labels = 'method="%s",route="%s",status="%d"' % (_escape(method), _escape(route), status)
+            for q in QUANTILES:
+                lines.append('%s{%s,quantile="%s"} %.6f' % (name, labels, q, histogram.quantile(q) / 1e6))
+            lines.append("%s_sum{%s} %.6f" % (name, labels, histogram.total / 1e6))
+            lines.append("%s_count{%s} %d" % (name, labels, histogram.count))
+            max_lines.append("%s_max{%s} %.6f" % (name, labels, histogram.max / 1e6))
+        return "\n".join(lines + max_lines) + "\n"
+
+
+# ルートのラベル (パスの値ごとに増えないよう、テンプレートを使います)
+def _route_label(scope: Scope, root_path: str) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Mount (例: /static) はマウント先のパス
+    if scope.get("root_path", "") != root_path:
+        return scope["root_path"][len(root_path):]
+    return "unmatched"
+
+
+class TimingMiddleware:
+    def __init__(self, app: ASGIApp, metrics: Metrics, header: bool = False):
+        self.app = app
+        self.metrics = metrics
+        self.header = header
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter_ns()
+        root_path = scope.get("root_path", "")
+        status = 500
+        recorded = False
+
+        def record():
+            nonlocal recorded
+            recorded = True
+            elapsed = (time.perf_counter_ns() - start) // 1000
+            self.metrics.record(scope["method"], _route_label(scope, root_path), status, elapsed)
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.header:
+                    elapsed = (time.perf_counter_ns() - start) / 1e9
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-process-time", str(elapsed).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+            elif message["type"] == "http.response.pathsend":
+                record()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not recorded:
+                record()
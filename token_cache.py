@@ -0,0 +1,82 @@
+# アクセストークンの検証結果のキャッシュ
+# 同じトークンで何度もアクセスされる場合に、jwt.decode (HMAC の計算) と
+# TokenData / UserInDB の生成を省略します
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+# LRU + TTL のキャッシュ
+# - キーはトークンの SHA-256 (トークン自体はメモリに保持しません)
+# - エントリの有効期限は TTL とトークンの exp の早い方
+# - invalidate_user でユーザー単位に破棄できます (ユーザーを無効化した場合など)
+class TokenCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, username, value = entry
+            if expires_at <= time.time():
+                self._remove(key, username)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # exp はトークンの有効期限 (UNIX 時間)
+    def set(self, token: str, username: str, value, exp: float = None):
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        key = self._key(token)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key, self._entries[key][1])
+            self._entries[key] = (expires_at, username, value)
+            self._keys_by_user.setdefault(username, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                old_key, (_, old_username, _) = self._entries.popitem(last=False)
+                self._discard_user_key(old_key, old_username)
+
+    def invalidate_user(self, username: str):
+        with self._lock:
+            for key in self._keys_by_user.pop(username, set()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, key: str, username: str):
+        self._entries.pop(key, None)
+        self._discard_user_key(key, username)
+
+    def _discard_user_key(self, key: str, username: str):
+        keys = self._keys_by_user.get(username)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[username]